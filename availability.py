@@ -0,0 +1,88 @@
+# availability.py
+import bisect
+from datetime import datetime, time, timedelta
+
+import config
+import google_calendar
+from dates import JST
+from event_store import event_span
+
+# 空き時間を探す1日の時間帯 (JST)
+DAY_START = time(9, 0)
+DAY_END = time(22, 0)
+# これより短い空き時間は表示しない
+MIN_SLOT = timedelta(minutes=30)
+
+
+def merge_intervals(intervals):
+    """(開始, 終了) の区間を開始時刻順に並べ、重なる区間・接する区間を1つにまとめます (sort-and-sweep)。"""
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+def free_intervals(busy, start, end, ends=None):
+    """
+    まとめ済みの busy (merge_intervals の結果) に含まれない start〜end の区間を返します。
+    ends (busy の終了時刻のリスト) を渡すと、二分探索で関係のある区間から調べ始めます。
+    """
+    if ends is None:
+        ends = [busy_end for _, busy_end in busy]
+    free = []
+    cursor = start
+    for busy_start, busy_end in busy[bisect.bisect_right(ends, start):]:
+        if busy_start >= end:
+            break
+        if busy_start > cursor:
+            free.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if cursor < end:
+        free.append((cursor, end))
+    return free
+
+def daily_free_slots(busy, start_day, end_day, day_start=DAY_START, day_end=DAY_END, min_slot=MIN_SLOT):
+    """start_day から end_day の前日までの各日について、(日付, その日の空き時間のリスト) を返します。"""
+    busy = merge_intervals(busy)
+    ends = [busy_end for _, busy_end in busy]
+    days = []
+    day = start_day
+    while day < end_day:
+        window_start = datetime.combine(day, day_start, tzinfo=JST)
+        window_end = datetime.combine(day, day_end, tzinfo=JST)
+        slots = [slot for slot in free_intervals(busy, window_start, window_end, ends) if slot[1] - slot[0] >= min_slot]
+        days.append((day, slots))
+        day += timedelta(days=1)
+    return days
+
+def _parse_instant(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(JST)
+
+async def collect_busy(calendar, user_ids, time_min, time_max):
+    """
+    user_ids のうち誰かに予定が入っている時間帯を (区間のリスト, 確認できなかったカレンダーのリスト) で返します。
+    共有カレンダーの予定 (終日の予定は freebusy では busy にならない) はミラーまたは一覧取得から、
+    本人が追加した予定と追加者の分からない予定だけを使います。個人カレンダーは freebusy の1回のリクエストでまとめて問い合わせます。
+    """
+    events, error = await google_calendar.list_events_in_range(time_min, time_max, calendar=calendar)
+    if events is None:
+        raise RuntimeError(error)
+    participants = set(user_ids) | {None}
+    busy = [event_span(event) for event in events if google_calendar.event_creator(event) in participants]
+
+    user_calendars = config.get_user_calendars()
+    calendar_ids = list(dict.fromkeys(user_calendars[user_id] for user_id in user_ids if user_id in user_calendars))
+    unavailable = []
+    if calendar_ids:
+        result = await calendar.api.query_freebusy(time_min, time_max, calendar_ids)
+        for calendar_id, entry in result.get('calendars', {}).items():
+            if entry.get('errors'):
+                unavailable.append(calendar_id) # 共有されていないなど
+                continue
+            busy.extend((_parse_instant(block['start']), _parse_instant(block['end'])) for block in entry.get('busy', []))
+    return busy, unavailable
@@ -0,0 +1,220 @@
+# bench/fake_calendar.py
+"""
+ベンチマーク用のGoogle Calendar v3 代替サーバー (aiohttp.web)。
+events の insert / list (ページングとsyncToken) / get / patch / delete と、バッチエンドポイントを実装します。
+応答遅延とエラー (429 / 503) を任意の割合で注入できます。
+"""
+import asyncio
+import itertools
+import json
+import random
+import uuid
+from urllib.parse import parse_qsl, unquote
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+JST = timezone(timedelta(hours=9))
+API_PREFIX = "/calendar/v3"
+BATCH_PATH = "/batch/calendar/v3"
+
+
+def _event_bounds(event):
+    start = event.get("start", {})
+    end = event.get("end", {})
+    if "date" in start:
+        start_dt = datetime.strptime(start["date"], "%Y-%m-%d").replace(tzinfo=JST)
+        end_dt = datetime.strptime(end.get("date", start["date"]), "%Y-%m-%d").replace(tzinfo=JST)
+        if end_dt <= start_dt:
+            end_dt = start_dt + timedelta(days=1)
+        return start_dt, end_dt
+    return datetime.fromisoformat(start["dateTime"]), datetime.fromisoformat(end["dateTime"])
+
+def _error(status, message, reason="backendError"):
+    body = {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+    return status, body
+
+
+class FakeCalendar:
+    """1つのプロセス内で複数のカレンダーを保持する、インメモリのCalendar APIの代替。"""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, rate_limit_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate # 503を返す割合
+        self.rate_limit_rate = rate_limit_rate # 403 rateLimitExceeded を返す割合
+        self.request_count = 0
+        self._calendars = {} # カレンダーID -> {イベントID: イベント}
+        self._changes = {} # カレンダーID -> [(連番, イベントID)]
+        self._seq = itertools.count(1)
+        self._seq_now = 0
+
+    # --- ストレージ操作 (HTTPに依存しない) ---
+
+    def _events(self, calendar_id):
+        return self._calendars.setdefault(calendar_id, {})
+
+    def _touch(self, calendar_id, event):
+        self._seq_now = next(self._seq)
+        event["etag"] = f'"{self._seq_now}"'
+        event["updated"] = datetime.now(timezone.utc).isoformat()
+        self._changes.setdefault(calendar_id, []).append((self._seq_now, event["id"]))
+
+    def insert(self, calendar_id, body):
+        events = self._events(calendar_id)
+        event_id = body.get("id") or uuid.uuid4().hex
+        if event_id in events and events[event_id].get("status") != "cancelled":
+            return _error(409, "The requested identifier already exists.", "duplicate")
+        event = dict(body, id=event_id, status="confirmed", htmlLink=f"https://calendar.example/event?eid={event_id}")
+        events[event_id] = event
+        self._touch(calendar_id, event)
+        return 200, event
+
+    def get(self, calendar_id, event_id):
+        event = self._events(calendar_id).get(event_id)
+        if event is None:
+            return _error(404, "Not Found", "notFound")
+        return 200, event
+
+    def patch(self, calendar_id, event_id, body, if_match=None):
+        event = self._events(calendar_id).get(event_id)
+        if event is None or event.get("status") == "cancelled":
+            return _error(404, "Not Found", "notFound")
+        if if_match and if_match != event["etag"]:
+            return _error(412, "Precondition Failed", "conditionNotMet")
+        event.update(body)
+        self._touch(calendar_id, event)
+        return 200, event
+
+    def delete(self, calendar_id, event_id, if_match=None):
+        event = self._events(calendar_id).get(event_id)
+        if event is None or event.get("status") == "cancelled":
+            return _error(410, "Resource has been deleted", "deleted")
+        if if_match and if_match != event["etag"]:
+            return _error(412, "Precondition Failed", "conditionNotMet")
+        event["status"] = "cancelled"
+        self._touch(calendar_id, event)
+        return 204, None
+
+    def list(self, calendar_id, params):
+        events = self._events(calendar_id)
+        max_results = min(int(params.get("maxResults", 250)), 2500)
+        offset = int(params.get("pageToken", 0))
+        sync_token = params.get("syncToken")
+        if sync_token is not None:
+            since = int(sync_token)
+            if since < self._seq_now - 100000:
+                return _error(410, "Sync token is no longer valid, a full sync is required.", "fullSyncRequired")
+            changed_ids = dict.fromkeys(event_id for seq, event_id in self._changes.get(calendar_id, []) if seq > since)
+            items = [events[event_id] for event_id in changed_ids]
+        else:
+            items = [event for event in events.values() if event.get("status") != "cancelled" or params.get("showDeleted") == "true"]
+            if "timeMin" in params or "timeMax" in params:
+                time_min = datetime.fromisoformat(params["timeMin"]) if "timeMin" in params else None
+                time_max = datetime.fromisoformat(params["timeMax"]) if "timeMax" in params else None
+                filtered = []
+                for event in items:
+                    start_dt, end_dt = _event_bounds(event)
+                    if (time_max is None or start_dt < time_max) and (time_min is None or end_dt > time_min):
+                        filtered.append(event)
+                items = filtered
+            if params.get("orderBy") == "startTime":
+                items.sort(key=lambda event: _event_bounds(event)[0])
+        page = items[offset:offset + max_results]
+        result = {"kind": "calendar#events", "items": page}
+        if offset + max_results < len(items):
+            result["nextPageToken"] = str(offset + max_results)
+        elif "timeMin" not in params and "timeMax" not in params:
+            result["nextSyncToken"] = str(self._seq_now)
+        return 200, result
+
+    # --- HTTP ---
+
+    async def _delay(self):
+        self.request_count += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def _injected_error(self):
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return _error(403, "Rate Limit Exceeded", "rateLimitExceeded")
+        if roll < self.rate_limit_rate + self.error_rate:
+            return _error(503, "Backend Error", "backendError")
+        return None
+
+    def _dispatch(self, method, path, params, body, headers):
+        """1件分のリクエストを処理して (ステータス, 本文) を返します。"""
+        injected = self._injected_error()
+        if injected:
+            return injected
+        parts = path[len(API_PREFIX):].strip("/").split("/")
+        if len(parts) < 3 or parts[0] != "calendars" or parts[2] != "events":
+            return _error(404, "Not Found", "notFound")
+        calendar_id = parts[1]
+        event_id = parts[3] if len(parts) > 3 else None
+        if_match = headers.get("If-Match")
+        if event_id is None and method == "POST":
+            return self.insert(calendar_id, body or {})
+        if event_id is None and method == "GET":
+            return self.list(calendar_id, params)
+        if method == "GET":
+            return self.get(calendar_id, event_id)
+        if method == "PATCH":
+            return self.patch(calendar_id, event_id, body or {}, if_match)
+        if method == "DELETE":
+            return self.delete(calendar_id, event_id, if_match)
+        return _error(405, "Method Not Allowed")
+
+    async def handle_api(self, request):
+        await self._delay()
+        body = await request.json() if request.can_read_body else None
+        status, data = self._dispatch(request.method, request.path, dict(request.query), body, request.headers)
+        if data is None:
+            return web.Response(status=status)
+        return web.json_response(data, status=status)
+
+    async def handle_batch(self, request):
+        await self._delay()
+        boundary = request.headers["Content-Type"].split("boundary=", 1)[1].strip('"')
+        raw = (await request.read()).decode("utf-8")
+        out_boundary = f"batch_{uuid.uuid4().hex}"
+        out = []
+        for part in raw.split(f"--{boundary}"):
+            part = part.strip()
+            if not part or part == "--":
+                continue
+            outer, _, inner = part.replace("\r\n", "\n").partition("\n\n")
+            content_id = next((line.split(":", 1)[1].strip() for line in outer.split("\n") if line.lower().startswith("content-id")), "<item-0>")
+            inner_head, _, inner_body = inner.partition("\n\n")
+            request_line, *header_lines = inner_head.split("\n")
+            method, target, _ = request_line.split(" ", 2)
+            path, _, query = target.partition("?")
+            path = unquote(path)
+            params = dict(parse_qsl(query))
+            headers = dict(line.split(": ", 1) for line in header_lines if ": " in line)
+            body = json.loads(inner_body) if inner_body.strip() else None
+            status, data = self._dispatch(method, path, params, body, headers)
+            out.append(
+                f"--{out_boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status} X\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(data) if data is not None else ''}\r\n"
+            )
+        out.append(f"--{out_boundary}--\r\n")
+        return web.Response(body="".join(out).encode("utf-8"), headers={"Content-Type": f"multipart/mixed; boundary={out_boundary}"})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_route("POST", BATCH_PATH, self.handle_batch)
+        app.router.add_route("*", API_PREFIX + "/{tail:.*}", self.handle_api)
+        return app
+
+
+async def start_server(fake, host="127.0.0.1", port=0):
+    """代替サーバーを起動し、(runner, ベースURL) を返します。"""
+    runner = web.AppRunner(fake.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    actual_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{actual_port}"
@@ -0,0 +1,120 @@
+# bench/fake_discord.py
+"""
+ベンチマーク用の discord.Interaction の代替。
+commands/*.py のハンドラが使う属性 (response.defer / followup.send / user / channel / namespace) だけを実装し、
+送信されたメッセージと時刻を記録します。
+"""
+import asyncio
+import itertools
+import time
+
+_message_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, user_id, display_name):
+        self.id = user_id
+        self.display_name = display_name
+        self.name = display_name
+
+
+class FakeMessage:
+    def __init__(self, content=None, embed=None, view=None, file=None):
+        self.id = next(_message_ids)
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.file = file
+        self.created_at = time.perf_counter()
+
+    async def edit(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+class FakeChannel:
+    """チャンネルへの送信を記録します (通知の送信先)。"""
+
+    def __init__(self, channel_id=1):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(content, kwargs.get("embed"), kwargs.get("view"), kwargs.get("file"))
+        self.sent.append(message)
+        return message
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self.deferred_at = None
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self.deferred_at = time.perf_counter()
+
+    def is_done(self):
+        return self.deferred_at is not None
+
+
+class FakeFollowup:
+    """interaction.followup (Webhook) の代替。"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def send(self, content=None, *, ephemeral=False, wait=False, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency) # Discordへの往復時間を模擬
+        message = FakeMessage(content, kwargs.get("embed"), kwargs.get("view"), kwargs.get("file"))
+        message.ephemeral = ephemeral
+        self.sent.append(message)
+        return message
+
+    async def edit_message(self, message_id, **kwargs):
+        for message in self.sent:
+            if message.id == message_id:
+                await message.edit(**kwargs)
+                return message
+
+
+class FakeNamespace:
+    """オートコンプリートで参照される interaction.namespace の代替。"""
+
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+    def __getattr__(self, name):
+        return None
+
+
+class FakeInteraction:
+    def __init__(self, user, channel, guild_id=None, followup_latency=0.0, **options):
+        self.id = next(_message_ids)
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = guild_id
+        self.application_id = 0
+        self.token = f"fake-token-{self.id}"
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(followup_latency)
+        self.namespace = FakeNamespace(**options)
+        self.created_at = time.perf_counter()
+
+    def first_reply_latency(self):
+        """コマンド開始から最初のフォローアップ送信までの秒数を返します。"""
+        if not self.followup.sent:
+            return None
+        return self.followup.sent[0].created_at - self.created_at
+
+    def succeeded(self):
+        """最初のフォローアップが成功 (✅ か一覧表示) を示していれば True を返します。"""
+        if not self.followup.sent:
+            return False
+        first = self.followup.sent[0]
+        if first.embed is not None:
+            return True
+        content = first.content or ""
+        return not getattr(first, "ephemeral", False) and not content.startswith(("❌", "🚫", "予期しない"))
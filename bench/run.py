@@ -0,0 +1,190 @@
+# bench/run.py
+"""
+オフラインのベンチマーク。Calendar APIの代替サーバーと discord.Interaction の代替を使い、
+commands/*.py の実際のハンドラを N 人の同時利用者で動かして、コマンドごとの
+p50 / p95 / p99 レイテンシとスループットを表示します。
+
+使い方 (リポジトリのルートで実行):
+    python -m bench.run --users 20 --iterations 5 --latency 0.08 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+BENCH_CALENDAR_ID = "bench-calendar@example.com"
+BENCH_USER_BASE = 100000
+
+
+def _prepare_environment(users, rate, burst):
+    """config.py を読み込む前に、ベンチマーク用の環境変数と設定ファイルを用意します。"""
+    config_dir = tempfile.mkdtemp(prefix="sharedule-bench-")
+    config_path = os.path.join(config_dir, "config.json")
+    user_ids = [BENCH_USER_BASE + index for index in range(users)]
+    pairings = {str(user_ids[i]): str(user_ids[i + 1]) for i in range(0, len(user_ids) - 1, 2)}
+    with open(config_path, "w") as f:
+        json.dump({
+            "allowed_users": [{"name": f"bench{index}", "id": user_id} for index, user_id in enumerate(user_ids)],
+            "pairings": pairings,
+            "bidirectional_pairings": True,
+        }, f)
+    os.environ.update({
+        "CONFIG_FILE_PATH": config_path,
+        "GOOGLE_CALENDAR_ID": BENCH_CALENDAR_ID,
+        "GOOGLE_CALENDAR_CREDENTIALS_PATH": "bench", # 実際には読み込まない (BenchCredentials を使う)
+        "EVENT_STORE_PATH": "", # ミラーはファイルに保存しない
+        "DISCORD_WEBHOOK_URL": "", # 通知はチャンネル (FakeChannel) に送る
+        "CALENDAR_API_RATE": str(rate),
+        "CALENDAR_API_BURST": str(burst),
+    })
+    return user_ids
+
+
+class BenchCredentials:
+    """service_manager の代わりに固定のアクセストークンを返します。"""
+
+    def add_listener(self, callback):
+        pass
+
+    def check_credentials_file(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def get_access_token(self):
+        return "bench-token", datetime.utcnow() + timedelta(hours=1)
+
+
+def percentile(values, pct):
+    """最近傍順位法によるパーセンタイル。"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {} # コマンド名 -> [(所要時間, 最初の応答までの時間, 成功したか)]
+
+    async def invoke(self, tree, name, interaction, **options):
+        command = tree.get_command(name)
+        started = time.perf_counter()
+        interaction.created_at = started
+        await command.callback(interaction, **options)
+        elapsed = time.perf_counter() - started
+        self.samples.setdefault(name, []).append((elapsed, interaction.first_reply_latency(), interaction.succeeded()))
+        return interaction
+
+    def report(self, wall_time):
+        lines = [f"{'command':<10} {'n':>5} {'ok%':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'first-p50':>10} {'ops/s':>8}"]
+        for name, samples in sorted(self.samples.items()):
+            durations = [sample[0] * 1000 for sample in samples]
+            first = [sample[1] * 1000 for sample in samples if sample[1] is not None]
+            ok = sum(1 for sample in samples if sample[2]) / len(samples) * 100
+            lines.append(
+                f"{name:<10} {len(samples):>5} {ok:>6.1f} {percentile(durations, 50):>8.1f} {percentile(durations, 95):>8.1f} "
+                f"{percentile(durations, 99):>8.1f} {percentile(first, 50):>10.1f} {len(samples) / wall_time:>8.1f}"
+            )
+        return "\n".join(lines)
+
+
+async def _user_session(tree, recorder, fake_discord, user_id, index, iterations, base_date, followup_latency, bulk):
+    """1人分の操作 (追加 → 一覧 → 変更 → 削除) を iterations 回繰り返します。"""
+    user = fake_discord.FakeUser(user_id, f"bench{index}")
+    channel = fake_discord.FakeChannel(index)
+
+    def new_interaction(**options):
+        return fake_discord.FakeInteraction(user, channel, followup_latency=followup_latency, **options)
+
+    if bulk:
+        lines = "; ".join(f"{(base_date + timedelta(days=day)).isoformat()} bulk-{index}-{day}" for day in range(bulk))
+        await recorder.invoke(tree, "add_bulk", new_interaction(), schedules=lines, file=None)
+    for iteration in range(iterations):
+        day = (base_date + timedelta(days=(index * iterations + iteration) % 365)).isoformat()
+        title = f"bench-{index}-{iteration}"
+        await recorder.invoke(tree, "add", new_interaction(), date=day, schedule=title)
+        await recorder.invoke(tree, "list_day", new_interaction(), date=day)
+        await recorder.invoke(tree, "edit", new_interaction(), old_date=day, old_schedule=title, new_date=day, new_schedule=f"{title}-edited")
+        await recorder.invoke(tree, "delete", new_interaction(), date=day, schedule=f"{title}-edited")
+
+
+async def main(args):
+    user_ids = _prepare_environment(args.users, args.rate, args.burst)
+    sys.path.insert(0, os.getcwd())
+
+    import discord
+    from discord import app_commands
+    import calendar_api
+    import event_store
+    import main as bot # import しただけではボットは起動しない (起動は __main__ のときだけ)
+    import notifications
+    from bench import fake_discord
+    from bench.fake_calendar import FakeCalendar, start_server
+
+    logging.getLogger().setLevel(logging.WARNING) # 1件ごとの info ログで結果の表示が埋もれないようにする
+
+    fake = FakeCalendar(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    runner, base_url = await start_server(fake)
+    calendar_api.set_api(calendar_api.CalendarAPI(
+        BENCH_CALENDAR_ID,
+        credentials_manager=BenchCredentials(),
+        base_url=f"{base_url}/calendar/v3",
+        batch_url=f"{base_url}/batch/calendar/v3",
+    ))
+
+    client = discord.Client(intents=discord.Intents.none())
+    tree = app_commands.CommandTree(client)
+    bot.load_commands(tree) # ボットと同じ手順で、ベンチ用のツリーにコマンドを登録する
+    notifications.get_queue().start()
+
+    store = event_store.get_store()
+    if args.mirror:
+        await store.sync() # ミラーを有効にした場合は計測前に全件同期しておく
+        await store.start()
+
+    recorder = Recorder()
+    base_date = date.today() + timedelta(days=1)
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        _user_session(tree, recorder, fake_discord, user_id, index, args.iterations, base_date, args.followup_latency, args.bulk)
+        for index, user_id in enumerate(user_ids)
+    ])
+    wall_time = time.perf_counter() - started
+
+    if args.mirror:
+        await store.stop()
+    await notifications.get_queue().stop()
+    await calendar_api.close()
+    await runner.cleanup()
+
+    print(f"users={args.users} iterations={args.iterations} latency={args.latency * 1000:.0f}ms "
+          f"error_rate={args.error_rate} mirror={args.mirror} wall={wall_time:.2f}s api_requests={fake.request_count}")
+    print(recorder.report(wall_time))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sharedule のオフラインベンチマーク")
+    parser.add_argument("--users", type=int, default=10, help="同時利用者数")
+    parser.add_argument("--iterations", type=int, default=5, help="1人あたりの 追加→一覧→変更→削除 の繰り返し回数")
+    parser.add_argument("--bulk", type=int, default=0, help="各利用者が最初に /add_bulk で追加する件数 (0で無効)")
+    parser.add_argument("--latency", type=float, default=0.05, help="代替Calendar APIの平均応答時間 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="応答時間のばらつき (標準偏差, 秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503を返す割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="403 rateLimitExceeded を返す割合")
+    parser.add_argument("--followup-latency", type=float, default=0.0, help="Discordへのフォローアップ送信1回あたりの遅延 (秒)")
+    parser.add_argument("--rate", type=float, default=1000.0, help="スケジューラの送信レート (リクエスト/秒)")
+    parser.add_argument("--burst", type=int, default=100, help="スケジューラのバースト許容数")
+    parser.add_argument("--mirror", action="store_true", help="イベントミラーを有効にする")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
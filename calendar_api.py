@@ -0,0 +1,292 @@
+# calendar_api.py
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode, urlsplit
+
+import aiohttp
+
+import config
+import instrumentation
+from calendar_service import service_manager
+from request_scheduler import RequestScheduler, TokenBucket
+
+CALENDAR_API_BASE_URL = "https://www.googleapis.com/calendar/v3"
+CALENDAR_BATCH_URL = "https://www.googleapis.com/batch/calendar/v3"
+# 部分レスポンスで取得するフィールド (コマンドが実際に使うものだけ)
+EVENT_FIELDS = "id,summary,start,end,htmlLink,etag,status,extendedProperties,recurrence,recurringEventId,originalStartTime"
+LIST_FIELDS = f"nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
+# 1回のバッチリクエストに含められる最大件数 (Calendar APIの上限は50)
+BATCH_MAX_SIZE = 50
+# キャッシュしたアクセストークンを失効の何秒前に取り直すか
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# 接続プールの設定 (keep-aliveで同じホストへの接続を使い回す)
+CONNECTION_LIMIT = 32
+KEEPALIVE_TIMEOUT = 60
+REQUEST_TIMEOUT = 30
+# 1つのカレンダーが同時に使える接続数 (遅いカレンダーが共有の接続プールを使い切らないようにする)
+MAX_IN_FLIGHT_PER_CALENDAR = 8
+
+
+class CalendarAPIError(Exception):
+    """Calendar APIがエラーを返したときに送出される例外。"""
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(f"<HTTP {status}: {message}>")
+        self.status = status
+        self.message = message
+        self.reason = reason # errors[0].reason (例: rateLimitExceeded)
+
+
+_session = None
+
+def get_session():
+    """共有のaiohttp.ClientSessionを返します。イベントループ上で初めて呼ばれたときに作成します。"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT, keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+    return _session
+
+async def close():
+    """共有セッションを閉じます。ボット終了時に呼び出します。"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+class CalendarAPI:
+    """aiohttp上で動くGoogle Calendar v3 (events) の非同期クライアント。"""
+
+    def __init__(self, calendar_id, credentials_manager=service_manager, base_url=CALENDAR_API_BASE_URL, batch_url=CALENDAR_BATCH_URL, scheduler=None):
+        self.calendar_id = calendar_id
+        # すべてのリクエストはスケジューラ (レート制限・再試行・同一読み取りの共有) を通して送る
+        # 送信ペースはプロジェクト全体のクォータなので、カレンダーごとのスケジューラでも1つのバケットを共有する
+        self._scheduler = scheduler or RequestScheduler(bucket=get_project_bucket())
+        self._credentials_manager = credentials_manager
+        self._base_url = base_url.rstrip("/")
+        self._batch_url = batch_url
+        self._token = None
+        self._token_expiry = None
+        self._token_lock = asyncio.Lock()
+        # 認証情報が差し替えられたら (ファイルの更新・invalidate())、キャッシュしたトークンも捨てる
+        credentials_manager.add_listener(self._drop_token)
+        self._in_flight = asyncio.Semaphore(MAX_IN_FLIGHT_PER_CALENDAR)
+
+    def _drop_token(self):
+        self._token = None
+
+    def _token_is_fresh(self):
+        return self._token and self._token_expiry and self._token_expiry - datetime.utcnow() > TOKEN_REFRESH_MARGIN
+
+    async def _get_token(self):
+        """アクセストークンを返します。更新が必要なときだけスレッドプールで取得し直します。"""
+        self._credentials_manager.check_credentials_file() # ファイルの確認は数秒に1回だけ行われる
+        if self._token_is_fresh():
+            return self._token
+        async with self._token_lock:
+            if not self._token_is_fresh():
+                loop = asyncio.get_running_loop()
+                self._token, self._token_expiry = await loop.run_in_executor(None, self._credentials_manager.get_access_token)
+        return self._token
+
+    def _events_url(self, event_id=None):
+        url = f"{self._base_url}/calendars/{quote(self.calendar_id, safe='')}/events"
+        if event_id is not None:
+            url += f"/{quote(event_id, safe='')}"
+        return url
+
+    async def _request(self, api_method, method, url, params=None, json=None, headers=None, data=None, cost=1):
+        """
+        APIリクエストをスケジューラ経由で送信し、レスポンスのJSONを返します (本文がない場合は None)。
+        GETは同じURL・パラメータの呼び出しが実行中であれば、その結果を共有します。
+        api_method はメトリクスのラベルに使うAPIメソッド名 (例: events.insert) です。
+        """
+        call = lambda: self._send(api_method, method, url, params=params, json=json, headers=headers, data=data)
+        if method == "GET":
+            key = (url, tuple(sorted(_encode_params(params).items())) if params else ())
+            return await self._scheduler.run_shared(key, call, cost=cost)
+        # 書き込みは処理済みかもしれない失敗では再送しない (クォータ超過のみ再送)
+        return await self._scheduler.run(call, cost=cost, idempotent=False)
+
+    async def _send(self, api_method, method, url, params=None, json=None, headers=None, data=None):
+        """1回分のHTTPリクエストを送信します。所要時間と失敗はAPIメソッドごとに記録します。"""
+        async with self._in_flight:
+            with instrumentation.calendar_span(api_method):
+                return await self._send_once(method, url, params=params, json=json, headers=headers, data=data)
+
+    async def _send_once(self, method, url, params=None, json=None, headers=None, data=None):
+        for attempt in range(2):
+            token = await self._get_token()
+            request_headers = {"Authorization": f"Bearer {token}"}
+            if headers:
+                request_headers.update(headers)
+            async with get_session().request(method, url, params=_encode_params(params) if params else None, json=json, data=data, headers=request_headers) as resp:
+                if resp.status == 401 and attempt == 0:
+                    # トークンが無効になっていた場合は、キャッシュ済みの認証情報ごと破棄して一度だけ取り直して再試行
+                    # (マネージャーが同じトークンを返し続けないよう、リスナー経由で他の CalendarAPI のトークンも捨てる)
+                    if self._token == token:
+                        await asyncio.get_running_loop().run_in_executor(None, self._credentials_manager.invalidate)
+                    continue
+                if resp.status >= 400:
+                    raise await _error_from_response(resp)
+                if resp.status == 204:
+                    return None
+                if data is not None:
+                    # バッチ応答はmultipart/mixedなので本文とContent-Typeをそのまま返す
+                    return resp.headers.get("Content-Type", ""), await resp.read()
+                return await resp.json(content_type=None)
+
+    async def insert_event(self, body, params=None):
+        return await self._request("events.insert", "POST", self._events_url(), params=params, json=body)
+
+    async def list_events(self, **params):
+        return await self._request("events.list", "GET", self._events_url(), params=params)
+
+    async def get_event(self, event_id, params=None):
+        return await self._request("events.get", "GET", self._events_url(event_id), params=params)
+
+    async def patch_event(self, event_id, body, params=None, headers=None):
+        return await self._request("events.patch", "PATCH", self._events_url(event_id), params=params, json=body, headers=headers)
+
+    async def delete_event(self, event_id, headers=None):
+        return await self._request("events.delete", "DELETE", self._events_url(event_id), headers=headers)
+
+    async def query_freebusy(self, time_min, time_max, calendar_ids):
+        """
+        複数のカレンダーの予定が入っている時間帯 (busy) を1回のリクエストで取得します。
+        POSTですが読み取りだけなので、一時的なエラーでは再送します。
+        """
+        body = {"timeMin": time_min, "timeMax": time_max, "items": [{"id": calendar_id} for calendar_id in calendar_ids]}
+        call = lambda: self._send("freebusy.query", "POST", f"{self._base_url}/freeBusy", json=body)
+        return await self._scheduler.run(call, idempotent=True)
+
+    async def batch_insert_events(self, bodies, params=None):
+        """
+        複数のイベントを1回のバッチHTTPリクエストで追加します (最大 BATCH_MAX_SIZE 件)。
+        入力と同じ順序で、作成されたイベントまたは CalendarAPIError のリストを返します。
+        """
+        if len(bodies) > BATCH_MAX_SIZE:
+            raise ValueError(f"バッチに含められるのは最大{BATCH_MAX_SIZE}件です。")
+        path = urlsplit(self._events_url()).path
+        if params:
+            path += "?" + urlencode(_encode_params(params))
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for index, body in enumerate(bodies):
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <item-{index}>\r\n\r\n"
+                f"POST {path} HTTP/1.1\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(body, ensure_ascii=False)}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        payload = "".join(parts).encode("utf-8")
+        content_type, raw = await self._request(
+            "batch", "POST", self._batch_url, data=payload,
+            headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            cost=len(bodies), # バッチ内の各リクエストがそれぞれクォータを消費する
+        )
+        responses = _parse_batch_response(content_type, raw)
+        results = []
+        for index in range(len(bodies)):
+            status, data = responses.get(index, (500, None))
+            if status >= 400 or data is None:
+                error = (data or {}).get("error", {}) if isinstance(data, dict) else {}
+                errors = error.get("errors") or [{}]
+                results.append(CalendarAPIError(status, error.get("message", "バッチ応答が不正です"), errors[0].get("reason")))
+            else:
+                results.append(data)
+        return results
+
+
+def _encode_params(params):
+    """クエリパラメータをaiohttpが扱える形 (bool -> 'true'/'false') に変換します。"""
+    encoded = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        encoded[key] = ("true" if value else "false") if isinstance(value, bool) else value
+    return encoded
+
+def _parse_batch_response(content_type, raw):
+    """multipart/mixed のバッチ応答を {リクエスト番号: (ステータス, JSON)} に変換します。"""
+    boundary = None
+    for param in content_type.split(";"):
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary":
+            boundary = value.strip('"')
+    if not boundary:
+        raise CalendarAPIError(500, "バッチ応答にboundaryがありません")
+    responses = {}
+    for part in raw.decode("utf-8").split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == "--":
+            continue
+        # パートのヘッダ / 内側のHTTPステータス行とヘッダ / 本文 の3つに分かれる
+        outer_headers, _, inner = part.replace("\r\n", "\n").partition("\n\n")
+        index = None
+        for line in outer_headers.split("\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-id":
+                # 例: <response-item-3>
+                index = int(value.strip().strip("<>").rsplit("-", 1)[-1])
+        inner_head, _, body = inner.partition("\n\n")
+        status = int(inner_head.split("\n", 1)[0].split()[1])
+        data = None
+        body = body.strip()
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+        if index is not None:
+            responses[index] = (status, data)
+    return responses
+
+async def _error_from_response(resp):
+    message = resp.reason
+    reason = None
+    try:
+        data = await resp.json(content_type=None)
+        error = data.get("error", {})
+        message = error.get("message", message)
+        errors = error.get("errors") or []
+        if errors:
+            reason = errors[0].get("reason")
+    except (aiohttp.ContentTypeError, ValueError, AttributeError):
+        pass
+    return CalendarAPIError(resp.status, message, reason)
+
+
+_project_bucket = None
+
+def get_project_bucket():
+    """
+    すべての CalendarAPI で共有する、プロジェクトのクォータ (CALENDAR_API_RATE / CALENDAR_API_BURST) のトークンバケットを返します。
+    ワーカーモードでは各ワーカープロセスが1つずつ持つため、ワーカーの数で等分します。
+    """
+    global _project_bucket
+    if _project_bucket is None:
+        share = max(1, config.CALENDAR_WORKERS)
+        _project_bucket = TokenBucket(config.CALENDAR_API_RATE / share, max(1, config.CALENDAR_API_BURST // share))
+    return _project_bucket
+
+
+_default_api = None
+
+def get_api():
+    """GOOGLE_CALENDAR_ID 用の共有クライアントを返します。"""
+    global _default_api
+    if _default_api is None:
+        _default_api = CalendarAPI(config.GOOGLE_CALENDAR_ID)
+    return _default_api
+
+def set_api(api):
+    """共有クライアントを差し替えます (ベンチマークなどで別のエンドポイントに向けるときに使う)。"""
+    global _default_api
+    _default_api = api
@@ -0,0 +1,132 @@
+# calendar_service.py
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httplib2
+import google_auth_httplib2
+from google.oauth2.service_account import Credentials
+
+import config
+import instrumentation
+
+# トークン失効の何秒前に先回りして更新するか
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# 認証情報ファイルの更新チェック間隔 (秒)
+CREDENTIALS_CHECK_INTERVAL = 5.0
+HTTP_TIMEOUT = 30
+
+log = instrumentation.get_logger(__name__)
+
+
+class CalendarServiceManager:
+    """
+    Google Calendar APIの認証情報を長期間使い回すための管理クラス。
+    認証情報は一度だけ読み込み、トークンは失効前に更新します。
+    認証情報を破棄したとき (ファイルの更新・invalidate()) は、登録されたリスナーに通知して
+    各 CalendarAPI がキャッシュしているトークンも捨てさせます。
+    """
+
+    def __init__(self, credentials_path, scopes):
+        self._credentials_path = credentials_path
+        self._scopes = scopes
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._credentials = None
+        self._file_stamp = None
+        self._last_file_check = 0.0
+        self._listeners = [] # 認証情報を破棄したときに呼ぶ関数
+
+    def _stat_credentials_file(self):
+        st = os.stat(self._credentials_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        """認証情報を読み込みます (ロック取得済みで呼ぶこと)。"""
+        if not self._credentials_path:
+            raise RuntimeError("Google Calendarの認証情報ファイルのパスが設定されていません。")
+        self._file_stamp = self._stat_credentials_file()
+        self._last_file_check = time.monotonic()
+        self._credentials = Credentials.from_service_account_file(self._credentials_path, scopes=self._scopes)
+
+    def _check_credentials_file(self):
+        """認証情報ファイルが更新されていれば認証情報を破棄します (ロック取得済みで呼ぶこと)。"""
+        now = time.monotonic()
+        if now - self._last_file_check < CREDENTIALS_CHECK_INTERVAL:
+            return
+        self._last_file_check = now
+        try:
+            stamp = self._stat_credentials_file()
+        except OSError:
+            return # ファイルが一時的に読めない場合は現在のクライアントを使い続ける
+        if stamp != self._file_stamp:
+            log.info("認証情報ファイルの変更を検知しました。認証情報を読み込み直します。")
+            self._invalidate_locked()
+
+    def _invalidate_locked(self):
+        self._credentials = None
+        for listener in list(self._listeners):
+            listener()
+
+    def add_listener(self, callback):
+        """認証情報を破棄したときに (引数なしで) 呼ぶ関数を登録します。どのスレッドから呼ばれてもよい処理にしてください。"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def invalidate(self):
+        """キャッシュ済みの認証情報を破棄し、リスナーに通知します。次回の呼び出しで読み込み直してトークンを取得します。"""
+        with self._lock:
+            self._invalidate_locked()
+
+    def check_credentials_file(self):
+        """
+        認証情報ファイルが更新されていれば認証情報を破棄し、リスナーに通知します。
+        確認は CREDENTIALS_CHECK_INTERVAL 秒に1回だけ行うため、リクエストのたびに呼んでも構いません。
+        """
+        with self._lock:
+            if self._credentials is not None:
+                self._check_credentials_file()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._credentials is not None:
+                self._check_credentials_file()
+            if self._credentials is None:
+                self._load()
+            return self._credentials
+
+    def get_credentials(self):
+        """有効なアクセストークンを持つ認証情報を返します。失効が近ければ先に更新します。"""
+        creds = self._ensure_loaded()
+        expiry = creds.expiry # google-authはUTCのnaive datetimeを使う
+        if creds.token and expiry and expiry - datetime.utcnow() > TOKEN_REFRESH_MARGIN:
+            return creds
+        with self._refresh_lock:
+            # 他のスレッドが更新済みでないか再確認
+            expiry = creds.expiry
+            if not creds.token or not expiry or expiry - datetime.utcnow() <= TOKEN_REFRESH_MARGIN:
+                creds.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT)))
+        return creds
+
+    def get_access_token(self):
+        """有効なアクセストークンとその失効時刻 (UTCのnaive datetime) を返します。"""
+        creds = self.get_credentials()
+        return creds.token, creds.expiry
+
+
+# アプリ全体で共有するクライアント管理オブジェクト
+service_manager = CalendarServiceManager(config.GOOGLE_CALENDAR_CREDENTIALS_PATH, config.GOOGLE_CALENDAR_SCOPES)
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_manager(credentials_path):
+    """認証情報ファイルごとの共有マネージャーを返します。同じファイルを使うカレンダー同士はトークンを共有します。"""
+    if credentials_path == config.GOOGLE_CALENDAR_CREDENTIALS_PATH:
+        return service_manager
+    with _managers_lock:
+        manager = _managers.get(credentials_path)
+        if manager is None:
+            manager = _managers[credentials_path] = CalendarServiceManager(credentials_path, config.GOOGLE_CALENDAR_SCOPES)
+        return manager
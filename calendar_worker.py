@@ -0,0 +1,224 @@
+# calendar_worker.py
+import asyncio
+import importlib
+import itertools
+import multiprocessing
+import time
+import zlib
+from functools import wraps
+
+import calendar_api
+import calendars
+import config
+import instrumentation
+
+# ワーカープロセスの死活を確認する間隔 (秒)
+WATCH_INTERVAL = 5.0
+# 停止時にワーカーが処理中の呼び出しを終えるのを待つ最大秒数
+STOP_TIMEOUT = 30.0
+# 書き込みの途中でワーカーが止まったときのメッセージ (反映済みかどうかはゲートウェイからは分からない)
+UNKNOWN_RESULT_MESSAGE = "カレンダーワーカーが停止したため、変更が反映されたか分かりません。予定を確認してください。"
+
+WORKER_CALL_SECONDS = instrumentation.register(
+    instrumentation.Histogram("sharedule_worker_call_seconds", "Round trip of a calendar operation handled by a worker process.")
+)
+
+log = instrumentation.get_logger(__name__)
+
+_pool = None # このプロセスがゲートウェイとしてワーカーに処理を任せている間だけ設定される
+
+
+def enabled():
+    """CALENDAR_WORKERS が1以上ならワーカーモードです。"""
+    return config.CALENDAR_WORKERS > 0
+
+def active():
+    """このプロセスの呼び出しがワーカーに送られる状態なら True を返します (ワーカープロセスの中では常に False)。"""
+    return _pool is not None
+
+def worker_index(target, workers):
+    """カレンダーを担当するワーカーの番号を返します。同じカレンダーは常に同じワーカーが処理するため、ミラーは1つで済みます。"""
+    if target is None:
+        target = config.default_calendar_target()
+    key = target.calendar_id if target is not None else ""
+    return zlib.crc32(key.encode("utf-8")) % workers
+
+def offload(failure, mutation=False):
+    """
+    非同期関数を、ワーカーモードではカレンダーを担当するワーカープロセスで実行させるデコレータ。
+    calendar 引数 (CalendarContext) はプロセスをまたげないため CalendarTarget に置き換えて送り、ワーカー側で引き直します。
+    ワーカーに届かなかった・時間切れになった場合は failure(メッセージ, *引数) の戻り値を返し、呼び出し側の扱いをそろえます。
+    mutation=True (書き込み) の呼び出しは、ワーカーがまだ反映するかもしれないため時間切れにしません。
+    """
+    def decorator(func):
+        name = f"{func.__module__}:{func.__name__}"
+
+        @wraps(func)
+        async def wrapper(*args, calendar=None, **kwargs):
+            if _pool is None:
+                return await func(*args, calendar=calendar, **kwargs)
+            try:
+                return await _pool.call(name, args, kwargs, calendar.target if calendar is not None else None, mutation=mutation)
+            except RuntimeError as error:
+                return failure(str(error), *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- ワーカープロセス側 ---
+
+def _worker_main(index, workers, requests, results):
+    """ワーカープロセスの入口。担当するカレンダーのミラーを持ち、届いた呼び出しを並行に処理します。"""
+    asyncio.run(_serve(index, workers, requests, results))
+
+async def _serve(index, workers, requests, results):
+    loop = asyncio.get_running_loop()
+    await calendars.start(owns=lambda target: worker_index(target, workers) == index)
+    log.info("カレンダーワーカーを起動しました", extra={"worker": index})
+    tasks = set()
+    try:
+        while True:
+            job = await loop.run_in_executor(None, requests.get)
+            if job is None:
+                break
+            task = asyncio.create_task(_run(job, results))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await calendars.stop() # 次回起動時に差分同期から始められるよう、担当するミラーを保存
+        await calendar_api.close()
+
+async def _run(job, results):
+    job_id, name, args, kwargs, target = job
+    module_name, func_name = name.split(":")
+    try:
+        func = getattr(importlib.import_module(module_name), func_name)
+        result = await func(*args, calendar=calendars.get_calendar(target), **kwargs)
+        results.put((job_id, True, result))
+    except Exception as e:
+        log.exception("ワーカーでの処理中にエラーが発生しました", extra={"operation": name})
+        results.put((job_id, False, f"ワーカーでの処理中にエラーが発生しました: {e}"))
+
+
+# --- ゲートウェイ側 ---
+
+class WorkerPool:
+    """
+    Calendar APIの呼び出しとミラーをワーカープロセスに分け、ゲートウェイのプロセスはDiscordとの通信だけを受け持つための仕組み。
+    呼び出しはカレンダーごとに決まったワーカーのキューに送り、結果は共通のキューで受け取って呼び出し元の Future に返します。
+    """
+
+    def __init__(self, workers, timeout):
+        self._workers = workers
+        self._timeout = timeout
+        # イベントループやスレッドを持つプロセスの fork は安全でないため spawn で起動する
+        self._context = multiprocessing.get_context("spawn")
+        self._requests = []
+        self._processes = []
+        self._results = None
+        self._pending = {} # 呼び出しID -> (Future, ワーカー番号, 書き込みかどうか)
+        self._ids = itertools.count()
+        self._reader = None
+        self._watcher = None
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._workers, self._requests[index], self._results),
+            name=f"calendar-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    async def start(self):
+        global _pool
+        if _pool is not None:
+            return
+        self._results = self._context.Queue()
+        self._requests = [self._context.Queue() for _ in range(self._workers)]
+        self._processes = [self._spawn(index) for index in range(self._workers)]
+        self._reader = asyncio.create_task(self._read_results())
+        self._watcher = asyncio.create_task(self._watch())
+        _pool = self
+        log.info("カレンダーワーカーに処理を任せます", extra={"workers": self._workers})
+
+    async def stop(self):
+        """新しい呼び出しを止め、ワーカーが処理中の呼び出しを終えてミラーを保存するのを待ちます。"""
+        global _pool
+        if _pool is not self:
+            return
+        _pool = None
+        self._watcher.cancel()
+        loop = asyncio.get_running_loop()
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None) # 結果の読み取りを終わらせる
+        await self._reader
+        self._fail_pending(lambda index: True, "ワーカーが停止しました。")
+
+    async def call(self, name, args, kwargs, target, mutation=False):
+        """
+        name の関数を担当のワーカーで実行し、結果を返します。失敗・時間切れの場合は RuntimeError を送出します。
+        mutation=True の場合は時間切れにせず、ワーカーが停止したときだけ UNKNOWN_RESULT_MESSAGE で失敗させます。
+        """
+        index = worker_index(target, self._workers)
+        job_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[job_id] = (future, index, mutation)
+        started = time.perf_counter()
+        self._requests[index].put((job_id, name, args, kwargs, target))
+        try:
+            ok, result = await asyncio.wait_for(future, None if mutation else self._timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("カレンダーの処理が時間内に終わりませんでした。") from None
+        finally:
+            self._pending.pop(job_id, None)
+            WORKER_CALL_SECONDS.observe(time.perf_counter() - started, operation=name.partition(":")[2])
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    async def _read_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self._results.get)
+            if item is None:
+                return
+            job_id, ok, result = item
+            entry = self._pending.get(job_id)
+            if entry is not None and not entry[0].done():
+                entry[0].set_result((ok, result))
+
+    def _fail_pending(self, matches, message):
+        for future, index, mutation in list(self._pending.values()):
+            if matches(index) and not future.done():
+                future.set_result((False, UNKNOWN_RESULT_MESSAGE if mutation else message))
+
+    async def _watch(self):
+        """停止したワーカーを再起動します。そのワーカー宛ての呼び出しは二重に実行されないよう、失敗として返して捨てます。"""
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                log.error("カレンダーワーカーが停止したため再起動します", extra={"worker": index, "exitcode": process.exitcode})
+                self._fail_pending(lambda worker: worker == index, "カレンダーワーカーが停止しました。もう一度お試しください。")
+                self._requests[index] = self._context.Queue()
+                self._processes[index] = self._spawn(index)
+
+
+_shared_pool = None
+
+def get_pool():
+    """共有のワーカープールを返します。"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = WorkerPool(config.CALENDAR_WORKERS, config.CALENDAR_WORKER_TIMEOUT)
+    return _shared_pool
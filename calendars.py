@@ -0,0 +1,99 @@
+# calendars.py
+import asyncio
+
+import config
+import calendar_api
+import calendar_service
+import event_store
+import instrumentation
+
+# カレンダーが割り当てられていないサーバーでコマンドが使われたときのメッセージ
+NOT_CONFIGURED_MESSAGE = "🚫 このサーバー (チャンネル) にはGoogleカレンダーが設定されていません。"
+
+log = instrumentation.get_logger(__name__)
+
+
+class CalendarContext:
+    """
+    1つのカレンダー専用のAPIクライアント (送信スケジューラを含む) とイベントミラーの組。
+    送信ペースはプロジェクト全体のクォータを共有しますが、同時に送るリクエスト数・再試行・キャッシュはカレンダーごとに分かれるため、
+    遅いカレンダーがあっても他のサーバーのコマンドは待たされません。
+    """
+    __slots__ = ("target", "api", "store", "start_task")
+
+    def __init__(self, target, api, store):
+        self.target = target
+        self.api = api
+        self.store = store
+        self.start_task = None # 実行中に追加されたカレンダーのミラーを開始するタスク (途中で回収されないよう参照を持つ)
+
+    @property
+    def calendar_id(self):
+        return self.target.calendar_id
+
+
+_contexts = {} # CalendarTarget -> CalendarContext
+_running = False
+
+def _create(target):
+    if target == config.default_calendar_target():
+        # 既定のカレンダーは従来の共有インスタンス (ミラーの保存先も従来どおり) を使う
+        return CalendarContext(target, calendar_api.get_api(), event_store.get_store())
+    api = calendar_api.CalendarAPI(target.calendar_id, credentials_manager=calendar_service.get_manager(target.credentials_path))
+    store = event_store.EventStore(
+        api,
+        path=event_store.partition_path(target.calendar_id),
+        sync_interval=config.EVENT_SYNC_INTERVAL,
+        max_staleness=config.EVENT_STORE_MAX_STALENESS,
+    )
+    return CalendarContext(target, api, store)
+
+def get_calendar(target):
+    """CalendarTarget に対応するコンテキストを返します (初回に作成し、以降は使い回す)。"""
+    if target is None:
+        return None
+    context = _contexts.get(target)
+    if context is None:
+        context = _contexts[target] = _create(target)
+        if _running:
+            # 設定の再読み込みで追加されたカレンダーは、最初に使われたときにミラーの同期を始める
+            context.start_task = asyncio.get_running_loop().create_task(context.store.start())
+    return context
+
+def default_calendar():
+    """環境変数で指定された既定のカレンダーのコンテキストを返します。"""
+    return get_calendar(config.default_calendar_target())
+
+def for_interaction(interaction):
+    """コマンドが実行されたサーバー・チャンネルに割り当てられたカレンダーを返します。なければ None を返します。"""
+    return get_calendar(config.get_calendar_target(interaction.guild_id, interaction.channel_id))
+
+
+async def start(owns=None):
+    """設定済みのカレンダーのミラーの同期を開始します。owns を渡すと、owns(target) が True のカレンダーだけを対象にします。"""
+    global _running
+    targets = set(config.config_service.current().calendars.values())
+    if not targets and config.default_calendar_target() is not None:
+        targets.add(config.default_calendar_target())
+    if owns is not None:
+        targets = {target for target in targets if owns(target)}
+    for target in targets:
+        await get_calendar(target).store.start()
+    _running = True
+    log.info("カレンダーのミラーの同期を開始しました", extra={"calendars": len(targets)})
+
+async def stop():
+    """すべてのミラーを保存して停止します。"""
+    global _running
+    _running = False
+    for context in list(_contexts.values()):
+        if context.start_task is not None:
+            context.start_task.cancel()
+            try:
+                await context.start_task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                log.exception("ミラーの開始に失敗していました", extra={"calendar_id": context.calendar_id})
+            context.start_task = None
+        await context.store.stop()
@@ -1,37 +1,106 @@
 import discord
 from discord import app_commands
-from dateutil import parser
+import calendars
 import config
+import dates
 import google_calendar
+import instrumentation
+import notifications
+import recurrence
+import write_queue
+
+REPEAT_LABELS = {"weekly": "毎週", "monthly": "毎月"}
 
 def setup(tree: app_commands.CommandTree):
     """コマンドツリーに/addコマンドを登録"""
     @tree.command(name="add", description="Googleカレンダーに予定を追加します")
-    @app_commands.describe(date="予定の日付 (例:yyyy/mm/dd, mm/dd)", schedule="予定の内容")
-    async def add_command(interaction: discord.Interaction, date: str, schedule: str):
+    @app_commands.describe(
+        date="予定の日付 (例:yyyy/mm/dd, mm/dd, 明日, 金曜)",
+        schedule="予定の内容",
+        repeat="繰り返し (省略時は1回だけ)",
+        until="繰り返しの最終日 (例:yyyy/mm/dd)",
+        count="繰り返す回数 (until を指定した場合は無視)",
+    )
+    @app_commands.choices(repeat=[app_commands.Choice(name=label, value=key) for key, label in REPEAT_LABELS.items()])
+    @instrumentation.instrument_command("add")
+    async def add_command(
+        interaction: discord.Interaction,
+        date: str,
+        schedule: str,
+        repeat: app_commands.Choice[str] = None,
+        until: str = None,
+        count: app_commands.Range[int, 2, 500] = None,
+    ):
         await interaction.response.defer(ephemeral=False) # 応答を遅延させる
         try:
             try:
-                # dateutilライブラリで柔軟に解析を試みる (年が最初に来る形式を優先)
-                date_obj = parser.parse(date, yearfirst=True)
-                formatted_date = date_obj.strftime("%Y-%m-%d")
-            except parser.ParserError:
-                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DDまたはM/Dで入力してください。", ephemeral=True)
+                # よく使われる形式は高速に解析し、それ以外は dateutil で解析する (年が最初に来る形式を優先)
+                with instrumentation.span("parse", "add"):
+                    formatted_date = dates.format_date(date)
+                    until_obj = dates.parse_date(until) if repeat and until else None
+            except dates.DateParseError:
+                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
+                return
+            if until_obj is not None and until_obj.isoformat() < formatted_date:
+                await interaction.followup.send("繰り返しの最終日は予定の日付以降を指定してください。", ephemeral=True)
                 return
 
+            # 繰り返しは1件の予定 (RRULE) として登録し、読み取り時に手元で展開する
+            recurrence_rules = recurrence.recurrence_rule(repeat.value, until=until_obj, count=count) if repeat else None
+            if repeat:
+                # 表示用: 「毎週 (2026-12-31まで)」のように繰り返しを予定の日付に添える
+                limit = f"{until_obj.isoformat()}まで" if until_obj else (f"{count}回" if count else "終了日なし")
+                date_label = f"{formatted_date} から{REPEAT_LABELS[repeat.value]} ({limit})"
+            else:
+                date_label = formatted_date
+
             user_id = interaction.user.id
             allowed_ids = config.get_allowed_user_ids()
 
+            # ペアリング相手への通知処理
+            partner_notification = ""
+            partner_id = config.get_user_pairings().get(user_id)
+            if partner_id is not None:
+                mention = f"<@{partner_id}>"
+                partner_notification = (
+                    f"{mention} さんへ: {interaction.user.display_name} さんが {date_label} に **{schedule}** を予定に追加しました。"
+                )
+            notification_line = f"{date_label} に **{schedule}** を追加"
+
             # Googleカレンダーへの追加処理（権限がある場合）
             added_to_gcal = False
             gcal_message = ""
 
-            if user_id in allowed_ids:
+            calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+            if user_id in allowed_ids and calendar is not None and write_queue.enabled():
+                # 書き込みキューに記録してすぐに応答し、反映後にこのメッセージを結果に書き換える
+                # イベントIDをこちらで決めておくことで、再送しても予定が重複しない
+                payload = {
+                    "body": google_calendar.all_day_event_body(
+                        formatted_date, schedule, event_id=google_calendar.new_event_id(), created_by=user_id, recurrence_rules=recurrence_rules,
+                    ),
+                    "messages": {
+                        "done": f"✅ Googleカレンダーに {date_label} の予定 '{schedule}' を追加しました。\nリンク: {{link}}",
+                        "failed": "❌ Googleカレンダーへの予定追加に失敗しました: ",
+                    },
+                    "notify": write_queue.notify_payload(partner_id, interaction.user.display_name, partner_notification, notification_line),
+                }
+                await write_queue.get_queue().submit(
+                    interaction, calendar, "add", payload,
+                    f"⏳ {date_label} の予定 '{schedule}' の追加を受け付けました。反映されるとこのメッセージが更新されます。",
+                )
+                return
+            if user_id in allowed_ids and calendar is None:
+                gcal_message = calendars.NOT_CONFIGURED_MESSAGE
+            elif user_id in allowed_ids:
                 # add_calendar_event が成功時にイベントオブジェクトを返すことを想定
-                success, result = await google_calendar.add_calendar_event(formatted_date, schedule) # 成功時 result は created_event オブジェクト
+                with instrumentation.span("calendar", "add"):
+                    success, result = await google_calendar.add_calendar_event(
+                        formatted_date, schedule, calendar=calendar, created_by=user_id, recurrence_rules=recurrence_rules,
+                    ) # 成功時 result は created_event オブジェクト
                 if success:
                     created_event = result # result は作成されたイベントオブジェクト
-                    gcal_message = f"✅ Googleカレンダーに {formatted_date} の予定 '{schedule}' を追加しました。\n"
+                    gcal_message = f"✅ Googleカレンダーに {date_label} の予定 '{schedule}' を追加しました。\n"
                     gcal_message += f'リンク: {created_event.get("htmlLink")}' # リンクを追加
                     added_to_gcal = True
                 else: # 追加に失敗した場合
@@ -39,22 +108,21 @@ def setup(tree: app_commands.CommandTree):
             else: # 権限がない場合
                 gcal_message = "🚫 あなたはGoogleカレンダーに予定を追加する権限がありません。"
 
-            # ペアリング相手への通知処理
-            partner_notification = ""
-            user_pairings = config.get_user_pairings()
-            if str(user_id) in user_pairings:
-                partner_id = int(user_pairings[str(user_id)])
-                mention = f"<@{partner_id}>"
-                partner_notification = (
-                    f"{mention} さんへ: {interaction.user.display_name} さんが {formatted_date} に **{schedule}** を予定に追加しました。"
-                )
             # 結果をユーザーに送信
-            await interaction.followup.send(gcal_message)
-            # ペアリング相手に通知（通知メッセージがある場合のみ）
+            with instrumentation.span("followup", "add"):
+                await interaction.followup.send(gcal_message)
+            # ペアリング相手への通知はキューに積むだけで、送信は待たない（通知メッセージがある場合のみ）
             if partner_notification:
-                await interaction.channel.send(partner_notification)
+                notifications.notify_partner(
+                    partner_id,
+                    interaction.user.display_name,
+                    partner_notification,
+                    notification_line,
+                    channel=interaction.channel,
+                    guild_id=interaction.guild_id,
+                )
 
 
-        except Exception as e:
-            print(f"[/add] 予期しないエラー: {e}")
+        except Exception:
+            instrumentation.command_failed("add")
             await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import discord
+from discord import app_commands
+import calendars
+import config
+import google_calendar
+import instrumentation
+import notifications
+import schedule_import
+
+# 添付ファイルの最大サイズ (バイト)
+MAX_ATTACHMENT_SIZE = 1024 * 1024
+# Discordの1メッセージあたりの文字数上限
+MESSAGE_LIMIT = 2000
+
+def _split_message(lines, limit=MESSAGE_LIMIT):
+    """行のリストを、上限文字数を超えないメッセージのリストにまとめます。"""
+    messages = []
+    current = ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > limit:
+            messages.append(current)
+            current = ""
+        current += line[:limit - 1] + "\n"
+    if current:
+        messages.append(current)
+    return messages
+
+def setup(tree: app_commands.CommandTree):
+    """コマンドツリーに/add_bulkコマンドを登録"""
+    @tree.command(name="add_bulk", description="複数の予定をまとめてGoogleカレンダーに追加します")
+    @app_commands.describe(
+        schedules="「日付 予定」を改行または ; 区切りで複数入力 (例: 10/1 早番; 10/2 遅番)",
+        file="予定を書いたファイル (.ics / .csv「日付,予定」/ .txt「日付 予定」)",
+    )
+    @instrumentation.instrument_command("add_bulk")
+    async def add_bulk_command(interaction: discord.Interaction, schedules: str = None, file: discord.Attachment = None):
+        await interaction.response.defer(ephemeral=False) # 応答を遅延させる
+
+        user_id = interaction.user.id
+        allowed_ids = config.get_allowed_user_ids()
+
+        # 権限チェック
+        if user_id not in allowed_ids:
+            await interaction.followup.send("🚫 あなたはGoogleカレンダーに予定を追加する権限がありません。", ephemeral=True)
+            return
+        calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+        if calendar is None:
+            await interaction.followup.send(calendars.NOT_CONFIGURED_MESSAGE, ephemeral=True)
+            return
+
+        try:
+            # すべての行を先に解析する
+            rows = []
+            if file is not None and file.size > MAX_ATTACHMENT_SIZE:
+                await interaction.followup.send("ファイルが大きすぎます (1MBまで)。", ephemeral=True)
+                return
+            data = await file.read() if file is not None else None
+            with instrumentation.span("parse", "add_bulk"):
+                if schedules:
+                    rows.extend(schedule_import.parse_lines(schedules))
+                if data is not None:
+                    rows.extend(schedule_import.parse_attachment(file.filename, data))
+            if not rows:
+                await interaction.followup.send("追加する予定を入力するか、ファイルを添付してください。", ephemeral=True)
+                return
+
+            valid_rows = [row for row in rows if row.ok]
+            with instrumentation.span("calendar", "add_bulk"):
+                results = await google_calendar.add_calendar_events_bulk([(row.date_str, row.schedule) for row in valid_rows], calendar=calendar, created_by=interaction.user.id)
+            outcome = {id(row): result for row, result in zip(valid_rows, results)}
+
+            # 行ごとの結果をまとめたサマリーを作成
+            added = []
+            summary_lines = []
+            for row in rows:
+                if not row.ok:
+                    summary_lines.append(f"❌ {row.line_no}行目 `{row.raw}`: {row.error}")
+                    continue
+                success, result = outcome[id(row)]
+                if success:
+                    added.append(row)
+                    summary_lines.append(f"✅ {row.date_str} {row.schedule}")
+                else:
+                    summary_lines.append(f"❌ {row.line_no}行目 {row.date_str} {row.schedule}: {result}")
+            header = f"🗓️ **一括追加の結果: {len(added)}/{len(rows)}件を追加しました**"
+
+            # ペアリング相手への通知は1件ずつキューに積み、通知キュー側で1通にまとめて送る
+            partner_id = config.get_user_pairings().get(user_id)
+            if partner_id is not None:
+                for row in added:
+                    notifications.notify_partner(
+                        partner_id,
+                        interaction.user.display_name,
+                        f"<@{partner_id}> さんへ: {interaction.user.display_name} さんが {row.date_str} に **{row.schedule}** を予定に追加しました。",
+                        f"{row.date_str} に **{row.schedule}** を追加",
+                        channel=interaction.channel,
+                        guild_id=interaction.guild_id,
+                    )
+
+            # 結果をユーザーに送信
+            with instrumentation.span("followup", "add_bulk"):
+                for message in _split_message([header] + summary_lines):
+                    await interaction.followup.send(message)
+
+        except Exception:
+            instrumentation.command_failed("add_bulk")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
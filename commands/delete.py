@@ -1,14 +1,20 @@
 import discord
 from discord import app_commands
-from dateutil import parser
+import calendars
 import config
+import dates
 import google_calendar
+import instrumentation
+import notifications
+import schedule_autocomplete
+import write_queue
 
 def setup(tree: app_commands.CommandTree):
     """コマンドツリーに/deleteコマンドを登録します。"""
 
     @tree.command(name="delete", description="Googleカレンダーの予定を削除します")
-    @app_commands.describe(date="削除したい予定の日付", schedule="削除したい予定の内容 (正確に入力)")
+    @app_commands.describe(date="削除したい予定の日付", schedule="削除したい予定の内容 (候補から選択、または正確に入力)")
+    @instrumentation.instrument_command("delete")
     async def delete_command(interaction: discord.Interaction, date: str, schedule: str):
         await interaction.response.defer(ephemeral=False) # 応答を遅延させる
 
@@ -19,18 +25,23 @@ def setup(tree: app_commands.CommandTree):
         if user_id not in allowed_ids:
             await interaction.followup.send("🚫 あなたは予定を削除する権限がありません。", ephemeral=True)
             return
+        calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+        if calendar is None:
+            await interaction.followup.send(calendars.NOT_CONFIGURED_MESSAGE, ephemeral=True)
+            return
 
         try:
             # 日付の解析
             try:
-                date_obj = parser.parse(date, yearfirst=True)
-                formatted_date = date_obj.strftime("%Y-%m-%d")
-            except parser.ParserError:
-                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DDまたはM/Dで入力してください。", ephemeral=True)
+                with instrumentation.span("parse", "delete"):
+                    formatted_date = dates.format_date(date)
+            except dates.DateParseError:
+                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
                 return
 
-            # 削除したい予定を検索 (タイムゾーン修正は find_calendar_event 内で行われている)
-            event_info, error_message = await google_calendar.find_calendar_event(formatted_date, schedule)
+            # 削除したい予定を検索 (候補から選ばれた場合はイベントIDで直接取得し、検索を省略する)
+            with instrumentation.span("lookup", "delete"):
+                event_info, error_message = await schedule_autocomplete.resolve_schedule(formatted_date, schedule, calendar)
 
             if error_message:
                 await interaction.followup.send(f"❌ 予定の検索に失敗しました: {error_message}", ephemeral=True)
@@ -39,8 +50,38 @@ def setup(tree: app_commands.CommandTree):
             event_id = event_info["id"]
             actual_schedule = event_info["summary"] # 検索で見つかった実際の概要
 
+            # ペアリング相手への通知処理
+            partner_notification = ""
+            partner_id = config.get_user_pairings().get(user_id)
+            if partner_id is not None:
+                mention = f"<@{partner_id}>"
+                partner_notification = (
+                    f"{mention} さんへ: {interaction.user.display_name} さんが予定を削除しました。\n"
+                    f"日付: {formatted_date}\n"
+                    f"内容: {actual_schedule}"
+                )
+            notification_line = f"{formatted_date} の **{actual_schedule}** を削除"
+
+            if write_queue.enabled():
+                # 書き込みキューに記録してすぐに応答し、反映後にこのメッセージを結果に書き換える
+                payload = {
+                    "event_id": event_id,
+                    "etag": event_info.get("etag"),
+                    "messages": {
+                        "done": f"✅ Googleカレンダーの {formatted_date} の予定 '{actual_schedule}' を削除しました。",
+                        "failed": "❌ 予定の削除に失敗しました: ",
+                    },
+                    "notify": write_queue.notify_payload(partner_id, interaction.user.display_name, partner_notification, notification_line),
+                }
+                await write_queue.get_queue().submit(
+                    interaction, calendar, "delete", payload,
+                    f"⏳ {formatted_date} の予定 '{actual_schedule}' の削除を受け付けました。反映されるとこのメッセージが更新されます。",
+                )
+                return
+
             # 予定の削除
-            success, delete_message = await google_calendar.delete_calendar_event(event_id)
+            with instrumentation.span("calendar", "delete"):
+                success, delete_message = await google_calendar.delete_calendar_event(event_id, etag=event_info.get("etag"), calendar=calendar)
 
             if success:
                 response_message = f"✅ Googleカレンダーの {formatted_date} の予定 '{actual_schedule}' を削除しました。"
@@ -49,22 +90,24 @@ def setup(tree: app_commands.CommandTree):
                 await interaction.followup.send(response_message, ephemeral=True)
                 return # 削除に失敗したらここで終了
 
-            # ペアリング相手への通知処理
-            partner_notification = ""
-            user_pairings = config.get_user_pairings()
-            if str(user_id) in user_pairings:
-                partner_id = int(user_pairings[str(user_id)])
-                mention = f"<@{partner_id}>"
-                partner_notification = (
-                    f"{mention} さんへ: {interaction.user.display_name} さんが予定を削除しました。\n"
-                    f"日付: {formatted_date}\n"
-                    f"内容: {actual_schedule}"
-                )
             # 結果をユーザーに送信
-            await interaction.followup.send(response_message)
-            # ペアリング相手に通知（通知メッセージがある場合のみ）
+            with instrumentation.span("followup", "delete"):
+                await interaction.followup.send(response_message)
+            # ペアリング相手への通知はキューに積むだけで、送信は待たない（通知メッセージがある場合のみ）
             if partner_notification:
-                await interaction.channel.send(partner_notification)
-        except Exception as e:
-            print(f"[/delete] 予期しないエラー: {e}") # 予期しないエラーのログは残しておく
-            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
\ No newline at end of file
+                notifications.notify_partner(
+                    partner_id,
+                    interaction.user.display_name,
+                    partner_notification,
+                    notification_line,
+                    channel=interaction.channel,
+                    guild_id=interaction.guild_id,
+                )
+        except Exception:
+            instrumentation.command_failed("delete")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
+
+    @delete_command.autocomplete("schedule")
+    async def delete_schedule_autocomplete(interaction: discord.Interaction, current: str):
+        """選択中の日付の予定を候補として表示します (値にはイベントIDが入る)。"""
+        return await schedule_autocomplete.schedule_choices(interaction.namespace.date, current, calendars.for_interaction(interaction))
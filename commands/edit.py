@@ -1,13 +1,19 @@
 import discord
 from discord import app_commands
-from dateutil import parser
+import calendars
 import config
+import dates
 import google_calendar
+import instrumentation
+import notifications
+import schedule_autocomplete
+import write_queue
 
 def setup(tree: app_commands.CommandTree):
     """コマンドツリーに/editコマンドを登録"""
     @tree.command(name="edit", description="Googleカレンダーの予定を変更します")
-    @app_commands.describe(old_date="変更したい予定の日付", old_schedule="変更したい予定の内容 (正確に入力)", new_date="新しい予定の日付", new_schedule="新しい予定の内容")
+    @app_commands.describe(old_date="変更したい予定の日付", old_schedule="変更したい予定の内容 (候補から選択、または正確に入力)", new_date="新しい予定の日付", new_schedule="新しい予定の内容")
+    @instrumentation.instrument_command("edit")
     async def edit_command(interaction: discord.Interaction, old_date: str, old_schedule: str, new_date: str, new_schedule: str):
         await interaction.response.defer(ephemeral=False) # 応答を遅延させる
 
@@ -18,20 +24,24 @@ def setup(tree: app_commands.CommandTree):
         if user_id not in allowed_ids:
             await interaction.followup.send("🚫 あなたは予定を変更する権限がありません。", ephemeral=True)
             return
+        calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+        if calendar is None:
+            await interaction.followup.send(calendars.NOT_CONFIGURED_MESSAGE, ephemeral=True)
+            return
 
         try:
             # 日付の解析
             try:
-                old_date_obj = parser.parse(old_date, yearfirst=True)
-                formatted_old_date = old_date_obj.strftime("%Y-%m-%d")
-                new_date_obj = parser.parse(new_date, yearfirst=True)
-                formatted_new_date = new_date_obj.strftime("%Y-%m-%d")
-            except parser.ParserError:
-                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DDまたはM/Dで入力してください。", ephemeral=True)
+                with instrumentation.span("parse", "edit"):
+                    formatted_old_date = dates.format_date(old_date)
+                    formatted_new_date = dates.format_date(new_date)
+            except dates.DateParseError:
+                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
                 return
 
-            # 変更したい予定を検索 (タイムゾーン修正は find_calendar_event 内で行われている)
-            event_info, error_message = await google_calendar.find_calendar_event(formatted_old_date, old_schedule)
+            # 変更したい予定を検索 (候補から選ばれた場合はイベントIDで直接取得し、検索を省略する)
+            with instrumentation.span("lookup", "edit"):
+                event_info, error_message = await schedule_autocomplete.resolve_schedule(formatted_old_date, old_schedule, calendar)
             if error_message:
                 await interaction.followup.send(f"❌ 予定の検索に失敗しました: {error_message}", ephemeral=True)
                 return
@@ -39,33 +49,66 @@ def setup(tree: app_commands.CommandTree):
             event_id = event_info["id"]
             actual_old_schedule = event_info["summary"] # 検索で見つかった実際の概要
 
-            # 予定の更新
-            success, update_message = await google_calendar.update_calendar_event(event_id, formatted_new_date, new_schedule)
-
-            if success:
-                response_message = f"✅ Googleカレンダーの {formatted_old_date} の予定 '{actual_old_schedule}' を {formatted_new_date} の '{new_schedule}' に変更しました。\nリンク: {update_message}" # update_message はリンクになっている
-            else:
-                response_message = f"❌ 予定の変更に失敗しました: {update_message}"
-                await interaction.followup.send(response_message, ephemeral=True)
-                return # 変更に失敗したらここで終了
-            
             # ペアリング相手への通知処理
             partner_notification = ""
-            user_pairings = config.get_user_pairings()
-            if str(user_id) in user_pairings:
-                partner_id = int(user_pairings[str(user_id)])
+            partner_id = config.get_user_pairings().get(user_id)
+            if partner_id is not None:
                 mention = f"<@{partner_id}>"
                 partner_notification = (
                     f"{mention} さんへ: {interaction.user.display_name} さんが予定を変更しました。\n"
                     f"日付: {formatted_old_date} -> {formatted_new_date}\n"
                     f"内容: {actual_old_schedule} -> {new_schedule}"
                 )
+            notification_line = f"{formatted_old_date} の **{actual_old_schedule}** を {formatted_new_date} の **{new_schedule}** に変更"
+
+            if write_queue.enabled():
+                # 書き込みキューに記録してすぐに応答し、反映後にこのメッセージを結果に書き換える
+                payload = {
+                    "event_id": event_id,
+                    "body": google_calendar.patch_body(event_info, formatted_new_date, new_schedule),
+                    "etag": event_info.get("etag"),
+                    "messages": {
+                        "done": f"✅ Googleカレンダーの {formatted_old_date} の予定 '{actual_old_schedule}' を {formatted_new_date} の '{new_schedule}' に変更しました。\nリンク: {{link}}",
+                        "failed": "❌ 予定の変更に失敗しました: ",
+                    },
+                    "notify": write_queue.notify_payload(partner_id, interaction.user.display_name, partner_notification, notification_line),
+                }
+                await write_queue.get_queue().submit(
+                    interaction, calendar, "edit", payload,
+                    f"⏳ {formatted_old_date} の予定 '{actual_old_schedule}' の変更を受け付けました。反映されるとこのメッセージが更新されます。",
+                )
+                return
+
+            # 予定の更新
+            with instrumentation.span("calendar", "edit"):
+                success, update_message = await google_calendar.update_calendar_event(event_id, formatted_new_date, new_schedule, current_event=event_info, calendar=calendar)
+
+            if success:
+                response_message = f"✅ Googleカレンダーの {formatted_old_date} の予定 '{actual_old_schedule}' を {formatted_new_date} の '{new_schedule}' に変更しました。\nリンク: {update_message}" # update_message はリンクになっている
+            else:
+                response_message = f"❌ 予定の変更に失敗しました: {update_message}"
+                await interaction.followup.send(response_message, ephemeral=True)
+                return # 変更に失敗したらここで終了
+
             # 結果をユーザーに送信
-            await interaction.followup.send(response_message)
-            # ペアリング相手に通知（通知メッセージがある場合のみ）
+            with instrumentation.span("followup", "edit"):
+                await interaction.followup.send(response_message)
+            # ペアリング相手への通知はキューに積むだけで、送信は待たない（通知メッセージがある場合のみ）
             if partner_notification:
-                await interaction.channel.send(partner_notification)
+                notifications.notify_partner(
+                    partner_id,
+                    interaction.user.display_name,
+                    partner_notification,
+                    notification_line,
+                    channel=interaction.channel,
+                    guild_id=interaction.guild_id,
+                )
+
+        except Exception:
+            instrumentation.command_failed("edit")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
 
-        except Exception as e:
-            print(f"[/edit] 予期しないエラー: {e}") # 予期しないエラーのログは残しておく
-            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
\ No newline at end of file
+    @edit_command.autocomplete("old_schedule")
+    async def edit_schedule_autocomplete(interaction: discord.Interaction, current: str):
+        """選択中の日付の予定を候補として表示します (値にはイベントIDが入る)。"""
+        return await schedule_autocomplete.schedule_choices(interaction.namespace.old_date, current, calendars.for_interaction(interaction))
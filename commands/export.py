@@ -0,0 +1,88 @@
+import os
+import tempfile
+import discord
+from discord import app_commands
+from datetime import timedelta
+import calendar_worker
+import calendars
+import dates
+import google_calendar
+import instrumentation
+import schedule_export
+from calendar_api import CalendarAPIError
+
+# この大きさまではメモリ上に書き出し、超えたら一時ファイルに移す (バイト)
+SPOOL_MAX_SIZE = 1024 * 1024
+# 添付できるファイルの最大サイズ (バイト)。サーバーの上限の方が小さければそちらを使う
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+async def _send_file(interaction, fp, count, start_obj, end_obj):
+    """書き出し済みの fp (末尾を指している) を添付して送信します。大きすぎる場合は期間を短くするよう案内します。"""
+    size = fp.tell()
+    limit = min(MAX_UPLOAD_SIZE, interaction.guild.filesize_limit) if interaction.guild else MAX_UPLOAD_SIZE
+    if size > limit:
+        await interaction.followup.send(f"出力が大きすぎます ({size // 1024}KB)。期間を短くしてお試しください。", ephemeral=True)
+        return
+    fp.seek(0)
+    filename = f"sharedule-{start_obj.strftime('%Y%m%d')}-{end_obj.strftime('%Y%m%d')}.ics"
+    with instrumentation.span("followup", "export"):
+        await interaction.followup.send(
+            f"📤 {start_obj.isoformat()} 〜 {end_obj.isoformat()} の予定 {count}件を出力しました。",
+            file=discord.File(fp, filename=filename),
+        )
+
+def setup(tree: app_commands.CommandTree):
+    """コマンドツリーに/exportコマンドを登録"""
+    @tree.command(name="export", description="指定した期間の予定をiCalendar (.ics) ファイルで出力します")
+    @app_commands.describe(start="開始日 (例:yyyy/mm/dd, mm/dd, 今日)", end="終了日 (この日を含む。例:yyyy/mm/dd)")
+    @instrumentation.instrument_command("export")
+    async def export_command(interaction: discord.Interaction, start: str, end: str):
+        await interaction.response.defer(ephemeral=False) # 応答を遅延
+
+        try:
+            try:
+                with instrumentation.span("parse", "export"):
+                    start_obj = dates.parse_date(start)
+                    end_obj = dates.parse_date(end)
+            except dates.DateParseError:
+                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
+                return
+            if end_obj < start_obj:
+                await interaction.followup.send("終了日は開始日以降の日付を指定してください。", ephemeral=True)
+                return
+
+            calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+            if calendar is None:
+                await interaction.followup.send(calendars.NOT_CONFIGURED_MESSAGE, ephemeral=True)
+                return
+
+            time_min, time_max = dates.range_bounds(start_obj, end_obj + timedelta(days=1))
+            if calendar_worker.active():
+                # 取得と書き出しはワーカーで行い、出来上がったファイルだけを受け取る
+                with instrumentation.span("calendar", "export"):
+                    path, result = await schedule_export.export_to_file(time_min, time_max, calendar=calendar)
+                if path is None:
+                    await interaction.followup.send(f"❌ 予定の取得に失敗しました: {result}", ephemeral=True)
+                    return
+                try:
+                    with open(path, "rb") as fp:
+                        fp.seek(0, os.SEEK_END)
+                        await _send_file(interaction, fp, result, start_obj, end_obj)
+                finally:
+                    os.unlink(path)
+                return
+
+            # ミラーが新しければメモリから、そうでなければページごとに取得しながら書き出す
+            pages = google_calendar.iter_event_pages(time_min, time_max, calendar=calendar)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as fp:
+                try:
+                    with instrumentation.span("calendar", "export"):
+                        count = await schedule_export.write_ics(pages, fp, calendar_name=calendar.calendar_id)
+                except (CalendarAPIError, RuntimeError) as error:
+                    await interaction.followup.send(f"❌ 予定の取得に失敗しました: {error}", ephemeral=True)
+                    return
+                await _send_file(interaction, fp, count, start_obj, end_obj)
+
+        except Exception:
+            instrumentation.command_failed("export")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
@@ -0,0 +1,78 @@
+import discord
+from discord import app_commands
+from datetime import timedelta
+import availability
+import calendars
+import config
+import dates
+import instrumentation
+from calendar_api import CalendarAPIError
+from pagination import WEEKDAYS
+
+# 一度に調べられる最大日数
+MAX_DAYS = 31
+# Discordの1メッセージあたりの文字数上限
+MESSAGE_LIMIT = 2000
+
+def _format_day(day, slots):
+    label = f"{day.strftime('%m/%d')}({WEEKDAYS[day.weekday()]})"
+    if len(slots) == 1 and slots[0][0].time() == availability.DAY_START and slots[0][1].time() == availability.DAY_END:
+        return f"・ {label} 終日空いています"
+    return f"・ {label} " + ", ".join(f"{start.strftime('%H:%M')}-{end.strftime('%H:%M')}" for start, end in slots)
+
+def setup(tree: app_commands.CommandTree):
+    """コマンドツリーに/freeコマンドを登録"""
+    @tree.command(name="free", description="あなたとペアの相手が両方空いている日・時間帯を探します")
+    @app_commands.describe(start="開始日 (例:yyyy/mm/dd, mm/dd, 今日。省略時は今日)", days=f"調べる日数 (1〜{MAX_DAYS}。省略時は7)")
+    @instrumentation.instrument_command("free")
+    async def free_command(interaction: discord.Interaction, start: str = None, days: app_commands.Range[int, 1, MAX_DAYS] = 7):
+        await interaction.response.defer(ephemeral=False) # 応答を遅延
+
+        try:
+            try:
+                with instrumentation.span("parse", "free"):
+                    start_obj = dates.parse_date(start) if start else dates.today_jst()
+            except dates.DateParseError:
+                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
+                return
+
+            calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+            if calendar is None:
+                await interaction.followup.send(calendars.NOT_CONFIGURED_MESSAGE, ephemeral=True)
+                return
+
+            user_id = interaction.user.id
+            partner_id = config.get_user_pairings().get(user_id)
+            user_ids = [user_id] if partner_id is None else [user_id, partner_id]
+
+            end_obj = start_obj + timedelta(days=days)
+            time_min, time_max = dates.range_bounds(start_obj, end_obj)
+            try:
+                with instrumentation.span("calendar", "free"):
+                    busy, unavailable = await availability.collect_busy(calendar, user_ids, time_min, time_max)
+            except (CalendarAPIError, RuntimeError) as error:
+                await interaction.followup.send(f"❌ 予定の取得に失敗しました: {error}", ephemeral=True)
+                return
+
+            free_days = [(day, slots) for day, slots in availability.daily_free_slots(busy, start_obj, end_obj) if slots]
+            who = "あなた" if partner_id is None else f"あなたと <@{partner_id}> さん"
+            last_day = (end_obj - timedelta(days=1)).isoformat()
+            lines = [f"🕊️ **{start_obj.isoformat()} 〜 {last_day} に{who}が空いている時間** "
+                     f"({availability.DAY_START.strftime('%H:%M')}〜{availability.DAY_END.strftime('%H:%M')})"]
+            lines.extend(_format_day(day, slots) for day, slots in free_days)
+            if not free_days:
+                lines.append("空いている時間はありませんでした。")
+            if unavailable:
+                lines.append(f"⚠️ 次のカレンダーは確認できませんでした: {', '.join(unavailable)}")
+
+            message = ""
+            for line in lines:
+                if len(message) + len(line) + 1 > MESSAGE_LIMIT:
+                    break
+                message += line + "\n"
+            with instrumentation.span("followup", "free"):
+                await interaction.followup.send(message, allowed_mentions=discord.AllowedMentions.none())
+
+        except Exception:
+            instrumentation.command_failed("free")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
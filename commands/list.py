@@ -1,65 +1,109 @@
 import discord
 from discord import app_commands
-from datetime import datetime, timedelta
-from dateutil import parser
-import config
+from datetime import timedelta
+import calendars
+import dates
 import google_calendar
+import instrumentation
+from calendar_api import CalendarAPIError
+from pagination import send_event_pages
+
+async def _send_range(interaction, command, title, start_obj, end_obj, empty_message, with_date=True):
+    """start_obj の 00:00 JST から end_obj の 00:00 JST までの予定をページ付きで送信します。"""
+    calendar = calendars.for_interaction(interaction) # このサーバー (チャンネル) のカレンダー
+    if calendar is None:
+        await interaction.followup.send(calendars.NOT_CONFIGURED_MESSAGE, ephemeral=True)
+        return
+    time_min, time_max = dates.range_bounds(start_obj, end_obj)
+    pages = google_calendar.iter_event_pages(time_min, time_max, calendar=calendar)
+    try:
+        # 最初のページの取得と送信は分けられないため、まとめて1つのフェーズとして計測する
+        with instrumentation.span("calendar_followup", command):
+            await send_event_pages(interaction, title, pages, empty_message, with_date=with_date)
+    except (CalendarAPIError, RuntimeError) as error:
+        await interaction.followup.send(f"❌ 予定の取得に失敗しました: {error}", ephemeral=True)
 
 def setup(tree: app_commands.CommandTree):
-    """コマンドツリーに/list_dayコマンドを登録"""
+    """コマンドツリーに/list_day, /list_week, /list_monthコマンドを登録"""
     @tree.command(name="list_day", description="指定した日付の予定一覧を表示します")
     @app_commands.describe(date="予定を表示したい日付 (例:yyyy/mm/dd, mm/dd, 今日, 明日)")
+    @instrumentation.instrument_command("list_day")
     async def list_day_command(interaction: discord.Interaction, date: str):
         await interaction.response.defer(ephemeral=False) # 応答を遅延
 
-        user_id = interaction.user.id
-        allowed_ids = config.get_allowed_user_ids()
-
         try:
             # 日付の解析
             try:
-                # dateutil.parser は "today", "tomorrow" なども解析できます
-                date_obj = parser.parse(date, yearfirst=True, fuzzy=True) # fuzzy=True で曖昧な解析も試みる
-                formatted_date = date_obj.strftime("%Y-%m-%d")
-            except parser.ParserError:
+                with instrumentation.span("parse", "list_day"):
+                    date_obj = dates.parse_date(date)
+                    formatted_date = date_obj.isoformat()
+            except dates.DateParseError:
                 await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
                 return
 
             # 検索期間の設定 (指定日の 00:00 JST から翌日の 00:00 JST まで)
-            time_min = f"{formatted_date}T00:00:00+09:00"
-            next_day_obj = date_obj + timedelta(days=1)
-            time_max = f"{next_day_obj.strftime('%Y-%m-%d')}T00:00:00+09:00"
-            # Googleカレンダーからイベントリストを取得
-            events, error_message = await google_calendar.list_events_in_range(time_min, time_max)
+            await _send_range(
+                interaction,
+                "list_day",
+                f"🗓️ {formatted_date} の予定",
+                date_obj,
+                date_obj + timedelta(days=1),
+                f"{formatted_date} の予定はありません。",
+                with_date=False,
+            )
 
-            if error_message:
-                await interaction.followup.send(f"❌ 予定の取得に失敗しました: {error_message}", ephemeral=True)
+        except Exception:
+            instrumentation.command_failed("list_day")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
+
+    @tree.command(name="list_week", description="指定した日付から1週間の予定一覧を表示します")
+    @app_commands.describe(date="開始日 (例:yyyy/mm/dd, mm/dd, 今日。省略時は今日)")
+    @instrumentation.instrument_command("list_week")
+    async def list_week_command(interaction: discord.Interaction, date: str = None):
+        await interaction.response.defer(ephemeral=False) # 応答を遅延
+
+        try:
+            try:
+                with instrumentation.span("parse", "list_week"):
+                    start_obj = dates.parse_date(date) if date else dates.today_jst()
+            except dates.DateParseError:
+                await interaction.followup.send("日付の形式が正しくありません。yyyy/mm/dd、MM/DD、M/D、「今日」「明日」などで入力してください。", ephemeral=True)
                 return
 
-            # 応答メッセージの生成
-            if not events:
-                response_message = f"{formatted_date} の予定はありません。"
-            else:
-                response_message = f"🗓️ **{formatted_date} の予定:**\n"
-                for event in events:
-                    summary = event.get('summary', 'タイトルなし')
-                    # 終日イベントかどうかを判定して表示を調整
-                    start = event.get('start', {})
-                    end = event.get('end', {})
+            end_obj = start_obj + timedelta(days=7)
+            last_day = (end_obj - timedelta(days=1)).strftime("%Y-%m-%d")
+            await _send_range(
+                interaction,
+                "list_week",
+                f"🗓️ {start_obj.strftime('%Y-%m-%d')} 〜 {last_day} の予定",
+                start_obj,
+                end_obj,
+                f"{start_obj.strftime('%Y-%m-%d')} 〜 {last_day} の予定はありません。",
+            )
+
+        except Exception:
+            instrumentation.command_failed("list_week")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
+
+    @tree.command(name="list_month", description="指定した月の予定一覧を表示します")
+    @app_commands.describe(month="表示したい月 (例:yyyy/mm, 10月, 来月。省略時は今月)")
+    @instrumentation.instrument_command("list_month")
+    async def list_month_command(interaction: discord.Interaction, month: str = None):
+        await interaction.response.defer(ephemeral=False) # 応答を遅延
 
-                    if 'date' in start: # 終日イベントの場合
-                        # 終日イベントは開始日と終了日が同じ date キーで示される
-                        # 厳密には終了日はイベントの最後の日の翌日になるが、表示上は日付だけで良いことが多い
-                        response_message += f"・ {summary} (終日)\n"
-                    else: # 時間指定イベントの場合
-                        # dateTime キーで示される
-                        start_time_str = datetime.fromisoformat(start.get('dateTime')).strftime('%H:%M')
-                        end_time_str = datetime.fromisoformat(end.get('dateTime')).strftime('%H:%M')
-                        response_message += f"・ {summary} ({start_time_str} - {end_time_str})\n" # 必要に応じてタイムゾーン考慮も
+        try:
+            try:
+                # 日を省略した "2026/10" や「来月」も1日として扱う
+                with instrumentation.span("parse", "list_month"):
+                    start_obj = dates.parse_month(month) if month else dates.today_jst().replace(day=1)
+            except dates.DateParseError:
+                await interaction.followup.send("月の形式が正しくありません。yyyy/mm などで入力してください。", ephemeral=True)
+                return
 
-            # 結果をユーザーに送信
-            await interaction.followup.send(response_message)
+            end_obj = dates.next_month(start_obj)
+            label = start_obj.strftime("%Y年%m月")
+            await _send_range(interaction, "list_month", f"🗓️ {label} の予定", start_obj, end_obj, f"{label} の予定はありません。")
 
-        except Exception as e:
-            print(f"[/list_day] 予期しないエラー: {e}")
-            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
\ No newline at end of file
+        except Exception:
+            instrumentation.command_failed("list_month")
+            await interaction.followup.send("予期しないエラーが発生しました。", ephemeral=True)
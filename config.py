@@ -1,42 +1,279 @@
 # config.py
 import os
 import json
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
 from dotenv import load_dotenv
 
+import instrumentation
+
+log = instrumentation.get_logger(__name__)
+
 # 環境変数の読み込み
 load_dotenv()
 
 # Discord Botの設定
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
+# 最後にDiscordへ同期したコマンド定義のハッシュの保存先
+COMMAND_SYNC_HASH_PATH = os.getenv("COMMAND_SYNC_HASH_PATH", "data/command_sync_hash")
 
 # Google Calendarの設定
 GOOGLE_CALENDAR_CREDENTIALS_PATH = os.getenv("GOOGLE_CALENDAR_CREDENTIALS_PATH")
 GOOGLE_CALENDAR_SCOPES = ['https://www.googleapis.com/auth/calendar']
 GOOGLE_CALENDAR_ID = os.getenv("GOOGLE_CALENDAR_ID")
+# Calendar APIの送信ペース (プロジェクトのクォータに合わせて設定)
+CALENDAR_API_RATE = float(os.getenv("CALENDAR_API_RATE", "5")) # 1秒あたりのリクエスト数
+CALENDAR_API_BURST = int(os.getenv("CALENDAR_API_BURST", "10")) # 瞬間的に許容するリクエスト数
+
+# イベントミラー (ローカルキャッシュ) の設定
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", "data/event_store.json")
+EVENT_SYNC_INTERVAL = int(os.getenv("EVENT_SYNC_INTERVAL", "60")) # 差分同期の間隔 (秒)
+EVENT_STORE_MAX_STALENESS = int(os.getenv("EVENT_STORE_MAX_STALENESS", "300")) # この秒数以上同期できていなければAPIに問い合わせる
+
+# 書き込みキュー (予定の追加・変更・削除をSQLiteに記録してすぐに応答し、バックグラウンドで反映する)
+DURABLE_WRITES = os.getenv("DURABLE_WRITES", "").lower() in ("1", "true", "yes")
+WRITE_QUEUE_PATH = os.getenv("WRITE_QUEUE_PATH", "data/write_queue.sqlite3")
+
+# メトリクスの公開先 (Prometheus形式の /metrics と /metrics.json)。ポートを0にすると無効
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# 翌日 (または翌週) の予定のまとめを送る時刻 (JST, "HH:MM")。未設定なら送らない
+DIGEST_TIME = os.getenv("DIGEST_TIME", "")
+DIGEST_DAYS = int(os.getenv("DIGEST_DAYS", "1")) # まとめに含める日数 (翌日から数える。7なら1週間分)
+DIGEST_WEEKDAY = int(os.getenv("DIGEST_WEEKDAY")) if os.getenv("DIGEST_WEEKDAY") else None # 0=月曜。指定した曜日だけ送る
+DIGEST_SEND_INTERVAL = float(os.getenv("DIGEST_SEND_INTERVAL", "1.0")) # 宛先ごとの送信間隔 (秒)
+
+# Calendar APIの呼び出しとミラーを任せるワーカープロセスの数 (0ならゲートウェイと同じプロセスで処理する)
+CALENDAR_WORKERS = int(os.getenv("CALENDAR_WORKERS", "0"))
+CALENDAR_WORKER_TIMEOUT = float(os.getenv("CALENDAR_WORKER_TIMEOUT", "60")) # ワーカーの応答を待つ最大秒数 (読み取りのみ。書き込みは時間切れにしない)
+
+# Discordのシャード数 (未設定ならDiscordの推奨値を使う)
+DISCORD_SHARD_COUNT = int(os.getenv("DISCORD_SHARD_COUNT")) if os.getenv("DISCORD_SHARD_COUNT") else None
+
+# config.jsonから読み込む設定 (ファイルの更新時刻が変わると自動で再読み込みされる)
+CONFIG_FILE_PATH = os.getenv("CONFIG_FILE_PATH", "config/config.json")
+CONFIG_CHECK_INTERVAL = 1.0 # 更新時刻を確認する最短間隔 (秒)
+
+
+# 操作対象のカレンダーと、それを操作する認証情報ファイルの組
+CalendarTarget = namedtuple("CalendarTarget", ["calendar_id", "credentials_path"])
+
+
+class ConfigSnapshot:
+    """
+    ある時点のconfig.jsonの内容。読み取り専用の構造で保持し、コマンドからそのまま参照します。
+    allowed_user_ids は frozenset、pairings は int -> int、calendars は (サーバーID, チャンネルID) -> CalendarTarget、
+    user_calendars は ユーザーID -> 個人のカレンダーID、webhooks は サーバーID -> 通知用のWebhook URL の読み取り専用マップです。
+    """
+    __slots__ = ("allowed_users", "allowed_user_ids", "pairings", "calendars", "user_calendars", "webhooks", "raw")
+
+    def __init__(self, allowed_users, pairings, raw, calendars=None, user_calendars=None, webhooks=None):
+        # allowed_users は (名前, ユーザーID) の組の並び。許可するIDは名前の重複に関係なく全員分を持つ
+        self.allowed_users = MappingProxyType(dict(allowed_users)) # 名前 -> ユーザーID
+        self.allowed_user_ids = frozenset(user_id for _, user_id in allowed_users)
+        self.pairings = MappingProxyType(pairings) # ユーザーID -> 相手のユーザーID
+        self.calendars = MappingProxyType(calendars or {}) # チャンネルIDが None のキーはサーバー全体の設定
+        self.user_calendars = MappingProxyType(user_calendars or {}) # /free で空き時間の確認に使う
+        self.webhooks = MappingProxyType(webhooks or {}) # ペアリング通知・予定のまとめの送信先
+        self.raw = MappingProxyType(raw)
+
+
+def _parse_user_id(value, where):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{where} のユーザーID '{value}' が数値ではありません。")
+
+def _parse_calendar(entry, where, default_credentials):
+    if not isinstance(entry, dict) or not entry.get("calendar_id"):
+        raise ValueError(f"{where} に calendar_id がありません。")
+    credentials_path = entry.get("credentials_path") or default_credentials
+    if not credentials_path:
+        raise ValueError(f"{where} に credentials_path がなく、GOOGLE_CALENDAR_CREDENTIALS_PATH も設定されていません。")
+    return CalendarTarget(entry["calendar_id"], credentials_path)
+
+def _parse_guilds(raw_guilds):
+    """
+    guilds セクションを (サーバーID, チャンネルID) -> CalendarTarget のマップと、サーバーID -> Webhook URL のマップに変換します。
+    例: {"<サーバーID>": {"calendar_id": "...", "credentials_path": "...", "webhook_url": "...", "channels": {"<チャンネルID>": {"calendar_id": "..."}}}}
+    credentials_path を省略するとサーバーの設定、それもなければ GOOGLE_CALENDAR_CREDENTIALS_PATH を使います。
+    """
+    if not isinstance(raw_guilds, dict):
+        raise ValueError("guilds はオブジェクトである必要があります。")
+    calendars = {}
+    webhooks = {}
+    for guild_key, guild in raw_guilds.items():
+        guild_id = _parse_user_id(guild_key, "guilds")
+        if not isinstance(guild, dict):
+            raise ValueError(f"guilds[{guild_key}] はオブジェクトである必要があります。")
+        webhook_url = guild.get("webhook_url")
+        if webhook_url is not None:
+            if not isinstance(webhook_url, str) or not webhook_url.startswith("https://"):
+                raise ValueError(f"guilds[{guild_key}].webhook_url は https:// で始まるURLである必要があります。")
+            webhooks[guild_id] = webhook_url
+        guild_credentials = guild.get("credentials_path") or GOOGLE_CALENDAR_CREDENTIALS_PATH
+        if guild.get("calendar_id"):
+            calendars[(guild_id, None)] = _parse_calendar(guild, f"guilds[{guild_key}]", guild_credentials)
+        channels = guild.get("channels", {})
+        if not isinstance(channels, dict):
+            raise ValueError(f"guilds[{guild_key}].channels はオブジェクトである必要があります。")
+        for channel_key, channel in channels.items():
+            channel_id = _parse_user_id(channel_key, f"guilds[{guild_key}].channels")
+            calendars[(guild_id, channel_id)] = _parse_calendar(channel, f"guilds[{guild_key}].channels[{channel_key}]", guild_credentials)
+    return calendars, webhooks
 
-# config.jsonから読み込む設定
-CONFIG_FILE_PATH = "config/config.json"
-allowed_users_data = {}
-user_pairings = {}
-
-try:
-    with open(CONFIG_FILE_PATH, "r") as f:
-        config_data = json.load(f)
-    allowed_users_data = {user["name"]: user["id"] for user in config_data.get("allowed_users", [])}
-    user_pairings = config_data.get("pairings", {})
-except FileNotFoundError:
-    print(f"Error: Config file not found at {CONFIG_FILE_PATH}")
-except json.JSONDecodeError:
-    print(f"Error: Could not decode JSON from {CONFIG_FILE_PATH}")
-except Exception as e:
-    print(f"An unexpected error occurred while loading config: {e}")
-
-# 設定値にアクセスするためのシンプルな関数や変数として公開
+def parse_config(data):
+    """config.jsonの内容を検証し、ConfigSnapshot を返します。不正な場合は ValueError を送出します。"""
+    if not isinstance(data, dict):
+        raise ValueError("設定ファイルのトップレベルはオブジェクトである必要があります。")
+
+    allowed_users = []
+    for index, user in enumerate(data.get("allowed_users", [])):
+        if not isinstance(user, dict) or "id" not in user:
+            raise ValueError(f"allowed_users[{index}] に id がありません。")
+        allowed_users.append((user.get("name", str(user["id"])), _parse_user_id(user["id"], f"allowed_users[{index}]")))
+
+    raw_pairings = data.get("pairings", {})
+    if not isinstance(raw_pairings, dict):
+        raise ValueError("pairings はオブジェクトである必要があります。")
+    pairings = {}
+    for user_id, partner_id in raw_pairings.items():
+        pairings[_parse_user_id(user_id, "pairings")] = _parse_user_id(partner_id, f"pairings[{user_id}]")
+    if data.get("bidirectional_pairings", False):
+        # 片方向しか書かれていないペアを逆方向にも登録する
+        for user_id, partner_id in list(pairings.items()):
+            pairings.setdefault(partner_id, user_id)
+
+    calendars, webhooks = _parse_guilds(data.get("guilds", {}))
+
+    # 各ユーザーの個人カレンダー (サービスアカウントに共有されているもの)。例: {"<ユーザーID>": "someone@gmail.com"}
+    raw_user_calendars = data.get("user_calendars", {})
+    if not isinstance(raw_user_calendars, dict):
+        raise ValueError("user_calendars はオブジェクトである必要があります。")
+    user_calendars = {}
+    for user_id, calendar_id in raw_user_calendars.items():
+        if not isinstance(calendar_id, str) or not calendar_id:
+            raise ValueError(f"user_calendars[{user_id}] にカレンダーIDがありません。")
+        user_calendars[_parse_user_id(user_id, "user_calendars")] = calendar_id
+    return ConfigSnapshot(allowed_users, pairings, data, calendars, user_calendars, webhooks)
+
+
+class ConfigService:
+    """
+    config.jsonを保持し、更新時刻が変わったら読み込み直すサービス。
+    新しい内容は検証してから丸ごと差し替え、検証に失敗した場合は最後に正常だった設定を使い続けます。
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._snapshot = ConfigSnapshot([], {}, {})
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """設定ファイルを読み込み直します。成功した場合は True を返します。"""
+        with self._lock:
+            try:
+                mtime = os.stat(self._path).st_mtime_ns
+            except FileNotFoundError:
+                log.error("config file not found", extra={"path": self._path})
+                return False
+            # 失敗した場合も更新時刻は記録し、ファイルが再び変更されるまで読み直さない
+            self._mtime = mtime
+            try:
+                with open(self._path, "r") as f:
+                    snapshot = parse_config(json.load(f))
+            except json.JSONDecodeError:
+                log.error("could not decode config JSON", extra={"path": self._path})
+                return False
+            except ValueError as e:
+                log.error("invalid config, keeping the last valid config", extra={"path": self._path, "error": str(e)})
+                return False
+            except Exception:
+                log.exception("unexpected error while loading config", extra={"path": self._path})
+                return False
+            self._snapshot = snapshot # 参照の差し替えだけなので読み手からは常に一貫した内容が見える
+            return True
+
+    def current(self):
+        """最新の設定を返します。一定間隔ごとにファイルの更新時刻を確認します。"""
+        now = time.monotonic()
+        if now - self._last_check >= CONFIG_CHECK_INTERVAL:
+            self._last_check = now
+            try:
+                mtime = os.stat(self._path).st_mtime_ns
+            except OSError:
+                mtime = self._mtime
+            if mtime != self._mtime:
+                self.reload()
+        return self._snapshot
+
+
+config_service = ConfigService(CONFIG_FILE_PATH)
+
+# 設定値にアクセスするためのシンプルな関数として公開 (呼び出しごとの新しいオブジェクト生成はしない)
 def get_allowed_user_ids():
-    """許可されたユーザーのIDリストを返します。"""
-    return [user["id"] for user in config_data.get("allowed_users", [])]
+    """許可されたユーザーIDの frozenset を返します。"""
+    return config_service.current().allowed_user_ids
 
 def get_user_pairings():
-    """ユーザーのペアリング情報を返します。"""
-    return user_pairings
\ No newline at end of file
+    """ユーザーIDから相手のユーザーIDを引く読み取り専用マップを返します。"""
+    return config_service.current().pairings
+
+def get_user_calendars():
+    """ユーザーIDから個人のカレンダーIDを引く読み取り専用マップを返します。"""
+    return config_service.current().user_calendars
+
+def default_calendar_target():
+    """環境変数で指定された既定のカレンダーを返します。設定されていなければ None を返します。"""
+    if GOOGLE_CALENDAR_ID and GOOGLE_CALENDAR_CREDENTIALS_PATH:
+        return CalendarTarget(GOOGLE_CALENDAR_ID, GOOGLE_CALENDAR_CREDENTIALS_PATH)
+    return None
+
+def get_calendar_targets():
+    """設定されているすべてのカレンダーを重複なく返します。guilds が空なら既定のカレンダーだけです。"""
+    calendars = config_service.current().calendars
+    if not calendars:
+        target = default_calendar_target()
+        return [target] if target else []
+    return list(dict.fromkeys(calendars.values()))
+
+def get_calendar_target(guild_id, channel_id=None):
+    """
+    サーバー (とチャンネル) に割り当てられたカレンダーを返します。チャンネルの設定がサーバーの設定より優先されます。
+    guilds が1つも設定されていない場合だけ既定のカレンダーを使います (別のコミュニティのカレンダーを誤って操作しないため)。
+    """
+    calendars = config_service.current().calendars
+    if not calendars:
+        return default_calendar_target()
+    if guild_id is None:
+        return None
+    return calendars.get((guild_id, channel_id)) or calendars.get((guild_id, None))
+
+def get_guild_webhook(guild_id):
+    """
+    サーバーの通知用のWebhook URLを返します。guilds が1つも設定されていない場合だけ DISCORD_WEBHOOK_URL を使います。
+    サーバーごとに設定がなければ None を返し、呼び出し側はコマンドのチャンネル (まとめの場合はDM) に送ります
+    (1つのWebhookに全サーバーの予定が流れないようにするため)。
+    """
+    snapshot = config_service.current()
+    if not snapshot.calendars:
+        return DISCORD_WEBHOOK_URL or None
+    if guild_id is None:
+        return None
+    return snapshot.webhooks.get(guild_id)
+
+def get_target_webhooks(target):
+    """
+    カレンダーが割り当てられている各サーバーのWebhook URLを重複なく返します。Webhookのないサーバーの分は None です。
+    guilds が1つも設定されていなければ空のリストを返します。
+    """
+    snapshot = config_service.current()
+    guild_ids = dict.fromkeys(guild_id for (guild_id, _), calendar in snapshot.calendars.items() if calendar == target)
+    return list(dict.fromkeys(snapshot.webhooks.get(guild_id) for guild_id in guild_ids))
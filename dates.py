@@ -0,0 +1,127 @@
+# dates.py
+import re
+import unicodedata
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+from dateutil import parser
+
+JST = timezone(timedelta(hours=9))
+# 解析結果をキャッシュする件数 (キーは入力と「今日」の日付)
+PARSE_CACHE_SIZE = 1024
+
+# よく使われる形式は正規表現で直接解析し、dateutil は最後の手段としてだけ使う
+_FULL_DATE = re.compile(r"(\d{4})[/\-.年](\d{1,2})[/\-.月](\d{1,2})日?")
+_ISO_DATETIME = re.compile(r"(\d{4})-(\d{2})-(\d{2})[t ][\d:.]+(?:z|[+\-]\d{2}:?\d{2})?") # 小文字化した後に照合する
+_COMPACT_DATE = re.compile(r"(\d{4})(\d{2})(\d{2})")
+_MONTH_DAY = re.compile(r"(\d{1,2})[/\-.月](\d{1,2})日?")
+_YEAR_MONTH = re.compile(r"(\d{4})[/\-.年](\d{1,2})月?")
+_MONTH_ONLY = re.compile(r"(\d{1,2})月?")
+_WEEKDAY = re.compile(r"(今週|来週|再来週)?の?([月火水木金土日])曜日?")
+
+_RELATIVE_DAYS = {
+    "今日": 0, "きょう": 0, "本日": 0, "today": 0,
+    "明日": 1, "あした": 1, "あす": 1, "tomorrow": 1,
+    "明後日": 2, "あさって": 2,
+    "昨日": -1, "きのう": -1, "yesterday": -1,
+}
+_RELATIVE_MONTHS = {"今月": 0, "来月": 1, "先月": -1}
+_WEEKDAYS = "月火水木金土日"
+_WEEK_OFFSETS = {None: 0, "今週": 0, "来週": 1, "再来週": 2}
+
+
+class DateParseError(ValueError):
+    """日付として解析できない入力が渡されたときに送出される例外。"""
+
+
+def today_jst():
+    """JSTの今日の日付を返します (サーバーのタイムゾーンに依存しない)。"""
+    return datetime.now(JST).date()
+
+def _normalize(text):
+    # 全角数字や全角スラッシュを半角にそろえ、英字は小文字にする
+    return unicodedata.normalize("NFKC", text).strip().lower()
+
+def _make_date(year, month, day, text):
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        raise DateParseError(f"存在しない日付です: {text}") from None
+
+def _weekday(prefix, name, today):
+    """「金曜」は今日以降で最初の金曜日、「来週金曜」は来週 (月曜始まり) の金曜日を返します。"""
+    target = _WEEKDAYS.index(name)
+    if prefix is None:
+        return today + timedelta(days=(target - today.weekday()) % 7)
+    monday = today - timedelta(days=today.weekday())
+    return monday + timedelta(weeks=_WEEK_OFFSETS[prefix], days=target)
+
+def _parse_slow(text, today):
+    try:
+        return parser.parse(text, yearfirst=True, default=datetime(today.year, today.month, today.day)).date()
+    except (parser.ParserError, ValueError, OverflowError):
+        raise DateParseError(f"日付を解析できません: {text}") from None
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_date(text, today):
+    normalized = _normalize(text)
+    if not normalized:
+        raise DateParseError("日付が入力されていません。")
+    if normalized in _RELATIVE_DAYS:
+        return today + timedelta(days=_RELATIVE_DAYS[normalized])
+    match = _FULL_DATE.fullmatch(normalized) or _ISO_DATETIME.fullmatch(normalized) or _COMPACT_DATE.fullmatch(normalized)
+    if match:
+        return _make_date(*match.groups(), text)
+    match = _MONTH_DAY.fullmatch(normalized)
+    if match:
+        # 年を省略した場合は今年として扱う (dateutil と同じ)
+        return _make_date(today.year, *match.groups(), text)
+    match = _WEEKDAY.fullmatch(normalized)
+    if match:
+        return _weekday(match.group(1), match.group(2), today)
+    return _parse_slow(normalized, today)
+
+def parse_date(text, today=None):
+    """
+    ユーザーが入力した日付を date に変換します。解析できなければ DateParseError を送出します。
+    yyyy/mm/dd・mm/dd・m/d・ISO形式・「今日」「明日」「明後日」「金曜」「来週月曜」などに対応します。
+    結果は入力と今日の日付の組ごとにキャッシュされます (日付が変われば「明日」の結果も変わる)。
+    """
+    return _parse_date(text, today or today_jst())
+
+def format_date(text, today=None):
+    """parse_date の結果を YYYY-MM-DD 形式の文字列で返します。"""
+    return parse_date(text, today).isoformat()
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_month(text, today):
+    normalized = _normalize(text)
+    if normalized in _RELATIVE_MONTHS:
+        index = today.year * 12 + today.month - 1 + _RELATIVE_MONTHS[normalized]
+        return date(index // 12, index % 12 + 1, 1)
+    match = _YEAR_MONTH.fullmatch(normalized)
+    if match:
+        return _make_date(*match.groups(), 1, text)
+    match = _MONTH_ONLY.fullmatch(normalized)
+    if match:
+        return _make_date(today.year, match.group(1), 1, text)
+    return _parse_date(text, today).replace(day=1)
+
+def parse_month(text, today=None):
+    """「2026/10」「10月」「来月」のような月の指定を、その月の1日の date に変換します。"""
+    return _parse_month(text, today or today_jst())
+
+
+def next_month(day):
+    """day の翌月の1日を返します。"""
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def range_bounds(start_day, end_day):
+    """start_day の 00:00 JST から end_day の 00:00 JST までを表すRFC3339形式の (timeMin, timeMax) を返します。"""
+    return f"{start_day.isoformat()}T00:00:00+09:00", f"{end_day.isoformat()}T00:00:00+09:00"
+
+def day_bounds(day, days=1):
+    """day (date または YYYY-MM-DD) から days 日間の (timeMin, timeMax) を返します。"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return range_bounds(day, day + timedelta(days=days))
@@ -0,0 +1,173 @@
+# digest.py
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import calendars
+import config
+import dates
+import google_calendar
+import instrumentation
+import notifications
+from dates import JST
+from pagination import format_event_line
+
+DIGEST_SENT = instrumentation.register(
+    instrumentation.Counter("sharedule_digest_messages_total", "Scheduled digest messages queued for delivery.")
+)
+
+log = instrumentation.get_logger(__name__)
+
+
+def parse_time(text):
+    """"HH:MM" を (時, 分) に変換します。空文字や不正な値なら None を返します。"""
+    try:
+        hour, minute = (int(part) for part in text.split(":"))
+    except ValueError:
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    return hour, minute
+
+def next_run(now, hour, minute, weekday=None):
+    """now より後で、指定した時刻 (と曜日) に当たる最初の日時を返します。"""
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run <= now:
+        run += timedelta(days=1)
+    if weekday is not None:
+        run += timedelta(days=(weekday - run.weekday()) % 7)
+    return run
+
+def group_by_participant(events):
+    """イベントを追加したユーザーのIDごとにまとめます。ボット以外から追加された予定は None にまとめます。"""
+    grouped = defaultdict(list)
+    for event in events:
+        grouped[google_calendar.event_creator(event)].append(event)
+    return grouped
+
+def compose(user_id, partner_id, grouped, label, with_date=False):
+    """1人分のまとめの本文を返します。本人・相手・その他の順に並べ、予定がなければ None を返します。"""
+    sections = [
+        ("あなたの予定", grouped.get(user_id, [])),
+        (f"<@{partner_id}> さんの予定", grouped.get(partner_id, [])),
+        ("その他の予定", grouped.get(None, [])),
+    ]
+    lines = [f"<@{user_id}> さんへ: 🗓️ **{label}の予定**"]
+    for title, events in sections:
+        if not events:
+            continue
+        events = sorted(events, key=lambda event: event['start'].get('date') or event['start'].get('dateTime'))
+        lines.append(f"__{title}__")
+        lines.extend(format_event_line(event, with_date=with_date) for event in events)
+    return "\n".join(lines) if len(lines) > 1 else None
+
+
+class DigestScheduler:
+    """
+    毎日決まった時刻に、ペアリングしている各ユーザーへ翌日 (または翌週) の予定のまとめを送るバックグラウンドタスク。
+    カレンダーごとに期間全体を1回の範囲取得 (ミラーが新しければメモリ) で読み、ユーザーごとの振り分けはメモリ上で行います。
+    """
+
+    def __init__(self, client, at, days=1, weekday=None, send_interval=1.0):
+        self._client = client
+        self._at = at # (時, 分)
+        self._days = days
+        self._weekday = weekday
+        self._send_interval = send_interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            now = datetime.now(JST)
+            run_at = next_run(now, *self._at, weekday=self._weekday)
+            await asyncio.sleep((run_at - now).total_seconds())
+            try:
+                await self.run_once(run_at.date())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("予定のまとめの送信中にエラーが発生しました")
+
+    async def _collect(self, start_day, end_day):
+        """
+        すべてのカレンダーの期間内の予定を、送信先のWebhook URLごと・追加したユーザーごとにまとめて返します。
+        カレンダーの予定は割り当てられたサーバーのWebhookにだけ送り、Webhookのないサーバーの分は None (DM) にまとめます。
+        """
+        time_min, time_max = dates.range_bounds(start_day, end_day)
+        targets = config.get_calendar_targets()
+        destinations = defaultdict(lambda: defaultdict(list))
+        for target in targets:
+            events, error = await google_calendar.list_events_in_range(time_min, time_max, calendar=calendars.get_calendar(target))
+            if events is None:
+                log.warning("まとめ用の予定を取得できませんでした", extra={"calendar_id": target.calendar_id, "error": error})
+                continue
+            webhooks = config.get_target_webhooks(target) or [None]
+            for user_id, user_events in group_by_participant(events).items():
+                # 誰が追加したか分からない予定は、どのサーバーの利用者か判断できないためカレンダーが1つのときだけ含める
+                if user_id is None and len(targets) > 1:
+                    continue
+                for webhook_url in webhooks:
+                    destinations[webhook_url][user_id].extend(user_events)
+        return destinations
+
+    async def _destination(self, user_id):
+        """guilds が設定されていなければ DISCORD_WEBHOOK_URL に送り、それもなければ本人へのDMで送ります。"""
+        webhook_url = config.get_guild_webhook(None)
+        if webhook_url:
+            return None, webhook_url
+        return self._client.get_user(user_id) or await self._client.fetch_user(user_id), None
+
+    async def run_once(self, today=None):
+        """today の翌日から days 日分のまとめを、ペアリングしている各ユーザーに送ります。送った件数を返します。"""
+        today = today or dates.today_jst()
+        start_day = today + timedelta(days=1)
+        end_day = start_day + timedelta(days=self._days)
+        destinations = await self._collect(start_day, end_day)
+        if self._days == 1:
+            label = f"明日 ({start_day.isoformat()}) "
+        else:
+            label = f"{start_day.isoformat()} 〜 {(end_day - timedelta(days=1)).isoformat()} "
+
+        queue = notifications.get_queue()
+        sent = 0
+        for webhook_url, grouped in destinations.items():
+            for user_id, partner_id in config.get_user_pairings().items():
+                if webhook_url and not (grouped.get(user_id) or grouped.get(partner_id)):
+                    continue # このサーバーのカレンダーを使っていないユーザーのまとめはサーバーに送らない
+                content = compose(user_id, partner_id, grouped, label, with_date=self._days > 1)
+                if content is None:
+                    continue
+                try:
+                    if webhook_url:
+                        queue.send(user_id, content, webhook_url=webhook_url)
+                    else:
+                        channel, fallback_url = await self._destination(user_id)
+                        queue.send(user_id, content, channel=channel, webhook_url=fallback_url)
+                except Exception as e:
+                    log.warning("予定のまとめの宛先を取得できませんでした", extra={"user_id": user_id, "error": str(e)})
+                    continue
+                DIGEST_SENT.inc()
+                sent += 1
+                # 宛先ごとに間隔を空け、Discordのレート制限に一度に当たらないようにする
+                await asyncio.sleep(self._send_interval)
+        log.info("予定のまとめを送信しました", extra={"recipients": sent, "start": start_day.isoformat(), "days": self._days})
+        return sent
+
+
+def from_config(client):
+    """環境変数の設定からスケジューラを作ります。DIGEST_TIME が未設定または不正なら None を返します。"""
+    at = parse_time(config.DIGEST_TIME) if config.DIGEST_TIME else None
+    if at is None:
+        if config.DIGEST_TIME:
+            log.error("DIGEST_TIME は HH:MM 形式で指定してください", extra={"value": config.DIGEST_TIME})
+        return None
+    return DigestScheduler(client, at, days=config.DIGEST_DAYS, weekday=config.DIGEST_WEEKDAY, send_interval=config.DIGEST_SEND_INTERVAL)
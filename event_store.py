@@ -0,0 +1,332 @@
+# event_store.py
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import config
+import calendar_api
+import dates
+import instrumentation
+import recurrence
+from dates import JST
+from calendar_api import CalendarAPIError, LIST_FIELDS
+
+# 1回のlistで取得する最大件数 (APIの上限は2500)
+SYNC_PAGE_SIZE = 2500
+STORE_FILE_VERSION = 3 # 2: 追加したユーザーの記録 (extendedProperties) を含む / 3: 繰り返しの予定を展開せずに保持する
+
+log = instrumentation.get_logger(__name__)
+
+
+def event_span(event):
+    """イベントの開始・終了をJSTのaware datetimeで返します。終日イベントは日付の0時として扱います。"""
+    start = event.get('start', {})
+    end = event.get('end', {})
+    if 'date' in start:
+        start_dt = datetime.strptime(start['date'], "%Y-%m-%d").replace(tzinfo=JST)
+        end_dt = datetime.strptime(end.get('date', start['date']), "%Y-%m-%d").replace(tzinfo=JST)
+        # このボットは開始日と終了日を同じ日付で登録するため、最低1日として扱う
+        if end_dt <= start_dt:
+            end_dt = start_dt + timedelta(days=1)
+    else:
+        start_dt = datetime.fromisoformat(start['dateTime']).astimezone(JST)
+        end_dt = datetime.fromisoformat(end.get('dateTime', start['dateTime'])).astimezone(JST)
+    return start_dt, end_dt
+
+def _dates_of(event):
+    """イベントがかかっているJSTの日付 (YYYY-MM-DD) を列挙します。"""
+    start_dt, end_dt = event_span(event)
+    day = start_dt.date()
+    last_day = (end_dt - timedelta(microseconds=1)).date() if end_dt > start_dt else day
+    while day <= last_day:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class EventStore:
+    """
+    1つのカレンダーのイベントをプロセス内に保持するミラー。
+    起動時に一度だけ全件同期し、以降はsyncTokenによる差分同期で追従します。
+    自分たちの追加・変更・削除は apply() / remove() で即座に反映します (write-through)。
+    繰り返しの予定は元の予定と例外だけを保持し、読み取りのたびに期間内の回を展開します。
+    """
+
+    def __init__(self, api, path=None, sync_interval=60, max_staleness=300):
+        self._api = api
+        self._path = path
+        self._sync_interval = sync_interval
+        self._max_staleness = max_staleness
+        self._reset()
+        self._sync_token = None
+        self._last_synced = 0.0
+        self._sync_lock = asyncio.Lock()
+        self._task = None
+
+    def _reset(self):
+        self._events = {} # イベントID -> イベント (繰り返しの元の予定・取り消された回も含む)
+        self._by_date = defaultdict(set) # 'YYYY-MM-DD' -> イベントIDの集合 (日付の決まっている予定だけ)
+        self._masters = {} # 繰り返しの元の予定のID -> イベント
+        self._overridden = defaultdict(set) # 繰り返しの元の予定のID -> 例外で変更・削除された回の instance_key
+
+    # --- 読み取り ---
+
+    def is_fresh(self):
+        """全件同期済みで、最後の同期から時間が経ちすぎていなければ True を返します。"""
+        return self._sync_token is not None and time.time() - self._last_synced <= self._max_staleness
+
+    def get(self, event_id):
+        """イベントを返します。繰り返しの予定の1回分のIDなら、元の予定から展開して返します。"""
+        event = self._events.get(event_id)
+        if event is not None:
+            return None if event.get('status') == 'cancelled' else event
+        parts = recurrence.split_instance_id(event_id)
+        master = self._masters.get(parts[0]) if parts else None
+        if master is None:
+            return None
+        time_min, _ = recurrence.key_start(parts[1])
+        for instance in recurrence.expand_master(master, time_min, time_min + timedelta(seconds=1), self._overridden.get(parts[0], ())):
+            if instance['id'] == event_id:
+                return instance
+        return None
+
+    def _expand_masters(self, time_min, time_max):
+        instances = []
+        for master_id, master in self._masters.items():
+            instances.extend(recurrence.expand_master(master, time_min, time_max, self._overridden.get(master_id, ())))
+        return instances
+
+    def events_on(self, date_str):
+        """指定日 (YYYY-MM-DD, JST) のイベントを開始時刻順で返します。"""
+        events = [self._events[event_id] for event_id in self._by_date.get(date_str, ())]
+        if self._masters:
+            time_min, time_max = dates.day_bounds(date_str)
+            events.extend(self._expand_masters(datetime.fromisoformat(time_min), datetime.fromisoformat(time_max)))
+        events.sort(key=lambda event: event_span(event)[0])
+        return events
+
+    def events_in_range(self, time_min_str, time_max_str):
+        """指定された時間範囲 (RFC3339形式文字列) と重なるイベントを開始時刻順で返します。"""
+        time_min = datetime.fromisoformat(time_min_str).astimezone(JST)
+        time_max = datetime.fromisoformat(time_max_str).astimezone(JST)
+        seen = set()
+        matched = []
+        day = time_min.date()
+        while day <= time_max.date():
+            for event_id in self._by_date.get(day.isoformat(), ()):
+                if event_id in seen:
+                    continue
+                seen.add(event_id)
+                event = self._events[event_id]
+                start_dt, end_dt = event_span(event)
+                if start_dt < time_max and end_dt > time_min:
+                    matched.append((start_dt, event))
+            day += timedelta(days=1)
+        matched.extend((event_span(event)[0], event) for event in self._expand_masters(time_min, time_max))
+        matched.sort(key=lambda item: item[0])
+        return [event for _, event in matched]
+
+    # --- 書き込み ---
+
+    def apply(self, event):
+        """イベントを追加・更新します。キャンセル済みのイベントは削除として扱います。"""
+        self._discard(event['id'])
+        if recurrence.is_exception(event) and 'originalStartTime' in event:
+            # 繰り返しの1回分の変更・削除は、元の予定からその回を展開しないように記録しておく
+            self._events[event['id']] = event
+            self._overridden[event['recurringEventId']].add(recurrence.original_key(event))
+            if event.get('status') == 'cancelled':
+                return
+        elif event.get('status') == 'cancelled':
+            return
+        self._events[event['id']] = event
+        if recurrence.is_master(event):
+            self._masters[event['id']] = event
+            return
+        for date_str in _dates_of(event):
+            self._by_date[date_str].add(event['id'])
+
+    def remove(self, event_id):
+        """イベントを削除します。繰り返しの予定の1回分のIDなら、その回だけを取り消します。"""
+        event = self._events.get(event_id)
+        if event is not None and recurrence.is_exception(event) and 'originalStartTime' in event:
+            # 変更済みの回を削除しても、元の予定からその回が再び展開されないようにする
+            self.apply({'id': event_id, 'status': 'cancelled', 'recurringEventId': event['recurringEventId'],
+                        'originalStartTime': event['originalStartTime']})
+            return
+        if event is None:
+            parts = recurrence.split_instance_id(event_id)
+            if parts and parts[0] in self._masters:
+                self.apply(recurrence.cancelled_instance(event_id, *parts))
+            return
+        self._discard(event_id)
+
+    def _discard(self, event_id):
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+        if self._masters.pop(event_id, None) is not None:
+            return
+        if recurrence.is_exception(event) and 'originalStartTime' in event:
+            self._overridden[event['recurringEventId']].discard(recurrence.original_key(event))
+            if event.get('status') == 'cancelled':
+                return
+        for date_str in _dates_of(event):
+            ids = self._by_date.get(date_str)
+            if ids is not None:
+                ids.discard(event_id)
+                if not ids:
+                    del self._by_date[date_str]
+
+    # --- 同期 ---
+
+    async def _list_all(self, **params):
+        """全ページを取得し、(イベントのリスト, nextSyncToken) を返します。繰り返しの予定はサーバー側で展開させません。"""
+        items = []
+        page_token = None
+        while True:
+            result = await self._api.list_events(
+                singleEvents=False, maxResults=SYNC_PAGE_SIZE, pageToken=page_token, fields=LIST_FIELDS, **params
+            )
+            items.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return items, result.get('nextSyncToken')
+
+    async def full_sync(self):
+        """カレンダー全体を取得し直してミラーを置き換えます。"""
+        items, sync_token = await self._list_all()
+        self._reset()
+        for event in items:
+            self.apply(event)
+        self._sync_token = sync_token
+        self._last_synced = time.time()
+        log.info("イベントミラーを全件同期しました", extra={"events": len(self._events)})
+        return len(items)
+
+    async def incremental_sync(self):
+        """前回のsyncToken以降の変更だけを取得して反映します。トークンが失効していれば全件同期します。"""
+        try:
+            items, sync_token = await self._list_all(syncToken=self._sync_token)
+        except CalendarAPIError as error:
+            if error.status != 410:
+                raise
+            log.info("syncTokenが失効したため、イベントミラーを全件同期し直します。")
+            return await self.full_sync()
+        for event in items:
+            self.apply(event)
+        self._sync_token = sync_token
+        self._last_synced = time.time()
+        return len(items)
+
+    async def sync(self):
+        async with self._sync_lock:
+            if self._sync_token is None:
+                changed = await self.full_sync()
+            else:
+                changed = await self.incremental_sync()
+        if changed:
+            await self.save()
+        return changed
+
+    async def _sync_loop(self):
+        # 初回同期もバックグラウンドで行い、起動を待たせない (同期が終わるまではAPIに問い合わせる)
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("イベントミラーの同期中にエラーが発生しました", extra={"error": str(e)})
+            await asyncio.sleep(self._sync_interval)
+
+    async def start(self):
+        """保存済みのミラーを読み込み、バックグラウンド同期を開始します。"""
+        if self._task is not None:
+            return
+        self.load()
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.save()
+
+    # --- 永続化 ---
+
+    def _snapshot(self):
+        return {
+            'version': STORE_FILE_VERSION,
+            'calendar_id': self._api.calendar_id,
+            'sync_token': self._sync_token,
+            'events': list(self._events.values()),
+        }
+
+    async def save(self):
+        """ミラーをファイルに保存します。書き込みはスレッドプールで行います。"""
+        if not self._path or self._sync_token is None:
+            return
+        snapshot = self._snapshot()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, _write_json_atomic, self._path, snapshot)
+        except Exception as e:
+            log.warning("イベントミラーの保存に失敗しました", extra={"error": str(e)})
+
+    def load(self):
+        """保存済みのミラーを読み込みます。読み込めた場合は次の同期が差分同期になります。"""
+        if not self._path:
+            return False
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            log.warning("イベントミラーの読み込みに失敗しました", extra={"error": str(e)})
+            return False
+        if data.get('version') != STORE_FILE_VERSION or data.get('calendar_id') != self._api.calendar_id:
+            return False
+        self._reset()
+        for event in data.get('events', []):
+            self.apply(event)
+        self._sync_token = data.get('sync_token')
+        # 読み込んだ直後は差分同期が終わるまで古いものとして扱う
+        self._last_synced = 0.0
+        return True
+
+
+def _write_json_atomic(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+_store = None
+
+def get_store():
+    """GOOGLE_CALENDAR_ID 用の共有イベントミラーを返します。"""
+    global _store
+    if _store is None:
+        _store = EventStore(
+            calendar_api.get_api(),
+            path=config.EVENT_STORE_PATH,
+            sync_interval=config.EVENT_SYNC_INTERVAL,
+            max_staleness=config.EVENT_STORE_MAX_STALENESS,
+        )
+    return _store
+
+def partition_path(calendar_id):
+    """カレンダーごとのミラーの保存先を返します (EVENT_STORE_PATH のファイル名にカレンダーIDのハッシュを付ける)。"""
+    if not config.EVENT_STORE_PATH:
+        return None
+    root, ext = os.path.splitext(config.EVENT_STORE_PATH)
+    return f"{root}-{hashlib.sha1(calendar_id.encode('utf-8')).hexdigest()[:12]}{ext}"
@@ -1,82 +1,221 @@
-from datetime import datetime, timedelta
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import config
-
-# 認証情報の取得とサービスの構築
-def _build_service():
-    """Google Calendar Serviceオブジェクトを構築します。"""
-    if not config.GOOGLE_CALENDAR_CREDENTIALS_PATH:
-        print("Google Calendarの認証情報ファイルのパスが設定されていません。")
-        return None
-    try:
-        creds = Credentials.from_service_account_file(config.GOOGLE_CALENDAR_CREDENTIALS_PATH, scopes=config.GOOGLE_CALENDAR_SCOPES)
-        service = build('calendar', 'v3', credentials=creds)
-        return service
-    except Exception as e:
-        print(f'Google Calendar Serviceの構築中にエラーが発生しました: {e}')
-        return None
+import asyncio
+import random
+import uuid
+import calendar_worker
+import calendars
+import dates
+import instrumentation
+import recurrence
+from datetime import datetime
+from request_scheduler import is_retryable
+from calendar_api import CalendarAPIError, BATCH_MAX_SIZE, EVENT_FIELDS, LIST_FIELDS
+
+# 一覧取得で1ページあたりに要求する件数 (APIの上限は2500)
+LIST_PAGE_SIZE = 2500
+# If-Match の etag が一致しなかった (412) ときのメッセージ
+CONFLICT_MESSAGE = "この予定は検索後に他の操作で変更されています。もう一度お試しください。"
+# 一括追加で失敗した項目を再送する最大回数
+BULK_MAX_RETRIES = 3
+# 予定を追加したDiscordユーザーのIDを記録する extendedProperties.private のキー
+CREATOR_PROPERTY = "sharedule_user"
+
+log = instrumentation.get_logger(__name__)
+
+# 操作対象のカレンダーの取得
+def _get_calendar(calendar):
+    """
+    操作対象のカレンダー (calendars.CalendarContext) を返します。省略時は環境変数で指定された既定のカレンダーです。
+    APIクライアントとミラーはカレンダーごとにプロセス内で使い回されます。
+    """
+    if calendar is None:
+        calendar = calendars.default_calendar()
+    if calendar is None:
+        log.error("Google CalendarのIDまたは認証情報ファイルのパスが設定されていません。")
+    return calendar
+
+def new_event_id():
+    """クライアント側で決めるイベントID (冪等キー)。Calendar APIが許す文字 (base32hex: 0-9, a-v) だけで作ります。"""
+    return uuid.uuid4().hex
 
-async def add_calendar_event(date_str, schedule):
+def all_day_event_body(date_str, schedule, event_id=None, created_by=None, recurrence_rules=None):
+    """
+    終日イベントを追加するときのリクエスト本文を返します。event_id を指定するとそのIDで作成します (再送しても重複しない)。
+    created_by (DiscordのユーザーID) は他の利用者には見えない private プロパティに記録します。
+    recurrence_rules (recurrence.recurrence_rule の結果) を指定すると、1件の繰り返しの予定として登録します。
+    """
+    body = {
+        'summary': schedule,
+        'start': {'date': date_str},
+        'end': {'date': date_str},
+        'transparency': 'transparent', # 終日イベントとして登録する場合に推奨
+    }
+    if event_id:
+        body['id'] = event_id
+    if created_by is not None:
+        body['extendedProperties'] = {'private': {CREATOR_PROPERTY: str(created_by)}}
+    if recurrence_rules:
+        body['recurrence'] = list(recurrence_rules)
+    return body
+
+def event_creator(event):
+    """予定を追加したDiscordユーザーのIDを返します。ボット以外から追加された予定では None です。"""
+    value = event.get('extendedProperties', {}).get('private', {}).get(CREATOR_PROPERTY)
+    return int(value) if value and value.isdigit() else None
+
+def patch_body(current_event, new_date_str, new_schedule):
+    """current_event から変更されたフィールドだけを含む patch の本文を返します。"""
+    # patchは送ったフィールドだけを書き換えるため、事前のgetは不要
+    body = {}
+    current_event = current_event or {}
+    if current_event.get('summary') != new_schedule:
+        body['summary'] = new_schedule
+    new_date = {'date': new_date_str}
+    if current_event.get('start') != new_date or current_event.get('end') != new_date:
+        body['start'] = new_date
+        body['end'] = new_date
+    return body
+
+@calendar_worker.offload(lambda message, *args, **kwargs: (False, message), mutation=True)
+async def add_calendar_event(date_str, schedule, calendar=None, created_by=None, recurrence_rules=None):
     """Googleカレンダーにイベントを追加します。"""
-    service = _build_service()
-    if not service:
+    calendar = _get_calendar(calendar)
+    if not calendar:
         return False, "カレンダーサービスに接続できませんでした。"
+    api = calendar.api
 
     try:
-        event = {
-            'summary': schedule,
-            'start': {'date': date_str},
-            'end': {'date': date_str},
-            'transparency': 'transparent', # 終日イベントとして登録する場合に推奨
-        }
-        calendar_id = config.GOOGLE_CALENDAR_ID
-        if not calendar_id:
-            return False, "Google Calendar IDが設定されていません。"
-
-        created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
-        print(f'Event created: {created_event.get("htmlLink")}')
+        event = all_day_event_body(date_str, schedule, created_by=created_by, recurrence_rules=recurrence_rules)
+        created_event = await api.insert_event(event, params={'fields': EVENT_FIELDS})
+        calendar.store.apply(created_event) # ミラーにも即座に反映
+        log.info('Event created', extra={"event_id": created_event.get("id"), "html_link": created_event.get("htmlLink")})
         # 成功時は created_event オブジェクト全体を返す
         return True, created_event
 
-    except HttpError as error:
-        print(f'Googleカレンダーへの追加中にAPIエラーが発生しました: {error}')
+    except CalendarAPIError as error:
+        log.warning('Googleカレンダーへの追加中にAPIエラーが発生しました', extra={"status": error.status, "error": str(error)})
         return False, f"Googleカレンダーへの追加中にAPIエラーが発生しました: {error}"
     except Exception as e:
-        print(f'Googleカレンダーへの追加中に予期しないエラーが発生しました: {e}')
+        log.exception('Googleカレンダーへの追加中に予期しないエラーが発生しました')
         return False, f"Googleカレンダーへの追加中に予期しないエラーが発生しました: {e}"
 
 
-async def find_calendar_event(date_str, schedule_summary):
+@calendar_worker.offload(lambda message, rows, *args, **kwargs: [(False, message)] * len(rows), mutation=True)
+async def add_calendar_events_bulk(rows, calendar=None, created_by=None):
     """
-    指定された日付と概要に一致するGoogleカレンダーイベントを検索します。
-    最初に見つかったイベントのIDと概要を返します。
+    複数の終日イベントをバッチリクエスト (最大50件/回) でまとめて追加します。
+    rows は (date_str, schedule) のリストです。失敗した項目のうち再送可能なものだけを再送し、
+    入力と同じ順序で (成功したかどうか, 作成されたイベントまたはエラーメッセージ) のリストを返します。
+    各項目はクライアント側で決めたIDで追加するため、処理済みかもしれない失敗 (5xx・接続エラー) を再送しても重複せず、
+    再送で 409 (同じIDの予定がすでにある) になった項目は前回の送信で追加されていたものとして扱います。
+    """
+    calendar = _get_calendar(calendar)
+    if not calendar:
+        return [(False, "カレンダーサービスに接続できませんでした。")] * len(rows)
+    api = calendar.api
+
+    bodies = [all_day_event_body(date_str, schedule, event_id=new_event_id(), created_by=created_by) for date_str, schedule in rows]
+    results = [None] * len(rows)
+    pending = list(range(len(rows)))
+    store = calendar.store
+
+    for attempt in range(BULK_MAX_RETRIES + 1):
+        retry = []
+        for chunk_start in range(0, len(pending), BATCH_MAX_SIZE):
+            chunk = pending[chunk_start:chunk_start + BATCH_MAX_SIZE]
+            try:
+                responses = await api.batch_insert_events([bodies[i] for i in chunk], params={'fields': EVENT_FIELDS})
+            except CalendarAPIError as error:
+                # バッチ全体が失敗した場合は全項目に同じエラーを割り当てる
+                responses = [error] * len(chunk)
+            except Exception as e:
+                log.exception('Googleカレンダーへの一括追加中に予期しないエラーが発生しました')
+                responses = [e] * len(chunk)
+            for index, response in zip(chunk, responses):
+                if isinstance(response, CalendarAPIError) and response.status == 409 and attempt > 0:
+                    try:
+                        response = await api.get_event(bodies[index]['id'], params={'fields': EVENT_FIELDS})
+                    except Exception as e:
+                        response = e
+                if isinstance(response, dict):
+                    store.apply(response)
+                    results[index] = (True, response)
+                elif is_retryable(response) and attempt < BULK_MAX_RETRIES:
+                    retry.append(index)
+                else:
+                    results[index] = (False, f"Googleカレンダーへの追加中にエラーが発生しました: {response}")
+        if not retry:
+            break
+        pending = retry
+        # 指数バックオフ (ジッター付き) してから失敗分だけ再送
+        await asyncio.sleep((2 ** attempt) + random.random())
+
+    log.info('Bulk insert finished', extra={"inserted": sum(1 for ok, _ in results if ok), "requested": len(rows)})
+    return results
+
+
+def event_info(event):
+    """コマンドが使うフィールドだけを取り出したイベント情報を返します。"""
+    return {
+        "id": event.get('id'),
+        "summary": event.get('summary'),
+        "start": event.get('start'),
+        "end": event.get('end'),
+        "etag": event.get('etag'), # 更新・削除時の競合検出に使う
+        "htmlLink": event.get('htmlLink'),
+    }
+
+@calendar_worker.offload(lambda message, *args, **kwargs: (None, message))
+async def get_calendar_event(event_id, calendar=None):
+    """
+    イベントIDでGoogleカレンダーイベントを取得します。
+    ミラーにあればメモリから返し、なければ events().get を1回だけ呼びます。
     """
-    service = _build_service()
-    if not service:
+    calendar = _get_calendar(calendar)
+    if not calendar:
         return None, "カレンダーサービスに接続できませんでした。"
+    event = calendar.store.get(event_id)
+    if event is not None:
+        return event_info(event), None
+    api = calendar.api
 
     try:
-        calendar_id = config.GOOGLE_CALENDAR_ID
-        if not calendar_id:
-            return None, "Google Calendar IDが設定されていません。"
+        event = await api.get_event(event_id, params={'fields': EVENT_FIELDS})
+        if event.get('status') == 'cancelled':
+            return None, "指定された予定は削除されています。"
+        return event_info(event), None
+
+    except CalendarAPIError as error:
+        if error.status == 404:
+            return None, "指定された予定が見つかりませんでした。"
+        log.warning('Googleカレンダーの取得中にAPIエラーが発生しました', extra={"status": error.status, "error": str(error)})
+        return None, f"Googleカレンダーの取得中にAPIエラーが発生しました: {error}"
+    except Exception as e:
+        log.exception('Googleカレンダーの取得中に予期しないエラーが発生しました')
+        return None, f"Googleカレンダーの取得中に予期しないエラーが発生しました: {e}"
+
+
+@calendar_worker.offload(lambda message, *args, **kwargs: (None, message))
+async def find_calendar_event(date_str, schedule_summary, calendar=None):
+    """
+    指定された日付と概要に一致するGoogleカレンダーイベントを検索します。
+    最初に見つかったイベントのID・概要・日付・etagを返します。
+    """
+    calendar = _get_calendar(calendar)
+    if not calendar:
+        return None, "カレンダーサービスに接続できませんでした。"
+    api = calendar.api
 
+    try:
         # 指定日の00:00:00から翌日の00:00:00までのイベントをJST (+09:00) で検索
-        time_min = f"{date_str}T00:00:00+09:00"
-        # date_strを日付オブジェクトに変換して翌日を計算
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        next_day_obj = date_obj + timedelta(days=1)
-        time_max = f"{next_day_obj.strftime('%Y-%m-%d')}T00:00:00+09:00"
-
-        events_result = service.events().list(
-            calendarId=calendar_id,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        events = events_result.get('items', [])
+        time_min, time_max = dates.day_bounds(date_str)
+
+        store = calendar.store
+        if store.is_fresh():
+            # ミラーが新しければネットワークに出ずにメモリから答える
+            events = store.events_on(date_str)
+        else:
+            # 繰り返しの予定は元の予定と例外だけを受け取り、手元で展開する
+            events = await _list_expanded(api, time_min, time_max)
 
         if not events:
             return None, "指定された日付にイベントは見つかりませんでした。"
@@ -89,112 +228,169 @@ async def find_calendar_event(date_str, schedule_summary):
             # 入力されたタイトルとイベントのタイトルを比較
             if event_summary == schedule_summary: # 完全一致のチェック
                 # 見つかったイベントのIDと実際の概要を返す
-                return {"id": event_id, "summary": event_summary}, None # エラーメッセージはNone
+                return event_info(event), None # エラーメッセージはNone
 
         # ループが終わっても見つからなかった場合
         return None, f"指定された日付 ({date_str}) に '{schedule_summary}' というタイトルのイベントは見つかりませんでした。"
 
-    except HttpError as error:
-        print(f'Googleカレンダーの検索中にAPIエラーが発生しました: {error}')
+    except CalendarAPIError as error:
+        log.warning('Googleカレンダーの検索中にAPIエラーが発生しました', extra={"status": error.status, "error": str(error)})
         return None, f"Googleカレンダーの検索中にAPIエラーが発生しました: {error}"
     except Exception as e:
-        print(f'Googleカレンダーの検索中に予期しないエラーが発生しました: {e}')
+        log.exception('Googleカレンダーの検索中に予期しないエラーが発生しました')
         return None, f"Googleカレンダーの検索中に予期しないエラーが発生しました: {e}"
 
 
+async def _list_expanded(api, time_min_str, time_max_str):
+    """
+    期間内のイベントを singleEvents=False ですべてのページから取得し、繰り返しの予定を手元で展開して開始日時順に返します。
+    Googleに展開させるより受け取る件数が少なく (繰り返しの予定は元の予定と例外だけ)、展開結果はキャッシュされます。
+    """
+    items = []
+    page_token = None
+    while True:
+        events_result = await api.list_events(
+            timeMin=time_min_str,
+            timeMax=time_max_str,
+            singleEvents=False,
+            maxResults=LIST_PAGE_SIZE,
+            pageToken=page_token,
+            fields=LIST_FIELDS,
+        )
+        items.extend(events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+    return recurrence.expand(items, datetime.fromisoformat(time_min_str), datetime.fromisoformat(time_max_str))
+
+# 期間内のイベントをページ単位で順に返す非同期ジェネレータ
+async def iter_event_pages(time_min_str, time_max_str, page_size=LIST_PAGE_SIZE, calendar=None):
+    """
+    指定された時間範囲 (RFC3339形式文字列) のイベントを、開始日時順にページ (イベントのリスト) ごとに返します。
+    ミラーが新しい場合はメモリから1ページで返します。
+    APIから取得する場合は nextPageToken をたどり、次のページは呼び出し側が必要としたときに初めて取得します。
+    ワーカーモードのゲートウェイでは、担当のワーカーから期間全体を1ページで受け取ります。
+
+    手元での展開 (_list_expanded) は並べ替えのために全ページを先に受け取る必要があるため、
+    ページごとに表示・書き出しする /list と /export のためのこの経路だけは、展開と並べ替えをGoogleに任せます
+    (singleEvents=True は繰り返しの回数だけ件数が増える代わりに、期間全体をメモリに持たずに済みます)。
+    期間全体をまとめて使う呼び出し側は list_events_in_range を使ってください。
+    """
+    if calendar_worker.active():
+        events, error = await list_events_in_range(time_min_str, time_max_str, calendar=calendar)
+        if events is None:
+            raise RuntimeError(error)
+        yield events
+        return
+    calendar = _get_calendar(calendar)
+    if not calendar:
+        raise RuntimeError("カレンダーサービスに接続できませんでした。")
+    if calendar.store.is_fresh():
+        yield calendar.store.events_in_range(time_min_str, time_max_str)
+        return
+    api = calendar.api
+
+    page_token = None
+    while True:
+        # singleEvents=True で繰り返しイベントを展開
+        # orderBy='startTime' で開始時間順にソート
+        events_result = await api.list_events(
+            timeMin=time_min_str, # RFC3339形式の開始時刻
+            timeMax=time_max_str, # RFC3339形式の終了時刻
+            singleEvents=True,
+            orderBy='startTime',
+            maxResults=page_size,
+            pageToken=page_token,
+            fields=LIST_FIELDS,
+        )
+        yield events_result.get('items', [])
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return
+
 # 期間内のイベントをリストアップする関数
-async def list_events_in_range(time_min_str, time_max_str):
+@calendar_worker.offload(lambda message, *args, **kwargs: (None, message))
+async def list_events_in_range(time_min_str, time_max_str, calendar=None):
     """
     指定された時間範囲 (RFC3339形式文字列) のGoogleカレンダーイベントをリストアップします。
     成功した場合はイベントのリストを、失敗した場合は None とエラーメッセージを返します。
+    ミラーが古い場合は、繰り返しの予定を展開させずに全ページを取得し、手元で展開します。
     """
-    service = _build_service()
-    if not service:
+    calendar = _get_calendar(calendar)
+    if not calendar:
         return None, "カレンダーサービスに接続できませんでした。"
 
     try:
-        calendar_id = config.GOOGLE_CALENDAR_ID
-        if not calendar_id:
-            return None, "Google Calendar IDが設定されていません。"
-
-        # APIでイベントをリストアップ
-        # singleEvents=True で繰り返しイベントを展開
-        # orderBy='startTime' で開始時間順にソート
-        events_result = service.events().list(
-            calendarId=calendar_id,
-            timeMin=time_min_str, # RFC3339形式の開始時刻
-            timeMax=time_max_str, # RFC3339形式の終了時刻
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        events = events_result.get('items', [])
+        if calendar.store.is_fresh():
+            events = calendar.store.events_in_range(time_min_str, time_max_str)
+        else:
+            events = await _list_expanded(calendar.api, time_min_str, time_max_str)
 
         # 成功時はイベントのリストを返す
         return events, None # エラーメッセージはNone
 
-    except HttpError as error:
-        print(f'Googleカレンダーからのイベントリスト取得中にAPIエラーが発生しました: {error}')
+    except CalendarAPIError as error:
+        log.warning('Googleカレンダーからのイベントリスト取得中にAPIエラーが発生しました', extra={"status": error.status, "error": str(error)})
         return None, f"イベントリストの取得中にAPIエラーが発生しました: {error}"
     except Exception as e:
-        print(f'Googleカレンダーからのイベントリスト取得中に予期しないエラーが発生しました: {e}')
+        log.exception('Googleカレンダーからのイベントリスト取得中に予期しないエラーが発生しました')
         return None, f"イベントリストの取得中に予期しないエラーが発生しました: {e}"
 
-async def update_calendar_event(event_id, new_date_str, new_schedule):
-    """Googleカレンダーのイベントを更新します。"""
-    service = _build_service()
-    if not service:
+@calendar_worker.offload(lambda message, *args, **kwargs: (False, message), mutation=True)
+async def update_calendar_event(event_id, new_date_str, new_schedule, current_event=None, calendar=None):
+    """
+    Googleカレンダーのイベントを更新します。
+    current_event (find_calendar_event の結果) があれば、変更されたフィールドだけを送信し、
+    etag を If-Match に付けて他の操作による変更を上書きしないようにします。
+    """
+    calendar = _get_calendar(calendar)
+    if not calendar:
         return False, "カレンダーサービスに接続できませんでした。"
+    api = calendar.api
 
     try:
-        calendar_id = config.GOOGLE_CALENDAR_ID
-        if not calendar_id:
-            return False, "Google Calendar IDが設定されていません。"
-
-        # 更新対象のイベントを取得
-        # 更新には元のイベント情報が必要
-        event = service.events().get(calendarId=calendar_id, eventId=event_id).execute()
-
-        # 情報を更新
-        event['summary'] = new_schedule
-        # 開始・終了日時も新しい日付で更新（終日イベントとして）
-        event['start'] = {'date': new_date_str}
-        event['end'] = {'date': new_date_str}
-
-        # イベントを更新
-        updated_event = service.events().update(
-            calendarId=calendar_id,
-            eventId=event_id,
-            body=event
-        ).execute()
-        print(f'Event updated: {updated_event.get("htmlLink")}')
+        # 概要と日付 (終日イベントとして) をpatchで更新
+        current_event = current_event or {}
+        body = patch_body(current_event, new_date_str, new_schedule)
+        if not body and current_event.get('htmlLink'):
+            # 変更点がなければAPIを呼ばない
+            return True, current_event['htmlLink']
+
+        headers = {'If-Match': current_event['etag']} if current_event.get('etag') else None
+        updated_event = await api.patch_event(event_id, body, params={'fields': EVENT_FIELDS}, headers=headers)
+        calendar.store.apply(updated_event)
+        log.info('Event updated', extra={"event_id": event_id, "html_link": updated_event.get("htmlLink")})
         return True, updated_event.get("htmlLink")
 
-    except HttpError as error:
-        print(f'Googleカレンダーの更新中にAPIエラーが発生しました: {error}')
+    except CalendarAPIError as error:
+        if error.status == 412:
+            return False, CONFLICT_MESSAGE
+        log.warning('Googleカレンダーの更新中にAPIエラーが発生しました', extra={"status": error.status, "error": str(error)})
         return False, f"Googleカレンダーの更新中にAPIエラーが発生しました: {error}"
     except Exception as e:
-        print(f'Googleカレンダーの更新中に予期しないエラーが発生しました: {e}')
+        log.exception('Googleカレンダーの更新中に予期しないエラーが発生しました')
         return False, f"Googleカレンダーの更新中に予期しないエラーが発生しました: {e}"
 
 
-async def delete_calendar_event(event_id):
-    """Googleカレンダーのイベントを削除します。"""
-    service = _build_service()
-    if not service:
+@calendar_worker.offload(lambda message, *args, **kwargs: (False, message), mutation=True)
+async def delete_calendar_event(event_id, etag=None, calendar=None):
+    """Googleカレンダーのイベントを削除します。etag があれば If-Match を付けて、検索後に変更された予定は削除しません。"""
+    calendar = _get_calendar(calendar)
+    if not calendar:
         return False, "カレンダーサービスに接続できませんでした。"
+    api = calendar.api
 
     try:
-        calendar_id = config.GOOGLE_CALENDAR_ID
-        if not calendar_id:
-            return False, "Google Calendar IDが設定されていません。"
-
-        service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
-        print(f'Event deleted: {event_id}')
+        await api.delete_event(event_id, headers={'If-Match': etag} if etag else None)
+        calendar.store.remove(event_id)
+        log.info('Event deleted', extra={"event_id": event_id})
         return True, None # 成功時はエラーメッセージはNone
 
-    except HttpError as error:
-        print(f'Googleカレンダーの削除中にAPIエラーが発生しました: {error}')
+    except CalendarAPIError as error:
+        if error.status == 412:
+            return False, CONFLICT_MESSAGE
+        log.warning('Googleカレンダーの削除中にAPIエラーが発生しました', extra={"status": error.status, "error": str(error)})
         return False, f"Googleカレンダーの削除中にAPIエラーが発生しました: {error}"
     except Exception as e:
-        print(f'Googleカレンダーの削除中に予期しないエラーが発生しました: {e}')
-        return False, f"Googleカレンダーの削除中に予期しないエラーが発生しました: {e}"
\ No newline at end of file
+        log.exception('Googleカレンダーの削除中に予期しないエラーが発生しました')
+        return False, f"Googleカレンダーの削除中に予期しないエラーが発生しました: {e}"
@@ -0,0 +1,264 @@
+# instrumentation.py
+import asyncio
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# レイテンシのヒストグラムのバケット (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# イベントループ遅延の計測間隔 (秒)
+LOOP_LAG_INTERVAL = 0.5
+
+
+# --- 構造化ログ ---
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行1オブジェクトのJSONで出力するフォーマッタ。extra に渡した値もフィールドとして出力します。"""
+
+    _RESERVED = set(vars(logging.makeLogRecord({})).keys()) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_logging_configured = False
+
+def configure_logging(level=logging.INFO):
+    """ルートロガーにJSONフォーマッタを設定します (何度呼んでも1回だけ設定)。"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    _logging_configured = True
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(name)
+
+
+# --- メトリクス ---
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self):
+        return [{"labels": dict(key), "value": value} for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {} # ラベル -> [各バケットの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+    def snapshot(self):
+        return [
+            {"labels": dict(key), "count": series[-1], "sum": round(series[-2], 6),
+             "buckets": dict(zip(map(str, self.buckets), series[:len(self.buckets)]))}
+            for key, series in sorted(self._series.items())
+        ]
+
+
+COMMAND_SECONDS = Histogram("sharedule_command_seconds", "Total time spent handling a slash command.")
+PHASE_SECONDS = Histogram("sharedule_phase_seconds", "Time spent in each phase of a command (parse, lookup, calendar, followup).")
+COMMAND_ERRORS = Counter("sharedule_command_errors_total", "Slash commands that raised an unexpected error.")
+CALENDAR_SECONDS = Histogram("sharedule_calendar_request_seconds", "Calendar API request latency by API method.")
+CALENDAR_ERRORS = Counter("sharedule_calendar_errors_total", "Calendar API requests that failed, by API method and status.")
+LOOP_LAG_SECONDS = Histogram("sharedule_event_loop_lag_seconds", "How late the event loop woke up a periodic timer.", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+LOOP_LAG_CURRENT = Gauge("sharedule_event_loop_lag_current_seconds", "Most recent event loop lag sample.")
+
+METRICS = [COMMAND_SECONDS, PHASE_SECONDS, COMMAND_ERRORS, CALENDAR_SECONDS, CALENDAR_ERRORS, LOOP_LAG_SECONDS, LOOP_LAG_CURRENT]
+
+def register(metric):
+    """モジュール独自のメトリクスを公開対象に追加します。"""
+    METRICS.append(metric)
+    return metric
+
+
+# --- 計測用のヘルパー ---
+
+@contextmanager
+def span(phase, command):
+    """with ブロックの所要時間を command の phase として記録します。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - started, command=command, phase=phase)
+
+@contextmanager
+def calendar_span(api_method):
+    """Calendar APIの1リクエストの所要時間と失敗を記録します。"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as error:
+        CALENDAR_ERRORS.inc(api_method=api_method, status=getattr(error, "status", type(error).__name__))
+        raise
+    finally:
+        CALENDAR_SECONDS.observe(time.perf_counter() - started, api_method=api_method)
+
+def command_failed(name):
+    """コマンドのハンドラで捕捉した予期しない例外を記録します (except ブロックの中で呼びます)。"""
+    COMMAND_ERRORS.inc(command=name)
+    get_logger("commands").exception("予期しないエラー", extra={"command": name})
+
+def instrument_command(name):
+    """
+    スラッシュコマンドのハンドラ全体の所要時間と予期しない例外を記録するデコレータ。
+    引数の情報は functools.wraps で元の関数から引き継がれるため、@tree.command の直下で使えます。
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(interaction, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(interaction, *args, **kwargs)
+            except Exception:
+                COMMAND_ERRORS.inc(command=name)
+                raise
+            finally:
+                COMMAND_SECONDS.observe(time.perf_counter() - started, command=name)
+        return wrapper
+    return decorator
+
+
+async def _monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """一定間隔で眠り、予定より何秒遅れて起きたかをイベントループの遅延として記録します。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG_CURRENT.set(lag)
+
+
+def render_prometheus():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def render_json():
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+class MetricsServer:
+    """/metrics (Prometheus形式) と /metrics.json を返すローカルHTTPサーバーとイベントループ遅延の監視。"""
+
+    def __init__(self, host, port):
+        self._host = host
+        self._port = port
+        self._runner = None
+        self._lag_task = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def prometheus(request):
+            return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        async def as_json(request):
+            return web.json_response(render_json())
+
+        app = web.Application()
+        app.router.add_get("/metrics", prometheus)
+        app.router.add_get("/metrics.json", as_json)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        self._lag_task = asyncio.create_task(_monitor_loop_lag())
+        get_logger(__name__).info("metrics endpoint started", extra={"host": self._host, "port": self._port})
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
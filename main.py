@@ -2,38 +2,113 @@ import discord
 from discord import app_commands
 import os
 import glob
+import hashlib
 import importlib
+import json
 import config # config.pyから設定を読み込む
+import calendar_api
+import calendar_worker
+import calendars
+import digest
+import instrumentation
+import notifications
+import write_queue
+
+log = instrumentation.get_logger(__name__)
 
 # Discord Botの設定
 intents = discord.Intents.default()
 intents.message_content = True # 必要に応じてFalseに変更も検討
 
+class ShareduleClient(discord.AutoShardedClient):
+    """
+    起動時にコマンドとイベントミラーを準備し、終了時に共有リソースを後片付けするDiscordクライアント。
+    setup_hook はプロセスにつき一度だけ呼ばれるため、再接続のたびに on_ready で初期化するより安全です。
+    サーバー数が増えても1プロセスで動かせるよう、自動シャーディングのクライアントを使います。
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.metrics = instrumentation.MetricsServer(config.METRICS_HOST, config.METRICS_PORT)
+        self.digest = digest.from_config(self) # DIGEST_TIME が未設定なら None
+
+    async def setup_hook(self):
+        load_commands() # コマンドの読み込みは1プロセスにつき1回
+        await sync_commands_if_changed()
+        notifications.get_queue().start() # ペアリング通知の送信ワーカー
+        if config.METRICS_PORT:
+            await self.metrics.start() # /metrics とイベントループ遅延の監視
+        if calendar_worker.enabled():
+            # Calendar APIの呼び出しとミラーはワーカープロセスに任せ、このプロセスはDiscordとの通信に専念する
+            await calendar_worker.get_pool().start()
+        else:
+            # 設定済みのカレンダーごとのイベントミラーの同期をバックグラウンドで開始 (起動は待たせない)
+            await calendars.start()
+        if write_queue.enabled():
+            await write_queue.get_queue().start(self) # 前回の実行で反映しきれなかった書き込みを再実行
+        if self.digest is not None:
+            self.digest.start() # 毎日決まった時刻に翌日の予定のまとめを送る
+
+    async def close(self):
+        if self.digest is not None:
+            await self.digest.stop()
+        if write_queue.enabled():
+            await write_queue.get_queue().stop() # 未処理の書き込みはジャーナルに残り、次回起動時に再実行される
+        await notifications.get_queue().stop() # まとめ待ちの通知を送り切る
+        if calendar_worker.enabled():
+            await calendar_worker.get_pool().stop() # 各ワーカーが処理中の呼び出しを終え、ミラーを保存してから終了する
+        await calendars.stop() # 次回起動時に差分同期から始められるよう、各カレンダーのミラーを保存
+        await calendar_api.close() # Calendar API用の共有HTTPセッションを閉じる
+        await self.metrics.stop()
+        await super().close()
+
 # Discord Botのクライアントとコマンドツリーの初期化
-client = discord.Client(intents=intents)
+client = ShareduleClient(intents=intents, shard_count=config.DISCORD_SHARD_COUNT)
 tree = app_commands.CommandTree(client)
 
 # コマンドを読み込む関数
-def load_commands():
-    """commandsディレクトリからコマンドモジュールを読み込み、セットアップします。"""
+def load_commands(command_tree=tree):
+    """commandsディレクトリからコマンドモジュールを読み込み、command_tree (省略時はボットのツリー) にセットアップします。"""
     command_files = glob.glob("commands/*.py") # commands/*.py に一致するファイルを取得
     for command_file in command_files:
         module_name = command_file.replace("\\", "/").replace("/", ".")[:-3] # ファイルパスからモジュール名に変換 (例: commands.add)
         try:
             module = importlib.import_module(module_name)
             if hasattr(module, 'setup'):
-                module.setup(tree) # setup関数があれば実行してコマンドを登録
-        except Exception as e:
-            print(f"Error loading command module {module_name}: {e}") # エラーログは残しておく
+                module.setup(command_tree) # setup関数があれば実行してコマンドを登録
+        except Exception:
+            log.exception("Error loading command module", extra={"command_module": module_name})
 
-# on_readyイベント
+def _command_signature_hash():
+    """登録済みコマンドの定義 (名前・説明・引数など) から求めたハッシュを返します。"""
+    payload = [command.to_dict(tree) for command in tree.get_commands()]
+    payload.sort(key=lambda command: command["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def sync_commands_if_changed():
+    """コマンド定義が前回同期時から変わっている場合だけ tree.sync() を実行します (同期はレート制限が厳しいため)。"""
+    signature_hash = _command_signature_hash()
+    try:
+        with open(config.COMMAND_SYNC_HASH_PATH, "r") as f:
+            synced_hash = f.read().strip()
+    except FileNotFoundError:
+        synced_hash = None
+    if signature_hash == synced_hash:
+        log.info('コマンド定義に変更がないため同期を省略しました')
+        return
+    await tree.sync() # コマンドをDiscordに同期
+    directory = os.path.dirname(config.COMMAND_SYNC_HASH_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(config.COMMAND_SYNC_HASH_PATH, "w") as f:
+        f.write(signature_hash)
+    log.info('コマンドを同期しました')
+
+# on_readyイベント (再接続のたびに呼ばれるため、ここでは初期化を行わない)
 @client.event
 async def on_ready():
-    print(f'{client.user} としてログインしました') # ログインログは残しておく
-    load_commands() # ボット起動時にコマンドを読み込む
-    await tree.sync() # コマンドをDiscordに同期
-    print('コマンドを同期しました') # 同期完了ログは残しておく
-    print(f'{client.user} が起動しました') # 起動完了ログは残しておく
+    log.info('ログインしました', extra={"user": str(client.user), "guilds": len(client.guilds), "shards": client.shard_count})
 
-# ボットの起動
-client.run(config.DISCORD_BOT_TOKEN)
\ No newline at end of file
+# ボットの起動 (ワーカープロセスは spawn でこのモジュールを読み込み直すため、直接実行されたときだけ起動する)
+if __name__ == "__main__":
+    client.run(config.DISCORD_BOT_TOKEN, log_handler=None) # ログは instrumentation のJSONフォーマッタで出力する
\ No newline at end of file
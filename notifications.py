@@ -0,0 +1,173 @@
+# notifications.py
+import asyncio
+import time
+
+import aiohttp
+
+import config
+import instrumentation
+
+# 同じ相手への通知をまとめる待ち時間 (秒)
+DEBOUNCE_SECONDS = 3.0
+# Discordの1メッセージあたりの文字数上限
+MESSAGE_LIMIT = 2000
+# 429以外で送信に失敗したときの再試行回数
+MAX_SEND_ATTEMPTS = 3
+
+log = instrumentation.get_logger(__name__)
+
+
+class Notification:
+    """ペアリング相手への通知1件。"""
+    __slots__ = ("partner_id", "actor", "text", "line", "channel", "webhook_url")
+
+    def __init__(self, partner_id, actor, text, line, channel=None, webhook_url=None):
+        self.partner_id = partner_id
+        self.actor = actor # 操作したユーザーの表示名
+        self.text = text # 単独で送るときの本文 (メンション付き)
+        self.line = line # まとめて送るときの1行
+        self.channel = channel # Webhookが設定されていないときの送信先
+        self.webhook_url = webhook_url # 操作したサーバーの通知用Webhook
+
+
+def _compose(partner_id, items):
+    """同じ相手への通知をまとめた本文を作ります。1件だけならそのまま送ります。"""
+    if len(items) == 1:
+        return items[0].text
+    actors = "、".join(dict.fromkeys(item.actor for item in items))
+    header = f"<@{partner_id}> さんへ: {actors} さんが予定を{len(items)}件変更しました。"
+    return "\n".join([header] + [f"・ {item.line}" for item in items])
+
+def _split(content, limit=MESSAGE_LIMIT):
+    """上限文字数を超える本文を行単位で分割します。"""
+    messages = []
+    current = ""
+    for line in content.split("\n"):
+        if current and len(current) + len(line) + 1 > limit:
+            messages.append(current.rstrip("\n"))
+            current = ""
+        current += line[:limit - 1] + "\n"
+    if current:
+        messages.append(current.rstrip("\n"))
+    return messages
+
+
+class NotificationQueue:
+    """
+    ペアリング通知の送信パイプライン。
+    コマンドは enqueue() で通知を積むだけですぐに戻り、バックグラウンドで
+    相手と送信先ごとに DEBOUNCE_SECONDS の間に届いた通知を1通にまとめ、サーバーのWebhook (なければチャンネル) に送信します。
+    """
+
+    def __init__(self, debounce=DEBOUNCE_SECONDS):
+        self._debounce = debounce
+        self._pending = {} # (相手のID, 送信先) -> [Notification]
+        self._timers = {} # (相手のID, 送信先) -> まとめ送信のタイマー
+        self._outbox = asyncio.Queue()
+        self._worker = None
+        self._session = None
+        self._blocked_until = {} # Webhook URL -> レート制限が解除される時刻 (monotonic)
+
+    def enqueue(self, notification):
+        """通知を積みます。送信は待ちません。"""
+        # 別のサーバー宛ての通知が1通にまとまらないよう、送信先 (Webhook、なければチャンネル) ごとに分ける
+        destination = notification.webhook_url or getattr(notification.channel, "id", None)
+        key = (notification.partner_id, destination)
+        self._pending.setdefault(key, []).append(notification)
+        if key not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self._debounce, self._flush, key)
+
+    def _flush(self, key):
+        self._timers.pop(key, None)
+        items = self._pending.pop(key, None)
+        if not items:
+            return
+        content = _compose(key[0], items)
+        for message in _split(content):
+            self._outbox.put_nowait((key[0], message, items[0].channel, items[0].webhook_url))
+
+    def send(self, partner_id, content, channel=None, webhook_url=None):
+        """まとめずにそのまま送信します (定時のまとめなど、すでに1通にまとまっている本文用)。webhook_url がなければ channel に送ります。"""
+        for message in _split(content):
+            self._outbox.put_nowait((partner_id, message, channel, webhook_url))
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._deliver_loop())
+
+    async def stop(self):
+        """まとめ待ちの通知をすぐに送り出し、送信が終わってから停止します。"""
+        for key, timer in list(self._timers.items()):
+            timer.cancel()
+            self._flush(key)
+        if self._worker is not None:
+            await self._outbox.join()
+            self._worker.cancel()
+            self._worker = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        return self._session
+
+    async def _deliver_loop(self):
+        while True:
+            partner_id, content, channel, webhook_url = await self._outbox.get()
+            try:
+                await self._deliver(partner_id, content, channel, webhook_url)
+            except Exception as e:
+                log.warning("通知の送信に失敗しました", extra={"partner_id": partner_id, "error": str(e)})
+            finally:
+                self._outbox.task_done()
+
+    async def _deliver(self, partner_id, content, channel, webhook_url):
+        if not webhook_url:
+            if channel is not None:
+                await channel.send(content)
+            return
+        payload = {"content": content, "allowed_mentions": {"users": [str(partner_id)]}}
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            # 直前の応答でこのWebhookのバケットを使い切っていたら、リセットまで待つ
+            wait = self._blocked_until.get(webhook_url, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self._get_session().post(webhook_url, json=payload) as resp:
+                self._record_rate_limit(webhook_url, resp)
+                if resp.status == 429:
+                    data = await resp.json(content_type=None)
+                    self._blocked_until[webhook_url] = time.monotonic() + float(data.get("retry_after", 1.0))
+                    continue
+                if resp.status >= 500:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                resp.raise_for_status()
+                return
+        raise RuntimeError(f"{MAX_SEND_ATTEMPTS}回試行しても送信できませんでした。")
+
+    def _record_rate_limit(self, webhook_url, resp):
+        """X-RateLimit-* ヘッダを見て、残りがなければこのWebhookへの次の送信をリセットまで遅らせます。"""
+        remaining = resp.headers.get("X-RateLimit-Remaining")
+        reset_after = resp.headers.get("X-RateLimit-Reset-After")
+        if remaining is not None and reset_after is not None and int(remaining) == 0:
+            self._blocked_until[webhook_url] = time.monotonic() + float(reset_after)
+
+
+_queue = None
+
+def get_queue():
+    """共有の通知キューを返します。"""
+    global _queue
+    if _queue is None:
+        _queue = NotificationQueue()
+    return _queue
+
+def notify_partner(partner_id, actor, text, line, channel=None, guild_id=None):
+    """
+    ペアリング相手への通知を積みます。コマンドの応答を待たせません。
+    操作したサーバー (guild_id) のWebhookに送り、設定がなければ channel に送ります。
+    """
+    webhook_url = config.get_guild_webhook(guild_id)
+    get_queue().enqueue(Notification(partner_id, actor, text, line, channel, webhook_url))
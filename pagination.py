@@ -0,0 +1,153 @@
+# pagination.py
+import asyncio
+from datetime import datetime
+
+import discord
+
+import instrumentation
+
+# 1つの埋め込み (ページ) に表示するイベント数
+EVENTS_PER_PAGE = 15
+# 埋め込みの説明文の上限 (Discordの上限は4096文字)
+EMBED_DESCRIPTION_LIMIT = 4000
+WEEKDAYS = "月火水木金土日"
+VIEW_TIMEOUT = 300
+
+log = instrumentation.get_logger(__name__)
+
+
+def format_event_line(event, with_date=False):
+    """イベント1件を一覧表示用の1行に整形します。"""
+    summary = event.get('summary', 'タイトルなし')
+    start = event.get('start', {})
+    end = event.get('end', {})
+
+    if 'date' in start: # 終日イベントの場合
+        start_obj = datetime.strptime(start['date'], "%Y-%m-%d")
+        detail = "終日"
+    else: # 時間指定イベントの場合
+        start_obj = datetime.fromisoformat(start.get('dateTime'))
+        end_obj = datetime.fromisoformat(end.get('dateTime'))
+        detail = f"{start_obj.strftime('%H:%M')} - {end_obj.strftime('%H:%M')}"
+
+    if with_date:
+        return f"・ {start_obj.strftime('%m/%d')}({WEEKDAYS[start_obj.weekday()]}) {summary} ({detail})"
+    return f"・ {summary} ({detail})"
+
+
+class EventPagesView(discord.ui.View):
+    """
+    イベント一覧を埋め込みのページに分けて表示し、「前へ」「次へ」ボタンで切り替えるビュー。
+    イベントは非同期のページイテレータから必要になった分だけ取得します。
+    """
+
+    def __init__(self, title, pages, with_date=True, timeout=VIEW_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.title = title
+        self.message = None
+        self._source = pages.__aiter__()
+        self._with_date = with_date
+        self._buffer = []
+        self._exhausted = False
+        self._pages = [] # 描画済みの埋め込み
+        self._index = 0
+        self._lock = asyncio.Lock()
+
+    async def _pull(self):
+        """イテレータから次のページを1つ取得してバッファに追加します。"""
+        try:
+            page = await self._source.__anext__()
+        except StopAsyncIteration:
+            self._exhausted = True
+            return
+        self._buffer.extend(page)
+
+    async def _ensure_page(self, index):
+        """index 番目のページが描画済みになるまでイベントを取得します。存在すれば True を返します。"""
+        while len(self._pages) <= index:
+            while len(self._buffer) < EVENTS_PER_PAGE and not self._exhausted:
+                await self._pull()
+            if not self._buffer: # 取得し尽くして表示するイベントが残っていない
+                return False
+            lines = []
+            length = 0
+            while self._buffer and len(lines) < EVENTS_PER_PAGE:
+                line = format_event_line(self._buffer[0], with_date=self._with_date)
+                if lines and length + len(line) + 1 > EMBED_DESCRIPTION_LIMIT:
+                    break
+                lines.append(line)
+                length += len(line) + 1
+                self._buffer.pop(0)
+            self._pages.append(discord.Embed(title=self.title, description="\n".join(lines)))
+        # 次のページがあるかどうかを正しく表示するため、少なくとも1件先まで取得しておく
+        while not self._buffer and not self._exhausted:
+            await self._pull()
+        return True
+
+    def has_next(self):
+        """次のページがあれば True を返します (_ensure_page で1件先まで取得済みであること)。"""
+        return self._index + 1 < len(self._pages) or bool(self._buffer)
+
+    def _current_embed(self):
+        embed = self._pages[self._index]
+        total = f"/{len(self._pages)}" if self._exhausted and not self._buffer else ""
+        embed.set_footer(text=f"ページ {self._index + 1}{total}")
+        return embed
+
+    def _update_buttons(self):
+        self.prev_button.disabled = self._index == 0
+        self.next_button.disabled = not self.has_next()
+
+    async def first_page(self):
+        """最初のページの埋め込みを返します。予定が1件もなければ None を返します。"""
+        if not await self._ensure_page(0):
+            return None
+        self._update_buttons()
+        return self._current_embed()
+
+    async def _show(self, interaction, index):
+        await interaction.response.defer()
+        try:
+            async with self._lock: # 連打されてもイテレータを同時に進めない
+                if await self._ensure_page(index):
+                    self._index = index
+        except Exception:
+            log.exception("ページ取得中にエラーが発生しました")
+            await interaction.followup.send("予定の取得に失敗しました。", ephemeral=True)
+            return
+        self._update_buttons()
+        await interaction.edit_original_response(embed=self._current_embed(), view=self)
+
+    @discord.ui.button(label="◀ 前へ", style=discord.ButtonStyle.secondary)
+    async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, max(self._index - 1, 0))
+
+    @discord.ui.button(label="次へ ▶", style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self._index + 1)
+
+    async def on_timeout(self):
+        # 時間切れになったらボタンを無効化する
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+
+async def send_event_pages(interaction, title, pages, empty_message, with_date=True):
+    """イベント一覧をページ付きで送信します。予定がなければ empty_message を送ります。"""
+    view = EventPagesView(title, pages, with_date=with_date)
+    embed = await view.first_page()
+    if embed is None:
+        view.stop()
+        await interaction.followup.send(empty_message)
+        return
+    if not view.has_next():
+        # 1ページに収まる場合はボタンを付けない
+        view.stop()
+        await interaction.followup.send(embed=embed)
+        return
+    view.message = await interaction.followup.send(embed=embed, view=view, wait=True)
@@ -0,0 +1,163 @@
+# recurrence.py
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from dateutil import rrule
+
+from dates import JST
+
+# 展開結果をキャッシュする件数 (キーは繰り返しの規則・開始日時・期間)
+EXPANSION_CACHE_SIZE = 512
+# /add で指定できる繰り返しの単位
+FREQUENCIES = {"weekly": "WEEKLY", "monthly": "MONTHLY"}
+
+
+def recurrence_rule(frequency, until=None, count=None):
+    """
+    /add の繰り返し指定から events の recurrence フィールド (RRULE の行のリスト) を作ります。
+    until (date) は終日イベント用に日付で、count は回数で指定します。両方あれば until を優先します。
+    """
+    parts = [f"FREQ={FREQUENCIES[frequency]}"]
+    if until is not None:
+        parts.append(f"UNTIL={until.strftime('%Y%m%d')}")
+    elif count is not None:
+        parts.append(f"COUNT={count}")
+    return ["RRULE:" + ";".join(parts)]
+
+def is_master(event):
+    return bool(event.get('recurrence'))
+
+def is_exception(event):
+    """繰り返しの1回分だけを変更・削除した例外 (recurringEventId を持つイベント) なら True を返します。"""
+    return bool(event.get('recurringEventId'))
+
+
+def _start_of(field):
+    """start / end / originalStartTime を (datetime, 終日かどうか) に変換します。終日の場合は naive な0時です。"""
+    if 'date' in field:
+        return datetime.strptime(field['date'], "%Y-%m-%d"), True
+    value = datetime.fromisoformat(field['dateTime'].replace("Z", "+00:00"))
+    if field.get('timeZone'):
+        value = value.astimezone(ZoneInfo(field['timeZone'])) # 夏時間のある地域でも現地時刻で繰り返す
+    return value, False
+
+def instance_key(value, all_day):
+    """Googleのインスタンスの ID の接尾辞と同じ形式 (終日は YYYYMMDD、時刻ありはUTCの YYYYMMDDTHHMMSSZ) を返します。"""
+    if all_day:
+        return value.strftime("%Y%m%d")
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def _normalize_rule(line, all_day):
+    # dateutil は DTSTART と UNTIL のタイムゾーンの有無が一致しないと例外を出すため、UNTIL の形式をそろえる
+    if not line.startswith("RRULE:") or "UNTIL=" not in line:
+        return line
+    head, _, rest = line.partition("UNTIL=")
+    until, sep, tail = rest.partition(";")
+    if all_day:
+        until = until[:8]
+    elif "T" not in until:
+        until += "T235959Z"
+    return f"{head}UNTIL={until}{sep}{tail}"
+
+@lru_cache(maxsize=EXPANSION_CACHE_SIZE)
+def _occurrences(rules, dtstart, range_start, range_end):
+    """rules (RRULE/EXDATE/RDATE の行) による dtstart 以降の開始日時のうち、range_start〜range_end のものを返します。"""
+    rule_set = rrule.rrulestr("\n".join(rules), dtstart=dtstart, forceset=True)
+    return tuple(rule_set.between(range_start, range_end, inc=True))
+
+def _instance(master, start, duration, all_day):
+    key = instance_key(start, all_day)
+    end = start + duration
+    instance = {k: v for k, v in master.items() if k not in ('recurrence', 'id', 'start', 'end', 'etag')}
+    instance['id'] = f"{master['id']}_{key}"
+    instance['recurringEventId'] = master['id'] # etag は元の予定とは別物なので持たせない (If-Match を付けずに変更・削除する)
+    if all_day:
+        instance['start'] = {'date': start.date().isoformat()}
+        instance['end'] = {'date': end.date().isoformat()}
+        instance['originalStartTime'] = {'date': start.date().isoformat()}
+    else:
+        instance['start'] = {'dateTime': start.isoformat()}
+        instance['end'] = {'dateTime': end.isoformat()}
+        instance['originalStartTime'] = {'dateTime': start.isoformat()}
+    return instance
+
+def expand_master(master, time_min, time_max, overridden=()):
+    """
+    繰り返しの元の予定を time_min〜time_max (aware datetime) と重なる1回ごとのイベントに展開します。
+    overridden (instance_key の集合) に含まれる回は、例外として別に返されるため除きます。
+    """
+    start, all_day = _start_of(master['start'])
+    end, _ = _start_of(master.get('end', master['start']))
+    duration = end - start
+    # 終日の予定は最低1日として扱い (event_store.event_span と同じ)、JSTの日付で展開する
+    span = max(duration, timedelta(days=1)) if all_day else duration
+    if all_day:
+        range_start = datetime.combine(time_min.astimezone(JST).date(), datetime.min.time()) - span
+        range_end = datetime.combine(time_max.astimezone(JST).date(), datetime.min.time())
+    else:
+        range_start, range_end = time_min - span, time_max
+    rules = tuple(_normalize_rule(line, all_day) for line in master['recurrence'])
+    instances = []
+    for occurrence in _occurrences(rules, start, range_start, range_end):
+        occurrence_start = occurrence.replace(tzinfo=JST) if all_day else occurrence
+        if not (occurrence_start < time_max and occurrence_start + span > time_min):
+            continue
+        if instance_key(occurrence, all_day) in overridden:
+            continue
+        instances.append(_instance(master, occurrence, duration, all_day))
+    return instances
+
+def original_key(event):
+    """例外イベントが置き換えている回の instance_key を返します。"""
+    value, all_day = _start_of(event['originalStartTime'])
+    return instance_key(value, all_day)
+
+def key_start(key):
+    """instance_key を (aware datetime, 終日かどうか) に戻します。終日の場合はJSTの0時です。"""
+    if "T" in key:
+        return datetime.strptime(key, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc), False
+    return datetime.strptime(key, "%Y%m%d").replace(tzinfo=JST), True
+
+def cancelled_instance(event_id, master_id, key):
+    """1回分だけを削除したときに同期で届くものと同じ形の、取り消された回のイベントを返します。"""
+    value, all_day = key_start(key)
+    original = {'date': value.date().isoformat()} if all_day else {'dateTime': value.isoformat()}
+    return {'id': event_id, 'status': 'cancelled', 'recurringEventId': master_id, 'originalStartTime': original}
+
+def split_instance_id(event_id):
+    """インスタンスの ID を (元の予定の ID, instance_key) に分けます。インスタンスの ID でなければ None を返します。"""
+    master_id, sep, key = event_id.rpartition("_")
+    if not sep or not master_id or not key[:8].isdigit():
+        return None
+    return master_id, key
+
+def expand(events, time_min, time_max):
+    """
+    singleEvents=False で取得したイベント (繰り返しの元の予定・例外・通常の予定) を、
+    singleEvents=True と同じ1回ごとのイベントのリストに展開します。結果は開始日時順に並べます。
+    """
+    masters = []
+    overridden = {}
+    singles = []
+    for event in events:
+        if is_master(event):
+            masters.append(event)
+        elif is_exception(event) and 'originalStartTime' in event:
+            overridden.setdefault(event['recurringEventId'], set()).add(original_key(event))
+            if event.get('status') != 'cancelled':
+                singles.append(event)
+        elif event.get('status') != 'cancelled':
+            singles.append(event)
+    for master in masters:
+        if master.get('status') == 'cancelled':
+            continue
+        singles.extend(expand_master(master, time_min, time_max, overridden.get(master['id'], ())))
+    return sort_events(singles)
+
+def sort_key(event):
+    value, all_day = _start_of(event['start'])
+    return value.replace(tzinfo=JST) if all_day else value
+
+def sort_events(events):
+    return sorted(events, key=sort_key)
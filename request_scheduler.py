@@ -0,0 +1,117 @@
+# request_scheduler.py
+import asyncio
+import random
+import time
+
+import aiohttp
+
+import instrumentation
+
+log = instrumentation.get_logger(__name__)
+
+
+class TokenBucket:
+    """
+    毎秒 rate 個ずつトークンが補充され、最大 capacity 個まで貯まるトークンバケット。
+    capacity を超える消費 (大きなバッチ) は残高をマイナスにして受け付け、その分だけ待つことで平均の送信ペースを rate に保ちます。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        """tokens 個を消費し、残高が足りなければマイナスになった分が補充されるまで (残高が0に戻るまで) 待ちます。"""
+        # ロックで順番待ちにし、先に来たリクエストから公平に送る
+        async with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
+
+
+def is_rate_limited(error):
+    """クォータ超過で拒否された (= サーバー側で処理されていない) エラーかどうかを判定します。"""
+    status = getattr(error, "status", None)
+    return status == 429 or (status == 403 and getattr(error, "reason", None) in ("rateLimitExceeded", "userRateLimitExceeded"))
+
+def is_retryable(error, idempotent=True):
+    """
+    再送すれば成功しうるエラーかどうかを判定します。
+    冪等でないリクエストは、処理済みかもしれない5xxや接続エラーでは再送しません。
+    """
+    if is_rate_limited(error):
+        return True
+    if not idempotent:
+        return False
+    status = getattr(error, "status", None)
+    if status is not None:
+        return status >= 500
+    # 接続エラー・切断・応答本文の途中での失敗やタイムアウト
+    return isinstance(error, (asyncio.TimeoutError, OSError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+class RequestScheduler:
+    """
+    Calendar APIへのリクエストを送り出す前に通す調整役。
+    - トークンバケットでプロジェクトのクォータを超えないように送信ペースを抑える
+    - 再送可能なエラーはジッター付き指数バックオフで再試行する
+    - 同じ内容の読み取りが同時に来たら、実行中の1回の結果を共有する (single-flight)
+    """
+
+    def __init__(self, rate=None, burst=None, max_retries=4, base_delay=0.5, max_delay=16.0, bucket=None):
+        # bucket を渡すと複数のスケジューラで1つのクォータを分け合う (渡さなければ rate / burst で専用のバケットを作る)
+        self._bucket = bucket or TokenBucket(rate, burst)
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._in_flight = {} # キー -> 実行中のタスク
+
+    def _backoff(self, attempt):
+        # Full Jitter: 0 〜 min(上限, 基本値 * 2^attempt) の一様乱数
+        return random.uniform(0, min(self._max_delay, self._base_delay * (2 ** attempt)))
+
+    async def run(self, call, cost=1, idempotent=True):
+        """
+        call (引数なしで呼ぶとコルーチンを返す関数) を実行します。
+        cost はクォータの消費量 (バッチなら件数)。idempotent=False の場合はクォータ超過のときだけ再試行します。
+        """
+        attempt = 0
+        while True:
+            await self._bucket.acquire(cost)
+            try:
+                return await call()
+            except Exception as error:
+                if attempt >= self._max_retries or not is_retryable(error, idempotent):
+                    raise
+                delay = self._backoff(attempt)
+                log.warning("Calendar APIの一時的なエラーのため再試行します", extra={"delay": round(delay, 3), "attempt": attempt + 1, "max_retries": self._max_retries, "error": str(error)})
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def run_shared(self, key, call, cost=1):
+        """
+        run() と同じですが、同じ key の呼び出しが実行中であればその結果を待って共有します。
+        結果は呼び出し元どうしで同じオブジェクトになるため、変更しない読み取りにだけ使ってください。
+        実行は呼び出し元とは別のタスクで1回だけ行うため、ある呼び出し元が時間切れ・キャンセルになっても他の呼び出し元には影響しません。
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self.run(call, cost=cost))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish_shared(key, done))
+        return await asyncio.shield(task)
+
+    def _finish_shared(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # 待ち手がいなくても「未取得の例外」警告を出さない
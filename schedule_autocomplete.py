@@ -0,0 +1,114 @@
+# schedule_autocomplete.py
+import asyncio
+import bisect
+import time
+import unicodedata
+
+from discord import app_commands
+
+import dates
+import google_calendar
+
+# 候補の値 (value) に付ける接頭辞。これで始まる値はイベントIDを表す
+EVENT_ID_PREFIX = "event-id:"
+# Discordが一度に表示できる候補の最大数
+MAX_CHOICES = 25
+# ミラーが使えないときにAPIから取得した一覧を使い回す秒数
+CACHE_TTL = 30
+# オートコンプリートは約3秒で打ち切られるため、API取得はこの秒数で諦める
+FETCH_TIMEOUT = 2.0
+
+_cache = {} # (カレンダー, 'YYYY-MM-DD') -> (有効期限, タイトル索引)
+
+
+def normalize_title(text):
+    """全角/半角・大文字/小文字・連続した空白の違いを吸収したタイトルを返します。"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+class TitleIndex:
+    """1日分のイベントを正規化タイトルで並べた索引。前方一致を二分探索で引きます。"""
+
+    def __init__(self, events):
+        self._entries = sorted(
+            ((normalize_title(event.get('summary')), event) for event in events),
+            key=lambda entry: entry[0],
+        )
+        self._keys = [key for key, _ in self._entries]
+
+    def search(self, query, limit=MAX_CHOICES):
+        """前方一致を先に、続けて部分一致のイベントを返します。"""
+        query = normalize_title(query)
+        if not query:
+            return [event for _, event in self._entries[:limit]]
+        matched = []
+        seen = set()
+        start = bisect.bisect_left(self._keys, query)
+        for key, event in self._entries[start:]:
+            if not key.startswith(query) or len(matched) >= limit:
+                break
+            matched.append(event)
+            seen.add(event['id'])
+        for key, event in self._entries:
+            if len(matched) >= limit:
+                break
+            if query in key and event['id'] not in seen:
+                matched.append(event)
+        return matched
+
+
+async def _index_for(date_str, calendar):
+    """指定日のタイトル索引を返します。ミラーが新しければそこから、なければTTL付きキャッシュかAPIから作ります。"""
+    if calendar.store.is_fresh():
+        return TitleIndex(calendar.store.events_on(date_str))
+
+    now = time.monotonic()
+    cache_key = (calendar.target, date_str)
+    cached = _cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    time_min, time_max = dates.day_bounds(date_str)
+    events, error_message = await asyncio.wait_for(google_calendar.list_events_in_range(time_min, time_max, calendar=calendar), FETCH_TIMEOUT)
+    if error_message:
+        return TitleIndex([])
+    index = TitleIndex(events)
+    _cache[cache_key] = (now + CACHE_TTL, index)
+    # 期限切れのエントリを掃除する
+    for key in [key for key, (expires, _) in _cache.items() if expires <= now]:
+        del _cache[key]
+    return index
+
+
+def _choice(event):
+    summary = event.get('summary') or 'タイトルなし'
+    value = f"{EVENT_ID_PREFIX}{event['id']}"
+    if len(value) > 100: # Discordの候補値は100文字まで
+        value = summary[:100]
+    return app_commands.Choice(name=summary[:100], value=value)
+
+
+async def schedule_choices(date_text, current, calendar):
+    """calendar の date_text の日付の予定から、current に一致する候補を返します。"""
+    if not date_text or calendar is None:
+        return []
+    try:
+        date_str = dates.format_date(date_text)
+    except dates.DateParseError:
+        return []
+    try:
+        index = await _index_for(date_str, calendar)
+    except asyncio.TimeoutError:
+        return []
+    return [_choice(event) for event in index.search(current)]
+
+
+async def resolve_schedule(date_str, value, calendar):
+    """
+    オートコンプリートで選ばれた値 (イベントID) または入力されたタイトルからイベントを特定します。
+    find_calendar_event と同じく (イベント情報, エラーメッセージ) を返します。
+    """
+    if value.startswith(EVENT_ID_PREFIX):
+        # 候補から選ばれた場合は検索を省略してIDで引く
+        return await google_calendar.get_calendar_event(value[len(EVENT_ID_PREFIX):], calendar=calendar)
+    return await google_calendar.find_calendar_event(date_str, value, calendar=calendar)
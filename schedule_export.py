@@ -0,0 +1,100 @@
+# schedule_export.py
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import calendar_worker
+import google_calendar
+from calendar_api import CalendarAPIError
+from event_store import event_span
+
+PRODID = "-//Sharedule//Discord Bot//JA"
+# iCalendarの1行の上限 (改行を除くオクテット数)
+_FOLD_LIMIT = 75
+
+
+def _escape_ics(value):
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+def _fold(line):
+    """75オクテットを超える行を折り返します。UTF-8の文字の途中では切りません。"""
+    data = line.encode("utf-8")
+    if len(data) <= _FOLD_LIMIT:
+        return data + b"\r\n"
+    chunks = []
+    limit = _FOLD_LIMIT
+    while data:
+        cut = min(limit, len(data))
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80: # 継続バイトで切らない
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+        limit = _FOLD_LIMIT - 1 # 2行目以降は先頭の空白の分だけ短くする
+    return b"\r\n ".join(chunks) + b"\r\n"
+
+def _utc(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def event_lines(event, stamp):
+    """イベント1件を VEVENT の行 (折り返し済みのバイト列) として返します。"""
+    start_dt, end_dt = event_span(event)
+    if 'date' in event.get('start', {}):
+        # 終日イベントの DTEND は翌日 (終了日を含まない) で表す
+        start_value = f"DTSTART;VALUE=DATE:{start_dt.strftime('%Y%m%d')}"
+        end_value = f"DTEND;VALUE=DATE:{end_dt.strftime('%Y%m%d')}"
+    else:
+        start_value = f"DTSTART:{_utc(start_dt)}"
+        end_value = f"DTEND:{_utc(end_dt)}"
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{event.get('iCalUID') or event['id'] + '@google.com'}",
+        f"DTSTAMP:{stamp}",
+        start_value,
+        end_value,
+        f"SUMMARY:{_escape_ics(event.get('summary', ''))}",
+    ]
+    if event.get('transparency') == 'transparent':
+        lines.append("TRANSP:TRANSPARENT")
+    if event.get('htmlLink'):
+        lines.append(f"URL:{event['htmlLink']}")
+    lines.append("END:VEVENT")
+    return b"".join(_fold(line) for line in lines)
+
+async def write_ics(pages, fp, calendar_name=None):
+    """
+    非同期のページイテレータ (イベントのリストを返す) を iCalendar 形式で fp (バイナリ) に書き出し、書いた件数を返します。
+    ページごとに書き出すため、期間全体のイベントを一度にメモリに持ちません。
+    """
+    stamp = _utc(datetime.now(timezone.utc))
+    header = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN"]
+    if calendar_name:
+        header.append(f"X-WR-CALNAME:{_escape_ics(calendar_name)}")
+    fp.write(b"".join(_fold(line) for line in header))
+    count = 0
+    async for page in pages:
+        for event in page:
+            if event.get('status') == 'cancelled':
+                continue
+            fp.write(event_lines(event, stamp))
+            count += 1
+    fp.write(_fold("END:VCALENDAR"))
+    return count
+
+@calendar_worker.offload(lambda message, *args, **kwargs: (None, message))
+async def export_to_file(time_min_str, time_max_str, calendar=None):
+    """
+    期間内の予定を一時ファイルに書き出し、(ファイルのパス, 件数) を返します。失敗した場合は (None, エラーメッセージ) です。
+    ワーカーモードで、取得と書き出しをワーカープロセスで行うために使います。ファイルは呼び出し側で削除してください。
+    """
+    pages = google_calendar.iter_event_pages(time_min_str, time_max_str, calendar=calendar)
+    with tempfile.NamedTemporaryFile(prefix="sharedule-", suffix=".ics", delete=False) as fp:
+        try:
+            count = await write_ics(pages, fp, calendar_name=calendar.calendar_id if calendar else None)
+        except (CalendarAPIError, RuntimeError) as error:
+            fp.close()
+            os.unlink(fp.name)
+            return None, str(error)
+    return fp.name, count
@@ -0,0 +1,132 @@
+# schedule_import.py
+import csv
+import io
+import re
+from datetime import datetime, timezone
+
+import dates
+from dates import JST
+
+# 1行の区切り: 改行または「;」 (スラッシュコマンドの入力欄は改行できないため)
+_LINE_SEPARATOR = re.compile(r"[\r\n;]+")
+
+
+class ImportRow:
+    """取り込み対象の1行。date_str が None の行は解析に失敗した行です。"""
+
+    def __init__(self, line_no, raw, date_str=None, schedule=None, error=None):
+        self.line_no = line_no
+        self.raw = raw
+        self.date_str = date_str
+        self.schedule = schedule
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _make_row(line_no, raw, date_text, schedule):
+    date_text = date_text.strip()
+    schedule = schedule.strip()
+    if not date_text or not schedule:
+        return ImportRow(line_no, raw, error="「日付 予定」の形式で入力してください。")
+    try:
+        return ImportRow(line_no, raw, dates.format_date(date_text), schedule)
+    except dates.DateParseError:
+        return ImportRow(line_no, raw, error=f"日付 '{date_text}' を解析できません。")
+
+
+def parse_lines(text):
+    """「日付 予定」形式の複数行テキストを解析します。"""
+    rows = []
+    for line_no, line in enumerate(_LINE_SEPARATOR.split(text), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        date_text, _, schedule = line.partition(" ")
+        if not schedule:
+            date_text, _, schedule = line.partition("　") # 全角スペース区切りも許可
+        rows.append(_make_row(line_no, line, date_text, schedule))
+    return rows
+
+def parse_csv(data):
+    """「日付,予定」形式のCSVを解析します。日付として解釈できない1行目はヘッダとして読み飛ばします。"""
+    text = data.decode("utf-8-sig")
+    rows = []
+    for line_no, record in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not record or not any(cell.strip() for cell in record):
+            continue
+        raw = ",".join(record)
+        if len(record) < 2:
+            rows.append(ImportRow(line_no, raw, error="「日付,予定」の2列が必要です。"))
+            continue
+        row = _make_row(line_no, raw, record[0], ",".join(record[1:]))
+        if line_no == 1 and not row.ok:
+            continue # ヘッダ行
+        rows.append(row)
+    return rows
+
+def _unfold_ics(text):
+    """iCalendarの折り返し行 (先頭が空白の行) を結合します。"""
+    lines = []
+    for line in text.splitlines():
+        if line[:1] in (" ", "\t") and lines:
+            lines[-1] += line[1:]
+        else:
+            lines.append(line)
+    return lines
+
+# TEXT 値のエスケープ (バックスラッシュの後の1文字) と元の文字の対応
+_ICS_ESCAPES = {"n": "\n", "N": "\n", ",": ",", ";": ";", "\\": "\\"}
+_ICS_ESCAPE = re.compile(r"\\(.)")
+
+def _unescape_ics(value):
+    # 1回の置換で左から処理し、エスケープされたバックスラッシュの後の n を改行と取り違えないようにする
+    return _ICS_ESCAPE.sub(lambda match: _ICS_ESCAPES.get(match.group(1), match.group(0)), value)
+
+def _ics_date(value):
+    """DTSTARTの値 (20261020 / 20261020T100000 / 20261020T010000Z) をJSTの日付に変換します。"""
+    if "T" not in value:
+        return datetime.strptime(value[:8], "%Y%m%d").strftime("%Y-%m-%d")
+    date_obj = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        date_obj = date_obj.replace(tzinfo=timezone.utc).astimezone(JST)
+    return date_obj.strftime("%Y-%m-%d")
+
+def parse_ics(data):
+    """iCalendar (.ics) のVEVENTを解析します。"""
+    rows = []
+    event = None
+    for line_no, line in enumerate(_unfold_ics(data.decode("utf-8-sig")), start=1):
+        if line == "BEGIN:VEVENT":
+            event = {"line_no": line_no}
+            continue
+        if event is None:
+            continue
+        if line == "END:VEVENT":
+            summary = event.get("SUMMARY", "")
+            raw = f"{event.get('DTSTART', '')} {summary}".strip()
+            if "DTSTART" not in event or not summary:
+                rows.append(ImportRow(event["line_no"], raw, error="DTSTARTまたはSUMMARYがありません。"))
+            else:
+                try:
+                    rows.append(ImportRow(event["line_no"], raw, _ics_date(event["DTSTART"]), summary))
+                except ValueError:
+                    rows.append(ImportRow(event["line_no"], raw, error=f"DTSTART '{event['DTSTART']}' を解析できません。"))
+            event = None
+            continue
+        name, _, value = line.partition(":")
+        name = name.split(";", 1)[0].upper() # DTSTART;VALUE=DATE などのパラメータは無視
+        if name in ("DTSTART", "SUMMARY"):
+            event[name] = _unescape_ics(value) if name == "SUMMARY" else value.strip()
+    return rows
+
+def parse_attachment(filename, data):
+    """添付ファイルの拡張子に応じて解析します。"""
+    lowered = filename.lower()
+    if lowered.endswith(".ics"):
+        return parse_ics(data)
+    if lowered.endswith(".csv"):
+        return parse_csv(data)
+    return parse_lines(data.decode("utf-8-sig"))
@@ -0,0 +1,18 @@
+import unittest
+
+import config
+
+
+class ParseConfigTest(unittest.TestCase):
+
+    def test_users_with_the_same_name_are_all_allowed(self):
+        snapshot = config.parse_config({"allowed_users": [{"name": "taro", "id": "1"}, {"name": "taro", "id": "2"}, {"id": "3"}]})
+        self.assertEqual(snapshot.allowed_user_ids, frozenset({1, 2, 3}))
+
+    def test_user_without_id_is_rejected(self):
+        with self.assertRaises(ValueError):
+            config.parse_config({"allowed_users": [{"name": "taro"}]})
+
+
+if __name__ == "__main__":
+    unittest.main()
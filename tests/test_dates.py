@@ -0,0 +1,80 @@
+import unittest
+from datetime import date
+
+import dates
+from dates import DateParseError
+
+TODAY = date(2026, 10, 14) # 水曜日
+
+
+class ParseDateTest(unittest.TestCase):
+
+    def assertParses(self, text, expected):
+        self.assertEqual(dates.parse_date(text, TODAY), expected, text)
+
+    def test_full_dates(self):
+        for text in ("2026/10/20", "2026-10-20", "2026.10.20", "2026年10月20日", "２０２６／１０／２０", "20261020"):
+            self.assertParses(text, date(2026, 10, 20))
+
+    def test_iso_datetime(self):
+        self.assertParses("2026-10-20T10:00:00+09:00", date(2026, 10, 20))
+        self.assertParses("2026-10-20T01:00:00Z", date(2026, 10, 20))
+
+    def test_month_day_uses_this_year(self):
+        for text in ("10/20", "10-20", "10月20日", "１０／２０"):
+            self.assertParses(text, date(2026, 10, 20))
+
+    def test_relative_days(self):
+        self.assertParses("今日", TODAY)
+        self.assertParses("TODAY", TODAY)
+        self.assertParses("明日", date(2026, 10, 15))
+        self.assertParses("あさって", date(2026, 10, 16))
+        self.assertParses("昨日", date(2026, 10, 13))
+
+    def test_weekdays(self):
+        self.assertParses("水曜", TODAY) # 今日以降で最初の水曜日
+        self.assertParses("金曜日", date(2026, 10, 16))
+        self.assertParses("月曜", date(2026, 10, 19))
+        self.assertParses("今週の月曜", date(2026, 10, 12))
+        self.assertParses("来週月曜", date(2026, 10, 19))
+        self.assertParses("再来週の金曜日", date(2026, 10, 30))
+
+    def test_dateutil_fallback(self):
+        self.assertParses("Oct 20 2026", date(2026, 10, 20))
+
+    def test_rejected_inputs(self):
+        for text in ("", "   ", "2026/02/30", "2026/13/01", "10/32", "あいうえお", "来週"):
+            with self.assertRaises(DateParseError, msg=text):
+                dates.parse_date(text, TODAY)
+
+    def test_format_date(self):
+        self.assertEqual(dates.format_date("10/20", TODAY), "2026-10-20")
+
+
+class ParseMonthTest(unittest.TestCase):
+
+    def test_month_inputs(self):
+        self.assertEqual(dates.parse_month("2026/11", TODAY), date(2026, 11, 1))
+        self.assertEqual(dates.parse_month("2026年11月", TODAY), date(2026, 11, 1))
+        self.assertEqual(dates.parse_month("11月", TODAY), date(2026, 11, 1))
+        self.assertEqual(dates.parse_month("今月", TODAY), date(2026, 10, 1))
+        self.assertEqual(dates.parse_month("来月", date(2026, 12, 5)), date(2027, 1, 1))
+        self.assertEqual(dates.parse_month("先月", date(2026, 1, 5)), date(2025, 12, 1))
+
+    def test_rejected_month(self):
+        with self.assertRaises(DateParseError):
+            dates.parse_month("2026/13", TODAY)
+
+
+class BoundsTest(unittest.TestCase):
+
+    def test_day_bounds(self):
+        self.assertEqual(dates.day_bounds("2026-10-20"), ("2026-10-20T00:00:00+09:00", "2026-10-21T00:00:00+09:00"))
+
+    def test_next_month(self):
+        self.assertEqual(dates.next_month(date(2026, 1, 31)), date(2026, 2, 1))
+        self.assertEqual(dates.next_month(date(2026, 12, 15)), date(2027, 1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from datetime import date, datetime
+
+import recurrence
+from dates import JST
+
+
+def window(start, end):
+    """start〜end (date、end を含まない) のJSTの範囲を返します。"""
+    return datetime(start.year, start.month, start.day, tzinfo=JST), datetime(end.year, end.month, end.day, tzinfo=JST)
+
+def all_day_master(event_id, day, rules):
+    return {
+        'id': event_id,
+        'summary': '定例',
+        'start': {'date': day},
+        'end': {'date': day},
+        'etag': '"1"',
+        'recurrence': rules,
+    }
+
+def start_dates(events):
+    return [event['start'].get('date') or event['start'].get('dateTime') for event in events]
+
+
+class RecurrenceRuleTest(unittest.TestCase):
+
+    def test_rules_from_add_options(self):
+        self.assertEqual(recurrence.recurrence_rule("weekly", until=date(2026, 12, 31)), ["RRULE:FREQ=WEEKLY;UNTIL=20261231"])
+        self.assertEqual(recurrence.recurrence_rule("monthly", count=3), ["RRULE:FREQ=MONTHLY;COUNT=3"])
+
+
+class ExpandTest(unittest.TestCase):
+
+    def test_weekly_until_includes_the_last_day(self):
+        master = all_day_master("w", "2026-10-01", recurrence.recurrence_rule("weekly", until=date(2026, 10, 22)))
+        events = recurrence.expand([master], *window(date(2026, 9, 1), date(2026, 12, 1)))
+        self.assertEqual(start_dates(events), ["2026-10-01", "2026-10-08", "2026-10-15", "2026-10-22"])
+        self.assertEqual([event['id'] for event in events][:2], ["w_20261001", "w_20261008"])
+        for event in events:
+            self.assertEqual(event['recurringEventId'], "w")
+            self.assertNotIn('etag', event) # 元の予定の etag で1回分を変更すると 412 になる
+            self.assertNotIn('recurrence', event)
+
+    def test_weekly_only_returns_occurrences_in_range(self):
+        master = all_day_master("w", "2026-10-01", ["RRULE:FREQ=WEEKLY"])
+        events = recurrence.expand([master], *window(date(2026, 10, 10), date(2026, 10, 23)))
+        self.assertEqual(start_dates(events), ["2026-10-15", "2026-10-22"])
+
+    def test_monthly_count_on_the_31st_skips_short_months(self):
+        master = all_day_master("m", "2026-01-31", recurrence.recurrence_rule("monthly", count=3))
+        events = recurrence.expand([master], *window(date(2026, 1, 1), date(2027, 1, 1)))
+        self.assertEqual(start_dates(events), ["2026-01-31", "2026-03-31", "2026-05-31"])
+
+    def test_modified_and_cancelled_exceptions_replace_occurrences(self):
+        master = all_day_master("w", "2026-10-01", ["RRULE:FREQ=WEEKLY;COUNT=4"])
+        modified = {
+            'id': "w_20261008",
+            'summary': '定例 (変更)',
+            'recurringEventId': "w",
+            'originalStartTime': {'date': "2026-10-08"},
+            'start': {'date': "2026-10-09"},
+            'end': {'date': "2026-10-09"},
+        }
+        cancelled = recurrence.cancelled_instance("w_20261015", "w", "20261015")
+        events = recurrence.expand([master, modified, cancelled], *window(date(2026, 9, 1), date(2026, 12, 1)))
+        self.assertEqual(start_dates(events), ["2026-10-01", "2026-10-09", "2026-10-22"])
+        self.assertEqual(events[1]['summary'], '定例 (変更)')
+
+    def test_cancelled_master_is_not_expanded(self):
+        master = dict(all_day_master("w", "2026-10-01", ["RRULE:FREQ=WEEKLY"]), status='cancelled')
+        single = {'id': "s", 'summary': '単発', 'start': {'date': "2026-10-02"}, 'end': {'date': "2026-10-02"}}
+        events = recurrence.expand([master, single], *window(date(2026, 10, 1), date(2026, 11, 1)))
+        self.assertEqual([event['id'] for event in events], ["s"])
+
+    def test_timed_weekly_keeps_local_time_across_dst(self):
+        master = {
+            'id': "t",
+            'summary': '会議',
+            'start': {'dateTime': "2026-10-19T10:00:00-04:00", 'timeZone': "America/New_York"},
+            'end': {'dateTime': "2026-10-19T11:00:00-04:00", 'timeZone': "America/New_York"},
+            'recurrence': ["RRULE:FREQ=WEEKLY;COUNT=3"],
+        }
+        events = recurrence.expand([master], *window(date(2026, 10, 1), date(2026, 12, 1)))
+        # 11月1日に夏時間が終わっても現地の10時のまま
+        self.assertEqual(start_dates(events), ["2026-10-19T10:00:00-04:00", "2026-10-26T10:00:00-04:00", "2026-11-02T10:00:00-05:00"])
+        self.assertEqual(events[2]['id'], "t_20261102T150000Z")
+
+
+class InstanceIdTest(unittest.TestCase):
+
+    def test_split_instance_id(self):
+        self.assertEqual(recurrence.split_instance_id("abc_20261008"), ("abc", "20261008"))
+        self.assertEqual(recurrence.split_instance_id("abc_20261102T150000Z"), ("abc", "20261102T150000Z"))
+        self.assertIsNone(recurrence.split_instance_id("abcdef"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import request_scheduler
+from request_scheduler import RequestScheduler, TokenBucket
+
+
+class FakeClock:
+    """time.monotonic と asyncio.sleep の代わりに使う、sleep した分だけ進む時計。"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patches = [
+            mock.patch.object(request_scheduler.time, "monotonic", self.clock.monotonic),
+            mock.patch.object(request_scheduler.asyncio, "sleep", self.clock.sleep),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_batch_larger_than_capacity_is_paced_at_rate(self):
+        async def scenario():
+            bucket = TokenBucket(rate=5, capacity=10)
+            for _ in range(4):
+                await bucket.acquire(200)
+        asyncio.run(scenario())
+        # 最初の10個分はバースト、残りの790個は毎秒5個のペース
+        self.assertAlmostEqual(self.clock.now, (800 - 10) / 5)
+
+    def test_debt_delays_the_next_request(self):
+        async def scenario():
+            bucket = TokenBucket(rate=5, capacity=10)
+            await bucket.acquire(20)
+            after_batch = self.clock.now
+            await bucket.acquire(1)
+            return after_batch
+        after_batch = asyncio.run(scenario())
+        self.assertAlmostEqual(after_batch, 2.0)
+        self.assertAlmostEqual(self.clock.now, 2.2)
+
+    def test_requests_within_capacity_do_not_wait(self):
+        async def scenario():
+            bucket = TokenBucket(rate=5, capacity=10)
+            for _ in range(10):
+                await bucket.acquire(1)
+        asyncio.run(scenario())
+        self.assertEqual(self.clock.now, 0.0)
+
+    def test_schedulers_sharing_a_bucket_share_the_rate(self):
+        async def call():
+            return None
+
+        async def scenario():
+            bucket = TokenBucket(rate=5, capacity=10)
+            first = RequestScheduler(bucket=bucket)
+            second = RequestScheduler(bucket=bucket)
+            for _ in range(10):
+                await first.run(call)
+                await second.run(call)
+        asyncio.run(scenario())
+        # 2つのスケジューラで合わせて20件なので、バーストの10件を超えた10件分は毎秒5件のペースになる
+        self.assertAlmostEqual(self.clock.now, 2.0)
+
+
+class RunSharedTest(unittest.TestCase):
+
+    def test_cancelled_leader_does_not_cancel_followers(self):
+        async def scenario():
+            scheduler = RequestScheduler(rate=100, burst=100)
+            release = asyncio.Event()
+            calls = []
+
+            async def call():
+                calls.append(1)
+                await release.wait()
+                return {"items": []}
+
+            leader = asyncio.create_task(scheduler.run_shared("key", call))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(scheduler.run_shared("key", call))
+            await asyncio.sleep(0)
+            leader.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            result = await follower
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return result, len(calls)
+        result, calls = asyncio.run(scenario())
+        self.assertEqual(result, {"items": []})
+        self.assertEqual(calls, 1)
+
+    def test_leader_timeout_does_not_fail_followers(self):
+        async def scenario():
+            scheduler = RequestScheduler(rate=100, burst=100)
+
+            async def call():
+                await asyncio.sleep(0.05)
+                return "done"
+
+            leader = asyncio.create_task(asyncio.wait_for(scheduler.run_shared("key", call), 0.01))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(scheduler.run_shared("key", call))
+            with self.assertRaises(asyncio.TimeoutError):
+                await leader
+            return await follower
+        self.assertEqual(asyncio.run(scenario()), "done")
+
+    def test_key_is_released_after_completion(self):
+        async def scenario():
+            scheduler = RequestScheduler(rate=100, burst=100)
+            calls = []
+
+            async def call():
+                calls.append(1)
+                return len(calls)
+
+            first = await scheduler.run_shared("key", call)
+            second = await scheduler.run_shared("key", call)
+            return first, second
+        self.assertEqual(asyncio.run(scenario()), (1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
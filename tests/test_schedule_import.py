@@ -0,0 +1,19 @@
+import unittest
+
+import schedule_import
+
+
+class UnescapeIcsTest(unittest.TestCase):
+
+    def test_escaped_backslash_before_n_is_not_a_newline(self):
+        self.assertEqual(schedule_import._unescape_ics("a\\\\nb"), "a\\nb")
+
+    def test_text_escapes(self):
+        self.assertEqual(schedule_import._unescape_ics("x\\, y\\; z\\nw\\Nv"), "x, y; z\nw\nv")
+
+    def test_unknown_escape_is_kept(self):
+        self.assertEqual(schedule_import._unescape_ics("a\\tb"), "a\\tb")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,328 @@
+# write_queue.py
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import aiohttp
+import discord
+
+import calendar_worker
+import calendars
+import config
+import google_calendar
+import instrumentation
+import notifications
+from calendar_api import CalendarAPIError, EVENT_FIELDS
+from request_scheduler import is_retryable
+
+# 一時的なエラーで再送する最大回数 (超えたら失敗として報告する)
+MAX_ATTEMPTS = 20
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+# 完了・失敗した記録を残しておく日数
+RETENTION_DAYS = 7
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+# apply_mutation の結果のうち、一時的なエラーのためあとで同じ操作を再送することを表すもの (ジャーナルには記録しない)
+RETRY = "retry"
+
+log = instrumentation.get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mutations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    calendar_id TEXT NOT NULL,
+    credentials_path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    reply TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mutations_pending ON mutations (status, calendar_id, credentials_path, id);
+"""
+
+
+class Journal:
+    """
+    書き込み操作を記録するSQLite (WAL) のジャーナル。
+    メソッドはブロッキングなので、イベントループからはスレッドプール経由で呼びます。
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL") # 受け付けたと返した操作は電源断でも失わない
+        self._conn.executescript(_SCHEMA)
+
+    def append(self, target, kind, payload, reply):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO mutations (calendar_id, credentials_path, kind, payload, reply, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (target.calendar_id, target.credentials_path, kind, json.dumps(payload, ensure_ascii=False), json.dumps(reply), now, now),
+            )
+            return cursor.lastrowid
+
+    def pending(self, target, limit=50):
+        """target の未処理の操作を記録順に返します。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM mutations WHERE status = ? AND calendar_id = ? AND credentials_path = ? ORDER BY id LIMIT ?",
+                (PENDING, target.calendar_id, target.credentials_path, limit),
+            ).fetchall()
+        return [dict(row, payload=json.loads(row["payload"]), reply=json.loads(row["reply"])) for row in rows]
+
+    def pending_targets(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT calendar_id, credentials_path FROM mutations WHERE status = ?", (PENDING,)).fetchall()
+        return [config.CalendarTarget(row["calendar_id"], row["credentials_path"]) for row in rows]
+
+    def set_reply(self, entry_id, reply):
+        with self._lock:
+            self._conn.execute("UPDATE mutations SET reply = ? WHERE id = ?", (json.dumps(reply), entry_id))
+
+    def record_attempt(self, entry_id, attempts):
+        with self._lock:
+            self._conn.execute("UPDATE mutations SET attempts = ?, updated_at = ? WHERE id = ?", (attempts, time.time(), entry_id))
+
+    def finish(self, entry_id, status, result):
+        with self._lock:
+            self._conn.execute("UPDATE mutations SET status = ?, result = ?, updated_at = ? WHERE id = ?", (status, result, time.time(), entry_id))
+
+    def prune(self, older_than):
+        with self._lock:
+            self._conn.execute("DELETE FROM mutations WHERE status != ? AND updated_at < ?", (PENDING, older_than))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WriteQueue:
+    """
+    予定の追加・変更・削除を先にジャーナルへ記録して、すぐに「受け付けました」と応答し、
+    バックグラウンドでカレンダーごとに記録順に反映するキュー。
+    追加はクライアント側で決めたイベントIDで行うため、再送や再起動後の再実行でも予定は重複しません。
+    完了すると、受け付け時に送ったフォローアップメッセージを結果 (リンク) に書き換えます。
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._journal = None
+        self._client = None
+        self._workers = {} # CalendarTarget -> ワーカーのタスク
+        self._wakeups = {} # CalendarTarget -> asyncio.Event
+        self._live = {} # 記録ID -> (interaction.followup, チャンネル) (同じプロセスで受け付けた操作だけ)
+        self._submitting = set() # 記録済みで、受け付けメッセージの送信がまだ終わっていない記録ID
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def start(self, client=None):
+        """ジャーナルを開き、前回の実行で残った未処理の操作の再実行を始めます。"""
+        if self._journal is not None:
+            return
+        self._client = client
+        self._journal = await self._run(Journal, self._path)
+        await self._run(self._journal.prune, time.time() - RETENTION_DAYS * 86400)
+        targets = await self._run(self._journal.pending_targets)
+        for target in targets:
+            self._wake(target)
+        if targets:
+            log.info("未処理の書き込みを再実行します", extra={"calendars": len(targets)})
+
+    async def stop(self):
+        for task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+        self._wakeups.clear()
+        if self._journal is not None:
+            await self._run(self._journal.close)
+            self._journal = None
+
+    async def submit(self, interaction, calendar, kind, payload, pending_message):
+        """
+        操作をジャーナルに記録し、pending_message をフォローアップとして送って受け付けを知らせます。
+        payload["messages"] には完了時 ("done", {link} がリンクに置き換わる) と失敗時 ("failed") の文面を入れます。
+        """
+        reply = {
+            "application_id": interaction.application_id,
+            "token": interaction.token,
+            "message_id": None,
+            "channel_id": interaction.channel_id,
+            "guild_id": interaction.guild_id, # ペアリング通知の送信先 (サーバーのWebhook) を決めるために使う
+        }
+        # 先に記録してから応答する (応答した後にプロセスが落ちても操作は失われない)
+        entry_id = await self._run(self._journal.append, calendar.target, kind, payload, reply)
+        self._submitting.add(entry_id)
+        try:
+            message = await interaction.followup.send(pending_message, wait=True)
+            reply["message_id"] = getattr(message, "id", None)
+            await self._run(self._journal.set_reply, entry_id, reply)
+            self._live[entry_id] = (interaction.followup, interaction.channel)
+        finally:
+            self._submitting.discard(entry_id)
+            self._wake(calendar.target)
+        return entry_id
+
+    def _wake(self, target):
+        wakeup = self._wakeups.get(target)
+        if wakeup is None:
+            wakeup = self._wakeups[target] = asyncio.Event()
+            self._workers[target] = asyncio.create_task(self._worker(target, wakeup))
+        wakeup.set()
+
+    async def _worker(self, target, wakeup):
+        """1つのカレンダーの操作を記録順に反映します。一時的なエラーの間は先に進まず、順序を保ちます。"""
+        calendar = calendars.get_calendar(target)
+        while True:
+            wakeup.clear()
+            entries = await self._run(self._journal.pending, target)
+            if not entries:
+                await wakeup.wait()
+                continue
+            for entry in entries:
+                if entry["id"] in self._submitting:
+                    await wakeup.wait() # 受け付けメッセージの送信が終われば submit() が起こしてくれる
+                    break
+                status, result = await apply_mutation(entry["kind"], entry["payload"], calendar=calendar)
+                if status == RETRY:
+                    attempts = entry["attempts"] + 1
+                    if attempts < MAX_ATTEMPTS:
+                        await self._run(self._journal.record_attempt, entry["id"], attempts)
+                        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempts))
+                        log.warning("書き込みを再送します", extra={"entry_id": entry["id"], "attempt": attempts, "delay": round(delay, 3), "error": result})
+                        await asyncio.sleep(delay)
+                        break
+                    status = FAILED
+                await self._finish(entry, status, result)
+
+    async def _finish(self, entry, status, result):
+        await self._run(self._journal.finish, entry["id"], status, result)
+        messages = entry["payload"].get("messages", {})
+        if status == DONE:
+            content = messages.get("done", "✅ 完了しました。").replace("{link}", result or "")
+        else:
+            content = f"{messages.get('failed', '❌ 失敗しました: ')}{result}"
+        followup, channel = self._live.pop(entry["id"], (None, None))
+        channel = channel or self._get_channel(entry["reply"]["channel_id"])
+        try:
+            await self._report(entry["reply"], followup, channel, content)
+        except Exception:
+            log.exception("書き込みの結果を送信できませんでした", extra={"entry_id": entry["id"]})
+        notify = entry["payload"].get("notify")
+        if status == DONE and notify:
+            notifications.notify_partner(notify["partner_id"], notify["actor"], notify["text"], notify["line"],
+                                         channel=channel, guild_id=entry["reply"].get("guild_id"))
+
+    def _get_channel(self, channel_id):
+        if self._client is None or channel_id is None:
+            return None
+        return self._client.get_channel(channel_id)
+
+    async def _report(self, reply, followup, channel, content):
+        """受け付け時のメッセージを結果に書き換えます。できなければ (トークンの期限切れなど) チャンネルに送ります。"""
+        try:
+            if followup is None and self._client is not None:
+                # 再起動後はトークンからフォローアップ用のWebhookを作り直す (トークンの有効期限は15分)
+                followup = discord.Webhook.from_url(
+                    f"https://discord.com/api/webhooks/{reply['application_id']}/{reply['token']}", client=self._client)
+            if followup is not None and reply.get("message_id") is not None:
+                await followup.edit_message(reply["message_id"], content=content)
+                return
+        except discord.HTTPException as error:
+            log.info("受け付けメッセージを書き換えられないためチャンネルに送信します", extra={"error": str(error)})
+        if channel is not None:
+            await channel.send(content)
+
+
+async def _insert(calendar, payload):
+    body = payload["body"]
+    try:
+        event = await calendar.api.insert_event(body, params={'fields': EVENT_FIELDS})
+    except CalendarAPIError as error:
+        if error.status != 409:
+            raise
+        # 前回の送信が実は成功していた (同じIDの予定がすでにある)
+        event = await calendar.api.get_event(body['id'], params={'fields': EVENT_FIELDS})
+    calendar.store.apply(event)
+    return event.get('htmlLink')
+
+async def _update(calendar, payload):
+    headers = {'If-Match': payload['etag']} if payload.get('etag') else None
+    try:
+        event = await calendar.api.patch_event(payload['event_id'], payload['body'], params={'fields': EVENT_FIELDS}, headers=headers)
+    except CalendarAPIError as error:
+        if error.status != 412:
+            raise
+        # 前回の送信が成功して etag が変わっただけなら完了として扱う
+        event = await calendar.api.get_event(payload['event_id'], params={'fields': EVENT_FIELDS})
+        if any(event.get(key) != value for key, value in payload['body'].items()):
+            raise
+    calendar.store.apply(event)
+    return event.get('htmlLink')
+
+async def _delete(calendar, payload):
+    headers = {'If-Match': payload['etag']} if payload.get('etag') else None
+    try:
+        await calendar.api.delete_event(payload['event_id'], headers=headers)
+    except CalendarAPIError as error:
+        if error.status not in (404, 410): # すでに削除済みなら完了として扱う
+            raise
+    calendar.store.remove(payload['event_id'])
+    return None
+
+@calendar_worker.offload(lambda message, *args, **kwargs: (RETRY, message), mutation=True)
+async def apply_mutation(kind, payload, calendar=None):
+    """
+    記録した操作を1件反映し、(DONE, 予定のリンク)・(RETRY, エラー)・(FAILED, エラー) のいずれかを返します。
+    ワーカーモードではカレンダーを担当するワーカーで実行するため、反映した予定はそのワーカーのミラーに書き込まれます。
+    ワーカーが途中で停止した場合は反映されたか分からないので再送に回します (どの操作も冪等なので二重には反映されません)。
+    """
+    try:
+        apply = {"add": _insert, "edit": _update, "delete": _delete}[kind]
+        return DONE, await apply(calendar, payload)
+    except CalendarAPIError as error:
+        # 冪等な操作なので、一時的なエラーは書き込みでも再送してよい
+        if is_retryable(error, idempotent=True):
+            return RETRY, str(error)
+        return FAILED, google_calendar.CONFLICT_MESSAGE if error.status == 412 else str(error)
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+        return RETRY, str(error)
+    except Exception as error:
+        log.exception("書き込みの反映中に予期しないエラーが発生しました", extra={"kind": kind})
+        return FAILED, str(error)
+
+
+def notify_payload(partner_id, actor, text, line):
+    """反映後に送るペアリング通知の内容を返します。相手がいなければ None を返します。"""
+    if partner_id is None or not text:
+        return None
+    return {"partner_id": partner_id, "actor": actor, "text": text, "line": line}
+
+
+_queue = None
+
+def get_queue():
+    """共有の書き込みキューを返します。"""
+    global _queue
+    if _queue is None:
+        _queue = WriteQueue(config.WRITE_QUEUE_PATH)
+    return _queue
+
+def enabled():
+    """書き込みキューを使う設定 (DURABLE_WRITES) になっていれば True を返します。"""
+    return config.DURABLE_WRITES